@@ -1,9 +1,15 @@
+import copy
 import json
 import logging
-import asyncio
 from google import genai
 from google.genai import types
 from constants import GEMINI_MODELS
+import rate_limits
+import metrics
+import single_flight
+
+# Сколько готовы ждать токен модели; если дольше — переходим к следующей модели
+MODEL_MAX_WAIT = 15
 
 class AIContentGenerator:
     def __init__(self, api_key):
@@ -26,6 +32,29 @@ class AIContentGenerator:
             "문구 (Фразы)", "문법 (Грамматика)"
         ]
 
+        # Одно и то же слово из нескольких заявок одновременно отправляется в Gemini один раз
+        self.flights = single_flight.group('gemini')
+
+    async def generate_content(self, model_name, contents):
+        """Вызов Gemini с учетом лимитов частоты провайдера и модели.
+
+        На 429 модель ставится на паузу (retryDelay из ответа) и вызов один раз
+        повторяется на той же модели, если пауза короткая. Исключение означает,
+        что пора переходить к следующей модели.
+        """
+        for attempt in range(2):
+            if not await rate_limits.acquire('gemini', model=model_name, max_wait=MODEL_MAX_WAIT):
+                raise RuntimeError(f"429 Rate limit: {model_name} недоступна дольше {MODEL_MAX_WAIT} сек")
+            try:
+                with metrics.span('gemini', model=model_name):
+                    return await self.client.aio.models.generate_content(model=model_name, contents=contents)
+            except Exception as e:
+                if not rate_limits.is_rate_limited(e):
+                    raise
+                rate_limits.penalize('gemini', rate_limits.retry_delay(e), model=model_name)
+                if attempt > 0:
+                    raise
+
     def _build_prompt(self, word_kr):
         return f"""You are an expert Korean language teacher for Russian speakers.
 Analyze the following Korean word: '{word_kr}' for use in TOPIK II exam preparation. The response should be in Russian. Also find frequency of use for this word (high, medium, low), and approximately to which TOPIK level this word corresponds (TOPIK I, TOPIK II level 3, TOPIK II level 4, TOPIK II level 5, TOPIK II level 6). Always explain Hanja component if it is available.
@@ -74,6 +103,11 @@ Input: '{word_kr}'
         Генерирует данные о слове через Gemini API.
         Возвращает кортеж: (список_данных, сообщение_об_ошибке)
         """
+        items, error = await self.flights.do(word_kr, lambda: self._generate_word_data(word_kr))
+        # Результат общий для всех ожидавших — каждому своя копия, чтобы правки не пересекались
+        return copy.deepcopy(items), error
+
+    async def _generate_word_data(self, word_kr):
         if not self.client:
             return [], "Missing Gemini API Key"
 
@@ -86,11 +120,8 @@ Input: '{word_kr}'
 
         for model_name in models_to_try:
             try:
-                # Асинхронный вызов через aio
-                response = await self.client.aio.models.generate_content(
-                    model=model_name,
-                    contents=prompt
-                )
+                # Асинхронный вызов через aio (с лимитом частоты)
+                response = await self.generate_content(model_name, prompt)
                 text = response.text.strip()
                 
                 # Очистка от markdown форматирования
@@ -127,10 +158,9 @@ Input: '{word_kr}'
                 return items, None
 
             except Exception as e:
-                if "429" in str(e):
+                if rate_limits.is_rate_limited(e):
                     logging.warning(f"⚠️ Quota exceeded for {model_name}. Trying next...")
                     last_error = "Quota Exceeded"
-                    await asyncio.sleep(1)
                     continue
                 logging.warning(f"⚠️ Error with {model_name}: {e}")
                 last_error = str(e)
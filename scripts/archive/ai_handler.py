@@ -5,20 +5,29 @@ import aiohttp
 from app_utils import delete_old_file, execute_supabase_query # type: ignore
 from constants import DB_TABLES, DB_BUCKETS, WORD_REQUEST_STATUS, GEMINI_MODELS
 from ai_generator import AIContentGenerator
+from limiters import limit
+import rate_limits
+import metrics
 
 class AIHandler:
     """Класс для управления AI генерацией (текст и изображения)"""
-    def __init__(self, supabase_client, ai_generator: AIContentGenerator, sb_url, sb_key):
-        self.supabase = supabase_client
+    def __init__(self, supabase_client, ai_generator: AIContentGenerator, sb_url, sb_key, http_pool=None):
+        self.supabase = supabase_client # Storage (синхронный клиент)
+        self.db = supabase_client # Запросы к таблицам (может быть заменен на async клиент)
         self.ai_gen = ai_generator
         self.sb_url = sb_url
         self.sb_key = sb_key
         self.has_grammar_info = True
         self.models_to_try = GEMINI_MODELS
+        self.http_pool = http_pool # Общая aiohttp-сессия воркера (HttpPool)
 
     def set_grammar_info_status(self, status: bool):
         self.has_grammar_info = status
 
+    def set_db_client(self, db_client):
+        """Переключает запросы к таблицам на другой клиент (например, async)."""
+        self.db = db_client
+
     async def handle_image(self, session, row, translation, word_hash, force_images):
         """Обработка изображения через Edge Function (Auto Mode)"""
         current_image = row.get('image')
@@ -48,21 +57,33 @@ class AIHandler:
                 "translation": row.get('translation')
             }
             
-            async with session.post(function_url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    logging.info(f"✅ Image (Edge Auto): {translation} -> {data.get('source')}")
-                    
-                    # Удаляем старое изображение, если оно было
-                    if current_image and current_image != data.get('finalUrl'):
-                        await delete_old_file(self.supabase, DB_BUCKETS['IMAGES'], current_image)
-                        
-                    return {}
-                else:
-                    if resp.status != 404:
-                        text = await resp.text()
-                        logging.warning(f"⚠️ Edge Function Error: {resp.status} - {text}")
-                    return {}
+            await rate_limits.acquire('edge_image')
+            async with limit('edge_image') as slot:
+                with metrics.span('edge_image') as sp:
+                    async with session.post(function_url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as resp:
+                        status = resp.status
+                        sp.attrs['status'] = status
+                        if status == 200:
+                            data = await resp.json()
+                        else:
+                            text = await resp.text()
+                            if status == 429 or status >= 500:
+                                slot.fail() # Перегрузка функции — снижаем лимит
+                            if status == 429:
+                                rate_limits.penalize('edge_image')
+
+            if status == 200:
+                logging.info(f"✅ Image (Edge Auto): {translation} -> {data.get('source')}")
+
+                # Удаляем старое изображение, если оно было
+                if current_image and current_image != data.get('finalUrl'):
+                    await delete_old_file(self.supabase, DB_BUCKETS['IMAGES'], current_image)
+
+                return {}
+            else:
+                if status != 404:
+                    logging.warning(f"⚠️ Edge Function Error: {status} - {text}")
+                return {}
 
         except asyncio.TimeoutError:
             logging.warning(f"⚠️ Timeout при вызове Edge Function для {translation}")
@@ -90,10 +111,7 @@ Format:
 """
         for model_name in self.models_to_try:
             try:
-                response = await self.ai_gen.client.aio.models.generate_content(
-                    model=model_name,
-                    contents=prompt
-                )
+                response = await self.ai_gen.generate_content(model_name, prompt)
                 text = response.text
                 
                 # Очистка от markdown форматирования
@@ -104,9 +122,8 @@ Format:
                     
                 return json.loads(text.strip())
             except Exception as e:
-                if "429" in str(e):
+                if rate_limits.is_rate_limited(e):
                     logging.warning(f"⚠️ Quota exceeded for {model_name}. Trying next...")
-                    await asyncio.sleep(1)
                     continue
                 logging.warning(f"⚠️ Ошибка генерации примеров ({model_name}): {e}")
                 continue
@@ -130,15 +147,11 @@ Output in Markdown format.
 """
         for model_name in self.models_to_try:
             try:
-                response = await self.ai_gen.client.aio.models.generate_content(
-                    model=model_name,
-                    contents=prompt
-                )
+                response = await self.ai_gen.generate_content(model_name, prompt)
                 return response.text.strip()
             except Exception as e:
-                if "429" in str(e):
+                if rate_limits.is_rate_limited(e):
                     logging.warning(f"⚠️ Quota exceeded for {model_name}. Trying next...")
-                    await asyncio.sleep(1)
                     continue
                 logging.warning(f"⚠️ Ошибка генерации грамматики ({model_name}): {e}")
                 continue
@@ -161,10 +174,7 @@ Output ONLY a comma-separated list of Korean words.
 """
         for model_name in self.models_to_try:
             try:
-                response = await self.ai_gen.client.aio.models.generate_content(
-                    model=model_name,
-                    contents=prompt
-                )
+                response = await self.ai_gen.generate_content(model_name, prompt)
                 text = response.text.strip()
                 
                 new_synonyms = [s.strip() for s in text.split(',') if s.strip()]
@@ -174,9 +184,8 @@ Output ONLY a comma-separated list of Korean words.
                     
                 return ", ".join(all_synonyms[:5])
             except Exception as e:
-                if "429" in str(e):
+                if rate_limits.is_rate_limited(e):
                     logging.warning(f"⚠️ Quota exceeded for {model_name}. Trying next...")
-                    await asyncio.sleep(1.5)
                     continue
                 logging.warning(f"⚠️ Ошибка генерации синонимов ({model_name}): {e}")
                 continue
@@ -198,7 +207,7 @@ Output ONLY a comma-separated list of Korean words.
 
         if not has_manual_data and not self.ai_gen.api_key:
             logging.warning(f"⚠️ Пропуск {word_kr}: нет ключа Gemini и нет ручных данных.")
-            builder = self.supabase.table(DB_TABLES['WORD_REQUESTS']).update({
+            builder = self.db.table(DB_TABLES['WORD_REQUESTS']).update({
                 'status': WORD_REQUEST_STATUS['ERROR'], 
                 'my_notes': 'Server Error: Missing Gemini API Key'
             }).eq('id', req_id)
@@ -219,13 +228,13 @@ Output ONLY a comma-separated list of Korean words.
                 
                 if error_msg:
                     logging.error(f"❌ Ошибка AI обработки для {word_kr}: {error_msg}")
-                    builder = self.supabase.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['ERROR'], 'my_notes': error_msg}).eq('id', req_id)
+                    builder = self.db.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['ERROR'], 'my_notes': error_msg}).eq('id', req_id)
                     await execute_supabase_query(builder)
                     return
 
             if not items_to_process:
                 logging.error(f"❌ Нет данных для обработки {word_kr}")
-                builder = self.supabase.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['ERROR']}).eq('id', req_id)
+                builder = self.db.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['ERROR']}).eq('id', req_id)
                 await execute_supabase_query(builder)
                 return
 
@@ -296,7 +305,7 @@ Output ONLY a comma-separated list of Korean words.
                 
                 async def _find_duplicate(table, uid=None):
                     # Ищем слово по написанию
-                    b = self.supabase.table(table).select('id, translation, created_by, is_public').eq('word_kr', data.get('word_kr'))
+                    b = self.db.table(table).select('id, translation, created_by, is_public').eq('word_kr', data.get('word_kr'))
                     rows = (await execute_supabase_query(b)).data or []
                     req_t = (data.get('translation') or "").strip().lower()
                     
@@ -339,7 +348,7 @@ Output ONLY a comma-separated list of Korean words.
                         del clean_data['grammar_info']
                     
                     try:
-                        builder = self.supabase.table(target_table).insert(clean_data)
+                        builder = self.db.table(target_table).insert(clean_data)
                         insert_data = (await execute_supabase_query(builder)).data
                     except Exception as e:
                         logging.error(f"❌ Ошибка вставки в БД: {e}")
@@ -352,6 +361,8 @@ Output ONLY a comma-separated list of Korean words.
                         
                         # Генерируем медиа для нового слова сразу
                         if content_gen_callback:
+                            if not session and self.http_pool:
+                                session = self.http_pool.session
                             if session:
                                 updates = await content_gen_callback(session, insert_data[0])
                             else:
@@ -359,7 +370,7 @@ Output ONLY a comma-separated list of Korean words.
                                     updates = await content_gen_callback(local_session, insert_data[0])
                             
                             if updates:
-                                update_builder = self.supabase.table(target_table).update(updates).eq("id", word_id)
+                                update_builder = self.db.table(target_table).update(updates).eq("id", word_id)
                                 await execute_supabase_query(update_builder)
                     else:
                         logging.error(f"❌ Не удалось вставить слово '{data.get('word_kr')}'. Ответ БД пуст (возможно, ошибка прав доступа RLS).")
@@ -367,7 +378,7 @@ Output ONLY a comma-separated list of Korean words.
                 # Опционально: Добавить слово в "Изучаемые" пользователя, который его запросил
                 if word_id and user_id:
                     try:
-                        builder = self.supabase.table(DB_TABLES['USER_PROGRESS']).upsert({'user_id': user_id, 'word_id': word_id, 'is_learned': False})
+                        builder = self.db.table(DB_TABLES['USER_PROGRESS']).upsert({'user_id': user_id, 'word_id': word_id, 'is_learned': False})
                         await execute_supabase_query(builder)
                     except Exception as e:
                         logging.warning(f"Не удалось добавить в прогресс пользователя: {e}")
@@ -376,7 +387,7 @@ Output ONLY a comma-separated list of Korean words.
                 target_list_id = request.get('target_list_id')
                 if word_id and target_list_id:
                     try:
-                        builder = self.supabase.table(DB_TABLES['LIST_ITEMS']).upsert({'list_id': target_list_id, 'word_id': word_id})
+                        builder = self.db.table(DB_TABLES['LIST_ITEMS']).upsert({'list_id': target_list_id, 'word_id': word_id})
                         await execute_supabase_query(builder)
                         logging.info(f"✅ Слово добавлено в список {target_list_id}")
                     except Exception as e:
@@ -393,15 +404,15 @@ Output ONLY a comma-separated list of Korean words.
             update_payload = {'status': final_status}
             if notes: update_payload['my_notes'] = notes
             
-            builder = self.supabase.table(DB_TABLES['WORD_REQUESTS']).update(update_payload).eq('id', req_id)
+            builder = self.db.table(DB_TABLES['WORD_REQUESTS']).update(update_payload).eq('id', req_id)
             await execute_supabase_query(builder)
 
         except asyncio.TimeoutError:
             logging.error(f"❌ Timeout AI для {word_kr}")
-            builder = self.supabase.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['ERROR'], 'my_notes': 'AI Timeout'}).eq('id', req_id)
+            builder = self.db.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['ERROR'], 'my_notes': 'AI Timeout'}).eq('id', req_id)
             await execute_supabase_query(builder)
 
         except Exception as e:
             logging.error(f"❌ Ошибка AI обработки для {word_kr}: {e}")
-            builder = self.supabase.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['ERROR']}).eq('id', req_id)
+            builder = self.db.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['ERROR']}).eq('id', req_id)
             await execute_supabase_query(builder)
\ No newline at end of file
@@ -1,13 +1,25 @@
+import io
 import os
 import sys
 import time
 import random
 import logging
 import asyncio
+import inspect
 from urllib.parse import unquote
 from io import BytesIO
 from dotenv import load_dotenv
-from supabase import create_client
+from supabase import create_client, create_async_client
+from limiters import limit
+import rate_limits
+import metrics
+import network_quality
+from local_supabase import is_local_url, create_local_client
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 try:
     from PIL import Image
@@ -62,7 +74,12 @@ def load_config(script_path):
     return url, key, gemini_key
 
 def init_supabase(url, key):
-    """Initializes Supabase client with StorageClient patch."""
+    """Initializes Supabase client with StorageClient patch.
+
+    A local:// URL (see local_supabase.py) returns the in-process stand-in instead.
+    """
+    if is_local_url(url):
+        return create_local_client(url)
     # Patch StorageClient for trailing slash issue
     try:
         StorageClient = None
@@ -94,16 +111,36 @@ def init_supabase(url, key):
         logging.error(f"❌ Критическая ошибка при инициализации Supabase: {e}")
         sys.exit(1)
 
+async def init_async_supabase(url, key):
+    """Initializes the async Supabase client used for non-blocking DB queries."""
+    if is_local_url(url):
+        return create_local_client(url, is_async=True)
+    try:
+        return await create_async_client(url, key)
+    except Exception as e:
+        logging.error(f"❌ Критическая ошибка при инициализации Async Supabase: {e}")
+        raise
+
+def _is_network_error(e):
+    """Returns True for transient network failures worth retrying."""
+    if httpx is not None and isinstance(e, httpx.TransportError):
+        return True
+    err_str = str(e).lower()
+    return 'getaddrinfo failed' in err_str or '10054' in err_str or 'timed out' in err_str or 'connection' in err_str or '10051' in err_str
+
 def _execute_with_retry(executable):
     """Executes a Supabase query synchronously with retry logic."""
     max_retries = 4
     base_delay = 1.5
     for attempt in range(max_retries):
+        start = time.perf_counter()
         try:
-            return executable.execute()
+            result = executable.execute()
+            network_quality.record('supabase_db', time.perf_counter() - start)
+            return result
         except Exception as e:
-            err_str = str(e).lower()
-            is_network_error = 'getaddrinfo failed' in err_str or '10054' in err_str or 'timed out' in err_str or 'connection' in err_str or '10051' in err_str
+            network_quality.record('supabase_db', time.perf_counter() - start, ok=False)
+            is_network_error = _is_network_error(e)
             if is_network_error and attempt < max_retries - 1:
                 delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
                 if attempt == 0 or attempt == max_retries - 2:
@@ -112,8 +149,34 @@ def _execute_with_retry(executable):
             else:
                 raise e
 
+async def _execute_async_with_retry(executable, max_retries=4, base_delay=1.5, max_delay=20.0):
+    """Awaits a query built on the async client; backoff sleeps never block a thread."""
+    for attempt in range(max_retries):
+        start = time.perf_counter()
+        try:
+            result = await executable.execute()
+            network_quality.record('supabase_db', time.perf_counter() - start)
+            return result
+        except Exception as e:
+            network_quality.record('supabase_db', time.perf_counter() - start, ok=False)
+            if _is_network_error(e) and attempt < max_retries - 1:
+                # Equal jitter: half of the exponential delay is fixed, half is random
+                cap = min(max_delay, base_delay * (2 ** attempt))
+                delay = cap / 2 + random.uniform(0, cap / 2)
+                if attempt == 0 or attempt == max_retries - 2:
+                    logging.warning(f"🌐 Сетевая ошибка Supabase ({e!r}). Попытка {attempt + 2}/{max_retries} через {delay:.1f}с...")
+                await asyncio.sleep(delay)
+            else:
+                raise e
+
 async def execute_supabase_query(executable):
-    """Async wrapper for Supabase queries with retry."""
+    """Async wrapper for Supabase queries with retry.
+
+    Builders from the async client are awaited directly on the event loop;
+    builders from the sync client fall back to the default thread pool.
+    """
+    if inspect.iscoroutinefunction(getattr(executable, 'execute', None)):
+        return await _execute_async_with_retry(executable)
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, _execute_with_retry, executable)
 
@@ -132,11 +195,24 @@ async def delete_old_file(supabase, bucket, url):
                     if "10035" in str(e) or "10054" in str(e): time.sleep(0.5); continue
                     raise e
 
-        await loop.run_in_executor(None, _do_delete)
+        await rate_limits.acquire('storage')
+        async with limit('storage'):
+            with metrics.span('storage_delete', bucket=bucket):
+                await loop.run_in_executor(None, _do_delete)
         logging.info(f"🗑 Удален старый файл: {filename}")
     except Exception as e:
         logging.warning(f"⚠️ Не удалось удалить старый файл {url}: {e}")
 
+def _payload_size(data):
+    """Размер загружаемых данных в байтах (bytes, BytesIO или файл), None если неизвестен."""
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if hasattr(data, 'getbuffer'):
+        return data.getbuffer().nbytes
+    if isinstance(data, (io.BufferedReader, io.FileIO)):
+        return os.fstat(data.fileno()).st_size
+    return None
+
 async def upload_to_supabase(supabase, bucket, path, data, content_type):
     """Uploads data to Supabase storage."""
     loop = asyncio.get_running_loop()
@@ -145,7 +221,10 @@ async def upload_to_supabase(supabase, bucket, path, data, content_type):
         for i in range(3):
             try:
                 file_data = data
-                if hasattr(data, 'getvalue'):
+                if isinstance(data, (io.BufferedReader, io.FileIO)):
+                    # Открытый файл передается как есть: клиент Storage отправляет его кусками
+                    data.seek(0)
+                elif hasattr(data, 'getvalue'):
                     file_data = data.getvalue()
                 elif hasattr(data, 'seek') and hasattr(data, 'read'):
                     data.seek(0)
@@ -158,7 +237,11 @@ async def upload_to_supabase(supabase, bucket, path, data, content_type):
                 if "10035" in str(e) or "10054" in str(e): time.sleep(1); continue
                 raise e
 
-    await loop.run_in_executor(None, _do_upload)
+    await rate_limits.acquire('storage')
+    async with limit('storage'):
+        with metrics.span('storage_upload', bucket=bucket) as sp:
+            sp.bytes = _payload_size(data)
+            await loop.run_in_executor(None, _do_upload)
 
 def optimize_image_data(data):
     """Optimizes image data using Pillow."""
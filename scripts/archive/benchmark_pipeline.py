@@ -0,0 +1,376 @@
+# Офлайн-бенчмарк конвейера контента: process_word, process_quote и process_word_request
+# прогоняются на локальных имитациях edge-tts, Gemini, Supabase Storage/PostgREST и Edge Function
+# с настраиваемыми задержками, разбросом, долей ошибок и размером аудио. Сеть и ключи не нужны.
+#
+# Пример:
+#   python benchmark_pipeline.py --concurrency 1,5,10,25 --words 200 --tts-latency 0.4 --error-rate 0.02
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from unittest.mock import patch
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+parser = argparse.ArgumentParser(description="Офлайн-бенчмарк пропускной способности конвейера контента (без сети и ключей)")
+parser.add_argument("--scenarios", type=str, default="words,quotes,requests", help="Сценарии через запятую: words, quotes, requests")
+parser.add_argument("--concurrency", type=str, default="1,5,10,25", help="Уровни параллелизма через запятую (по умолчанию 1,5,10,25)")
+parser.add_argument("--words", type=int, default=100, help="Слов в сценарии words (по умолчанию 100)")
+parser.add_argument("--quotes", type=int, default=100, help="Цитат в сценарии quotes (по умолчанию 100)")
+parser.add_argument("--requests", type=int, default=20, help="Заявок в сценарии requests (по умолчанию 20)")
+parser.add_argument("--tts-latency", type=float, default=0.4, help="Медианная задержка синтеза edge-tts, сек")
+parser.add_argument("--storage-latency", type=float, default=0.15, help="Медианная задержка загрузки/удаления в Storage, сек")
+parser.add_argument("--db-latency", type=float, default=0.05, help="Медианная задержка запроса PostgREST, сек")
+parser.add_argument("--gemini-latency", type=float, default=1.5, help="Медианная задержка ответа Gemini, сек")
+parser.add_argument("--edge-latency", type=float, default=0.8, help="Медианная задержка Edge Function картинок, сек")
+parser.add_argument("--jitter", type=float, default=0.35, help="Разброс задержек (sigma логнормального распределения, 0 = без разброса)")
+parser.add_argument("--error-rate", type=float, default=0.0, help="Доля вызовов имитаций, завершающихся ошибкой (0..1)")
+parser.add_argument("--audio-kb", type=float, default=24, help="Медианный размер аудио одной фразы, КБ")
+parser.add_argument("--dialogue-share", type=float, default=0.2, help="Доля примеров-диалогов (синтез по репликам)")
+parser.add_argument("--no-tts-cache", action="store_true", help="Без дискового кэша TTS: аудио держится в памяти (по умолчанию — свежий кэш во временной папке на каждый прогон, как у воркера)")
+parser.add_argument("--keep-rate-limits", action="store_true", help="Не снимать квоты rate_limits (по умолчанию сняты, чтобы мерить сам конвейер)")
+parser.add_argument("--stages", action="store_true", help="Печатать сводку по стадиям для каждого прогона")
+parser.add_argument("--json", type=str, help="Сохранить результаты в JSON-файл")
+parser.add_argument("--seed", type=int, default=42, help="Зерно генератора случайных чисел")
+parser.add_argument("--verbose", action="store_true", help="Не приглушать логи воркера")
+bench_args = parser.parse_args()
+
+class Latency:
+    """Логнормальная задержка вокруг медианы: большинство вызовов близко к ней, редкие — сильно дольше."""
+    def __init__(self, median, jitter):
+        self.median = median
+        self.jitter = jitter
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return self.median * random.lognormvariate(0, self.jitter) if self.jitter > 0 else self.median
+
+class FakeServices:
+    """Общие настройки имитаций и счетчик вызовов по сервисам."""
+    def __init__(self, opts):
+        self.tts = Latency(opts.tts_latency, opts.jitter)
+        self.storage = Latency(opts.storage_latency, opts.jitter)
+        self.db = Latency(opts.db_latency, opts.jitter)
+        self.gemini = Latency(opts.gemini_latency, opts.jitter)
+        self.edge = Latency(opts.edge_latency, opts.jitter)
+        self.audio = Latency(opts.audio_kb * 1024, opts.jitter)
+        self.error_rate = opts.error_rate
+        self.calls = {}
+
+    def call(self, service):
+        self.calls[service] = self.calls.get(service, 0) + 1
+        if self.error_rate and random.random() < self.error_rate:
+            raise ConnectionError(f"fake {service}: connection reset")
+
+services = FakeServices(bench_args)
+
+class FakeCommunicate:
+    """Имитация edge_tts.Communicate: отдает аудио кусками после задержки синтеза."""
+    def __init__(self, text, voice, *args, **kwargs):
+        self.text = text
+        self.voice = voice
+
+    async def stream(self):
+        services.call('tts')
+        total = max(1024, int(services.audio.sample()))
+        delay = services.tts.sample()
+        chunks = max(1, total // 4096)
+        for i in range(chunks):
+            await asyncio.sleep(delay / chunks)
+            size = total // chunks if i < chunks - 1 else total - (total // chunks) * (chunks - 1)
+            yield {"type": "audio", "data": b"\x00" * size}
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+
+class FakeQuery:
+    """Цепочка PostgREST (table().select().eq()...): execute() синхронный, как у sync-клиента."""
+    def __init__(self, table):
+        self.table = table
+        self.op = 'select'
+        self.payload = None
+
+    def __getattr__(self, name):
+        def chain(*args, **kwargs):
+            return self
+        return chain
+
+    def select(self, *args, **kwargs):
+        self.op = 'select'
+        return self
+
+    def insert(self, payload, *args, **kwargs):
+        self.op, self.payload = 'insert', payload
+        return self
+
+    def update(self, payload, *args, **kwargs):
+        self.op, self.payload = 'update', payload
+        return self
+
+    def upsert(self, payload, *args, **kwargs):
+        self.op, self.payload = 'upsert', payload
+        return self
+
+    def execute(self):
+        services.call('db')
+        time.sleep(services.db.sample())
+        if self.op == 'insert':
+            return FakeResult([dict(self.payload, id=random.randint(10**6, 10**7))])
+        if self.op in ('update', 'upsert'):
+            return FakeResult([dict(self.payload or {})])
+        return FakeResult([])
+
+class FakeBucket:
+    def __init__(self, name):
+        self.name = name
+
+    def upload(self, path, file, file_options=None):
+        services.call('storage')
+        if hasattr(file, 'read'):
+            # Открытый файл читается кусками, как это делает multipart-загрузка клиента Storage
+            size = 0
+            for chunk in iter(lambda: file.read(64 * 1024), b""):
+                size += len(chunk)
+        else:
+            size = len(file)
+        time.sleep(services.storage.sample() + size / (50 * 1024 * 1024))
+        return {'Key': f"{self.name}/{path}"}
+
+    def remove(self, paths):
+        services.call('storage')
+        time.sleep(services.storage.sample())
+        return []
+
+    def get_public_url(self, path):
+        return f"https://bench.local/storage/v1/object/public/{self.name}/{path}"
+
+class FakeStorage:
+    def from_(self, bucket):
+        return FakeBucket(bucket)
+
+    def list_buckets(self):
+        return []
+
+    def create_bucket(self, *args, **kwargs):
+        return None
+
+    def update_bucket(self, *args, **kwargs):
+        return None
+
+class FakeSupabase:
+    """Синхронный клиент Supabase: таблицы и Storage с имитацией задержек."""
+    def __init__(self, *args, **kwargs):
+        self.storage = FakeStorage()
+
+    def table(self, name):
+        return FakeQuery(name)
+
+    def rpc(self, name, params=None):
+        return FakeQuery(name)
+
+class FakeResponse:
+    def __init__(self, status, payload):
+        self.status = status
+        self._payload = payload
+
+    async def __aenter__(self):
+        await asyncio.sleep(services.edge.sample())
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self):
+        return self._payload
+
+    async def text(self):
+        return json.dumps(self._payload)
+
+class FakeSession:
+    """aiohttp-сессия для вызова Edge Function картинок."""
+    def post(self, url, json=None, headers=None, timeout=None):
+        try:
+            services.call('edge_image')
+        except ConnectionError:
+            return FakeResponse(503, {'error': 'unavailable'})
+        return FakeResponse(200, {'source': 'pixabay', 'finalUrl': f"https://bench.local/img/{(json or {}).get('id')}.jpg"})
+
+class FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeGeminiModels:
+    async def generate_content(self, model, contents):
+        services.call('gemini')
+        await asyncio.sleep(services.gemini.sample())
+        if 'synonyms' in contents and 'comma-separated' in contents:
+            return FakeGeminiResponse("동의어1, 동의어2, 동의어3")
+        word = contents.rsplit("Input: '", 1)[-1].split("'")[0] if "Input: '" in contents else "단어"
+        return FakeGeminiResponse(json.dumps({
+            'word_kr': word, 'translation': 'тест', 'frequency': 'medium', 'topik_level': 'TOPIK II level 3',
+            'tone': 'Informal', 'word_hanja': '', 'topic': '기타 (Другое)', 'category': '명사 (Существительные)',
+            'level': '★★☆', 'example_kr': f"{word}를 자주 사용해요.", 'example_ru': 'Часто использую.',
+            'synonyms': '동의어1', 'antonyms': '', 'collocations': '', 'grammar_info': '', 'type': 'word',
+        }, ensure_ascii=False))
+
+class FakeGemini:
+    def __init__(self):
+        self.aio = type('FakeAio', (), {'models': FakeGeminiModels()})()
+
+# Воркер импортируется с имитацией клиента Supabase, без сервера метрик и разбора аргументов бенчмарка
+os.environ.setdefault("SUPABASE_URL", "https://bench.local/")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench-key")
+sys.argv = [os.path.join(SCRIPT_DIR, 'content_worker.py'), '--metrics-port', '0']
+# Лог воркера (log.txt в текущей папке) бенчмарку не нужен — пишем только в консоль
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+with patch("supabase.create_client", new=FakeSupabase), patch("app_utils.setup_logging"):
+    import content_worker as cw
+import metrics
+import limiters
+import rate_limits
+import network_quality
+
+if not bench_args.verbose:
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+import tts_generator
+from tts_cache import TTSCache
+tts_generator.edge_tts.Communicate = FakeCommunicate
+cw.ai_gen.api_key = 'bench'
+cw.ai_gen.client = FakeGemini()
+fake_db = FakeSupabase()
+cw.db = fake_db
+cw.ai_handler.set_db_client(fake_db)
+fake_session = FakeSession()
+
+WORDS = ["사랑", "학교", "공부하다", "행복", "시간", "친구", "음식", "여행", "가족", "날씨"]
+DIALOGUE = "가: 오늘 날씨가 어때요?\n나: 아주 좋아요.\n가: 산책할까요?"
+
+def make_word(i):
+    word = f"{WORDS[i % len(WORDS)]}{i}"
+    example = DIALOGUE if random.random() < bench_args.dialogue_share else f"{word}를 자주 사용해요."
+    return {'id': i, 'word_kr': word, 'translation': f"перевод {i}", 'example_kr': example,
+            'audio_url': None, 'audio_male': None, 'example_audio': None, 'image': None, 'image_source': None}
+
+async def run_word(row):
+    updates = await cw.process_word(fake_session, row, {'network': 0, 'other': 0})
+    return updates is not None
+
+async def run_quote(row):
+    # process_quote не пробрасывает ошибки — неудачу сообщает результатом
+    return await cw.process_quote('quotes', row)
+
+async def run_request(req):
+    await cw.ai_handler.process_word_request(req, session=fake_session, content_gen_callback=cw._generate_content_for_word)
+    return True
+
+SCENARIOS = {
+    'words': (lambda: [make_word(i) for i in range(1, bench_args.words + 1)], run_word),
+    'quotes': (lambda: [{'id': i, 'quote_kr': f"천 리 길도 한 걸음부터 {i}", 'audio_url': None} for i in range(1, bench_args.quotes + 1)], run_quote),
+    'requests': (lambda: [{'id': i, 'word_kr': f"{WORDS[i % len(WORDS)]}{i}", 'user_id': None} for i in range(1, bench_args.requests + 1)], run_request),
+}
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def run_level(name, concurrency):
+    make_items, run_item = SCENARIOS[name]
+    items = make_items()
+    limiters.set_initial_limits(concurrency)
+    metrics.pass_summary(reset=True)
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(item):
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                ok = await run_item(item)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    # Свежий кэш на каждый прогон: повторные уровни не должны брать аудио из кэша предыдущих
+    cache_dir = None if bench_args.no_tts_cache else tempfile.mkdtemp(prefix="bench_tts_")
+    cw.tts_gen.set_cache(TTSCache(cache_dir) if cache_dir else None)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(one(item) for item in items))
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        cw.tts_gen.set_cache(None)
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    result = {
+        'scenario': name,
+        'concurrency': concurrency,
+        'items': len(items),
+        'errors': errors,
+        'elapsed': round(elapsed, 3),
+        'per_sec': round(len(items) / elapsed, 2) if elapsed else 0.0,
+        'p50': round(percentile(latencies, 0.50), 3),
+        'p95': round(percentile(latencies, 0.95), 3),
+        'p99': round(percentile(latencies, 0.99), 3),
+        'peak_mb': round(peak / 1048576, 2),
+        'stages': metrics.pass_summary(reset=True),
+    }
+    return result
+
+def print_row(r):
+    print(f"{r['scenario']:<9} {r['concurrency']:>5} {r['items']:>6} {r['errors']:>6} {r['elapsed']:>8.2f} "
+          f"{r['per_sec']:>8.2f} {r['p50']:>7.2f} {r['p95']:>7.2f} {r['p99']:>7.2f} {r['peak_mb']:>8.2f}")
+    if bench_args.stages:
+        for stage, s in sorted(r['stages'].items(), key=lambda item: item[1]['total'], reverse=True):
+            print(f"{'':<15}{stage:<22} {s['count']:>5} шт., p50 {s['p50']:.2f}, p95 {s['p95']:.2f}, ошибок {s['errors']}")
+
+async def main():
+    random.seed(bench_args.seed)
+    if not bench_args.keep_rate_limits:
+        rate_limits.scale_all(1e6)
+    metrics.add_span_listener(network_quality.on_span)
+    levels = [int(x) for x in bench_args.concurrency.split(',') if x.strip()]
+    scenarios = [s.strip() for s in bench_args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        print(f"❌ Неизвестные сценарии: {', '.join(unknown)}")
+        sys.exit(2)
+
+    print(f"{'сценарий':<9} {'парал.':>5} {'шт.':>6} {'ошибок':>6} {'сек':>8} {'шт./сек':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'пик МБ':>8}")
+    results = []
+    for name in scenarios:
+        for concurrency in levels:
+            result = await run_level(name, concurrency)
+            results.append(result)
+            print_row(result)
+
+    if bench_args.json:
+        with open(bench_args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(bench_args), 'calls': services.calls, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"🧾 Результаты сохранены в {bench_args.json}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,13 +4,18 @@ DB_TABLES = {
     "WORD_REQUESTS": "word_requests",
     "USER_PROGRESS": "user_progress",
     "LIST_ITEMS": "list_items",
+    "MEDIA_FAILURES": "media_failures",
+    "VOCABULARY_MEDIA_QUEUE": "vocabulary_media_queue",
 }
+# Минимальный размер аудиофайла (байт); меньше — битый файл
+MIN_FILE_SIZE = 500
 DB_BUCKETS = {
     "AUDIO": "audio-files",
     "IMAGES": "image-files",
 }
 WORD_REQUEST_STATUS = {
     "PENDING": "pending",
+    "PROCESSING": "processing",
     "PROCESSED": "processed",
     "ERROR": "error",
 }
@@ -6,14 +6,10 @@ import re
 import sys
 import time
 import hashlib
-import random
 import logging
-import threading
+import signal
 import asyncio
 import argparse
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from io import BytesIO
-import json
 import warnings
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -25,11 +21,7 @@ try:
 except AttributeError: pass
 
 try:
-    import requests
     import aiohttp
-    from supabase import create_client
-    import edge_tts # type: ignore
-    from PIL import Image
     from google import genai
 except ImportError as e:
     logging.error(f"❌ Ошибка импорта библиотек: {e}")
@@ -45,18 +37,33 @@ try:
     if script_dir not in sys.path:
         sys.path.insert(0, script_dir)
     
-    from tts_generator import TTSGenerator, MIN_FILE_SIZE # type: ignore
+    from tts_generator import TTSGenerator # type: ignore
     from ai_generator import AIContentGenerator # type: ignore
     from app_utils import ( # type: ignore
-        setup_logging, load_config, init_supabase, 
-        execute_supabase_query, _execute_with_retry,
-        delete_old_file, upload_to_supabase, optimize_image_data
+        setup_logging, load_config, init_supabase, init_async_supabase,
+        execute_supabase_query, _execute_with_retry
     )
     from constants import DB_TABLES, DB_BUCKETS, WORD_REQUEST_STATUS
     from tts_handler import TTSHandler
     from ai_handler import AIHandler
     from realtime_handler import realtime_loop
+    import realtime_handler
+    from request_leases import RequestLeaseManager
+    from pipeline import MediaPipeline
+    from http_pool import HttpPool
+    from write_behind import WriteBehindBuffer
+    from scan_cursor import ScanCursor
+    from failure_ledger import FailureLedger
+    import limiters
+    import rate_limits
+    import metrics
+    import network_quality
+    import single_flight
     from maintenance import cleanup_temp_files, reset_failed_requests
+    from supervisor import WorkerSupervisor
+    from scheduler import PriorityScheduler
+    from tts_cache import TTSCache
+    from storage_index import StorageIndex
 except ImportError as e:
     print(f"❌ Ошибка импорта локальных модулей: {e}")
     sys.exit(1)
@@ -70,6 +77,21 @@ SUPABASE_URL, SUPABASE_KEY, GEMINI_API_KEY = load_config(__file__)
 # Глобальные флаги состояния схемы
 HAS_GRAMMAR_INFO = True
 
+# Размер страницы при чтении словаря (keyset-пагинация)
+WORDS_PAGE_SIZE = 200
+# Максимум слов в работе одновременно; реальную нагрузку на сервисы ограничивают лимитеры зависимостей
+WORD_CONSUMERS = 25
+# Максимум событий Realtime в работе одновременно; остальные ждут в ограниченной очереди
+REALTIME_CONSUMERS = 25
+# Размер страницы при чтении цитат
+QUOTES_PAGE_SIZE = 20
+# Пока Realtime подключен, опрос словаря и цитат — лишь редкая страховка (сек)
+SAFETY_NET_POLL_INTERVAL = 600
+# Сколько секунд игнорировать UPDATE-события по только что обработанному слову (эхо собственной записи)
+RECENTLY_PROCESSED_TTL = 600
+# Только колонки, нужные для генерации медиа (_generate_content_for_word и обработчикам)
+WORD_MEDIA_COLUMNS = "id,word_kr,translation,example_kr,audio_url,audio_male,example_audio,image,image_source"
+
 if not SUPABASE_URL or not SUPABASE_KEY:
     logging.error("❌ ОШИБКА: Не найдены переменные окружения SUPABASE_URL или SUPABASE_SERVICE_KEY (или их VITE_ аналоги).")
     logging.error("Убедитесь, что файл .env создан и содержит эти ключи.")
@@ -84,38 +106,73 @@ parser.add_argument("--force-audio", action="store_true", help="Принудит
 parser.add_argument("--force-quotes", action="store_true", help="Принудительно обновить аудио только для цитат")
 parser.add_argument("--retry-errors", action="store_true", help="Сбросить статус ошибочных заявок на 'pending' для повторной обработки")
 parser.add_argument("--exit-after-maintenance", action="store_true", help="Завершить работу после выполнения задач обслуживания")
-parser.add_argument("--concurrency", type=int, default=0, help="Количество одновременных потоков (0 = авто-подбор, по умолчанию 0)")
+parser.add_argument("--concurrency", type=int, default=0, help="Стартовый лимит параллелизма зависимостей (0 = значения по умолчанию, дальше лимиты подстраиваются по замерам)")
+parser.add_argument("--request-concurrency", type=int, default=5, help="Количество заявок пользователей, обрабатываемых одновременно (по умолчанию 5)")
+parser.add_argument("--rate-limit", action="append", default=[], metavar="KEY=RATE[/BURST]", help="Лимит частоты запросов в секунду, например gemini:gemini-2.5-flash=0.15/3 или tts=5 (можно повторять)")
+parser.add_argument("--metrics-port", type=int, default=9108, help="Порт HTTP-сервера /metrics и /healthz (0 = отключить, по умолчанию 9108)")
+parser.add_argument("--metrics-host", type=str, default="127.0.0.1", help="Адрес HTTP-сервера метрик (0.0.0.0 — доступ извне)")
+parser.add_argument("--timings-jsonl", type=str, help="Писать замеры стадий (TTS, Storage, Edge Function, запись в БД) в файл JSON lines")
+parser.add_argument("--drain-timeout", type=float, default=60, help="Сколько секунд при остановке (Ctrl-C/SIGTERM) дорабатывать начатые слова и заявки (по умолчанию 60)")
+parser.add_argument("--processes", type=int, default=1, help="Количество процессов-воркеров; >1 включает режим супервизора с шардированием словаря по id % N (по умолчанию 1)")
+parser.add_argument("--shard-index", type=int, default=0, help="Номер шарда этого процесса (задается супервизором)")
+parser.add_argument("--shard-count", type=int, default=1, help="Общее число шардов (задается супервизором)")
+parser.add_argument("--request-timeout", type=float, default=180, help="Лимит времени на обработку одной заявки в секундах (по умолчанию 180)")
+parser.add_argument("--tts-cache-dir", type=str, default="tts_cache", help="Папка дискового кэша синтезированного аудио; при шардировании у каждого процесса подпапка shard-N (по умолчанию tts_cache)")
+parser.add_argument("--tts-cache-mb", type=int, default=2048, help="Лимит размера кэша TTS в МБ; старые файлы вытесняются (0 = без кэша, по умолчанию 2048)")
+parser.add_argument("--warm-tts-cache", action="store_true", help="Заполнить кэш TTS озвучкой слов, примеров и цитат из БД (без загрузки в Storage) и выйти")
 args = parser.parse_args()
 
+# Шардирование: процесс обрабатывает только слова с id % shard_count == shard_index.
+# Цитаты и обслуживание (сброс ошибок, очистка временных файлов) выполняет только шард 0.
+IS_SHARDED = args.shard_count > 1
+IS_PRIMARY_SHARD = args.shard_index == 0
+# Курсор сканирования у каждого шарда в своем файле (процессы не перезаписывают друг друга)
+SCAN_STATE_FILE = f"worker_state.shard{args.shard_index}-of{args.shard_count}.json" if IS_SHARDED else "worker_state.json"
+# Кэш TTS у каждого шарда в своей подпапке: учет размера и очистка временных файлов
+# ведутся в памяти процесса, поэтому общую папку шарды делить не могут
+TTS_CACHE_DIR = os.path.join(args.tts_cache_dir, f"shard-{args.shard_index}") if IS_SHARDED else args.tts_cache_dir
+
+if IS_SHARDED:
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(f'%(asctime)s - %(levelname)s - [шард {args.shard_index}/{args.shard_count}] %(message)s'))
+
+def in_shard(row_id):
+    return not IS_SHARDED or (isinstance(row_id, int) and row_id % args.shard_count == args.shard_index)
+
 # 3. Инициализация Supabase
 supabase = init_supabase(SUPABASE_URL, SUPABASE_KEY)
+# Клиент для запросов к таблицам. В main_loop заменяется на async клиент,
+# чтобы запросы не занимали потоки пула (Storage остается на синхронном клиенте).
+db = supabase
 
-# 1.1 Проверка и создание бакета (автоматическая настройка)
-try:
-    buckets = supabase.storage.list_buckets()
-    if not any(b.name == DB_BUCKETS['AUDIO'] for b in buckets):
-        logging.info(f"📦 Бакет '{DB_BUCKETS['AUDIO']}' не найден. Создаю новый публичный бакет...")
-        supabase.storage.create_bucket(DB_BUCKETS['AUDIO'], options={"public": True})
-        logging.info(f"✅ Бакет '{DB_BUCKETS['AUDIO']}' успешно создан.")
-    else:
-        logging.info(f"ℹ️ Бакет '{DB_BUCKETS['AUDIO']}' уже существует.")
-except Exception as e:
-    # Игнорируем ошибку, если бакет уже есть, но API вернул ошибку прав доступа
-    logging.warning(f"⚠️ Проверка бакета: {e}")
+def ensure_buckets():
+    """Проверяет и создает бакеты Storage (вызывается из main_loop, а не при импорте модуля)."""
+    # 1.1 Проверка и создание бакета (автоматическая настройка)
+    try:
+        buckets = supabase.storage.list_buckets()
+        if not any(b.name == DB_BUCKETS['AUDIO'] for b in buckets):
+            logging.info(f"📦 Бакет '{DB_BUCKETS['AUDIO']}' не найден. Создаю новый публичный бакет...")
+            supabase.storage.create_bucket(DB_BUCKETS['AUDIO'], options={"public": True})
+            logging.info(f"✅ Бакет '{DB_BUCKETS['AUDIO']}' успешно создан.")
+        else:
+            logging.info(f"ℹ️ Бакет '{DB_BUCKETS['AUDIO']}' уже существует.")
+    except Exception as e:
+        # Игнорируем ошибку, если бакет уже есть, но API вернул ошибку прав доступа
+        logging.warning(f"⚠️ Проверка бакета: {e}")
 
-# 1.2 Проверка и создание бакета для изображений
-try:
-    buckets = supabase.storage.list_buckets()
-    if not any(b.name == DB_BUCKETS['IMAGES'] for b in buckets):
-        logging.info(f"📦 Бакет '{DB_BUCKETS['IMAGES']}' не найден. Создаю новый публичный бакет...")
-        supabase.storage.create_bucket(DB_BUCKETS['IMAGES'], options={"public": True})
-        logging.info(f"✅ Бакет '{DB_BUCKETS['IMAGES']}' успешно создан.")
-    else:
-        # Если бакет уже есть, убедимся, что он публичный
-        logging.info(f"ℹ️ Бакет '{DB_BUCKETS['IMAGES']}' найден. Обновляю права на Public...")
-        supabase.storage.update_bucket(DB_BUCKETS['IMAGES'], {"public": True})
-except Exception as e:
-    logging.warning(f"⚠️ Проверка бакета изображений: {e}")
+    # 1.2 Проверка и создание бакета для изображений
+    try:
+        buckets = supabase.storage.list_buckets()
+        if not any(b.name == DB_BUCKETS['IMAGES'] for b in buckets):
+            logging.info(f"📦 Бакет '{DB_BUCKETS['IMAGES']}' не найден. Создаю новый публичный бакет...")
+            supabase.storage.create_bucket(DB_BUCKETS['IMAGES'], options={"public": True})
+            logging.info(f"✅ Бакет '{DB_BUCKETS['IMAGES']}' успешно создан.")
+        else:
+            # Если бакет уже есть, убедимся, что он публичный
+            logging.info(f"ℹ️ Бакет '{DB_BUCKETS['IMAGES']}' найден. Обновляю права на Public...")
+            supabase.storage.update_bucket(DB_BUCKETS['IMAGES'], {"public": True})
+    except Exception as e:
+        logging.warning(f"⚠️ Проверка бакета изображений: {e}")
 
 if args.retry_errors:
     try:
@@ -143,35 +200,131 @@ def clean_query_for_pixabay(text):
 tts_gen = TTSGenerator()
 ai_gen = AIContentGenerator(GEMINI_API_KEY)
 
-def cleanup_temp_files():
-    """Удаляет временные mp3 файлы, оставшиеся от предыдущих запусков."""
-    try:
-        for f in os.listdir("."):
-            if f.startswith("temp_") and f.endswith(".mp3"):
-                try:
-                    os.remove(f)
-                    logging.info(f"🧹 Удален старый временный файл: {f}")
-                except Exception as e:
-                    logging.warning(f"⚠️ Не удалось удалить {f}: {e}")
-    except Exception as e:
-        logging.warning(f"⚠️ Ошибка очистки временных файлов: {e}")
+# Общий пул HTTP-соединений (Edge Functions и прочие HTTP-вызовы)
+http_pool = HttpPool()
 
 # Инициализация обработчиков
 tts_handler = TTSHandler(supabase, tts_gen)
-ai_handler = AIHandler(supabase, ai_gen, SUPABASE_URL, SUPABASE_KEY)
+# Индекс уже загруженных аудиофайлов: строка без URL получает готовый файл без синтеза
+audio_index = StorageIndex(supabase, DB_BUCKETS['AUDIO'])
+tts_handler.set_storage_index(audio_index)
+ai_handler = AIHandler(supabase, ai_gen, SUPABASE_URL, SUPABASE_KEY, http_pool=http_pool)
+
+# Аренда заявок (несколько воркеров могут работать параллельно)
+request_leases = RequestLeaseManager(supabase)
+
+# Постоянный журнал ошибок генерации медиа (повторы с backoff)
+failure_ledger = FailureLedger(supabase)
+
+# Текущий проход конвейера слов (для метрик глубины очередей)
+active_pipeline = None
+
+# Строки из Realtime (INSERT/UPDATE в vocabulary и quotes), которые обрабатываются сразу, без ожидания опроса
+realtime_media_queue = asyncio.Queue(maxsize=1000)
+# Слова в работе (скан + Realtime) и недавно обработанные — чтобы одно слово не генерировалось дважды
+media_in_flight = set()
+recently_processed = {}
+quotes_in_flight = set()
+
+def needs_media(row):
+    """Те же условия, что у фильтра опроса: нет одного из аудио или картинки."""
+    return any(not row.get(col) for col in ('audio_url', 'audio_male', 'image', 'example_audio'))
 
-async def reset_failed_requests():
-    """Сбрасывает статус ошибочных заявок на 'pending' для повторной обработки."""
+def mark_processed(row_id):
+    media_in_flight.discard(row_id)
+    recently_processed[row_id] = time.time()
+    if len(recently_processed) > 10000:
+        cutoff = time.time() - RECENTLY_PROCESSED_TTL
+        for rid in [rid for rid, ts in recently_processed.items() if ts < cutoff]:
+            del recently_processed[rid]
+
+def enqueue_realtime_word(record):
+    """Колбэк Realtime для vocabulary: ставит слово в очередь немедленной обработки."""
+    row_id = record.get('id')
+    skip = (
+        row_id is None or not in_shard(row_id) or not needs_media(record)
+        or row_id in media_in_flight or failure_ledger.is_backing_off(row_id)
+        or time.time() - recently_processed.get(row_id, 0) < RECENTLY_PROCESSED_TTL
+    )
+    if skip:
+        metrics.inc('worker_realtime_events_total', table='vocabulary', action='skipped')
+        return
     try:
-        # Пытаемся обновить статус ERROR -> PENDING
-        builder = supabase.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['PENDING']}).eq('status', WORD_REQUEST_STATUS['ERROR'])
-        res = await execute_supabase_query(builder)
-        
-        count = len(res.data) if res and res.data else 0
-        if count > 0:
-            logging.info(f"♻️ Авто-сброс: {count} ошибочных заявок возвращено в очередь.")
-    except Exception as e:
-        logging.warning(f"⚠️ Ошибка при авто-сбросе заявок: {e}")
+        realtime_media_queue.put_nowait(('word', {col: record.get(col) for col in WORD_MEDIA_COLUMNS.split(',')}))
+        media_in_flight.add(row_id)
+        metrics.inc('worker_realtime_events_total', table='vocabulary', action='enqueued')
+    except asyncio.QueueFull:
+        logging.warning(f"⚠️ Очередь Realtime переполнена, слово id={row_id} подхватит опрос.")
+
+def enqueue_realtime_quote(record):
+    """Колбэк Realtime для quotes: озвучка новой цитаты без ожидания опроса."""
+    row_id = record.get('id')
+    if row_id is None or record.get('audio_url') or not record.get('quote_kr') or row_id in quotes_in_flight:
+        metrics.inc('worker_realtime_events_total', table='quotes', action='skipped')
+        return
+    try:
+        realtime_media_queue.put_nowait(('quote', record))
+        metrics.inc('worker_realtime_events_total', table='quotes', action='enqueued')
+    except asyncio.QueueFull:
+        logging.warning(f"⚠️ Очередь Realtime переполнена, цитату id={row_id} подхватит опрос.")
+
+# Заявки word_requests из Realtime: захватываются по id сразу после вставки, без ожидания опроса.
+# Payload используется только для отбора: сам захват — тот же один условный UPDATE, что и у RPC
+# (без него два воркера могут взять одну заявку), и он же возвращает актуальную строку заявки
+pushed_requests = asyncio.Queue(maxsize=1000)
+pushed_request_ids = set()
+
+def enqueue_realtime_request(record):
+    """Колбэк Realtime для word_requests: ставит вставленную заявку в очередь захвата."""
+    req_id = record.get('id')
+    if req_id is None or record.get('status') not in (None, WORD_REQUEST_STATUS['PENDING']):
+        return
+    if req_id in pushed_request_ids or req_id in request_leases.held:
+        # Заявку уже подхватил опрос или она уже ждет захвата
+        metrics.inc('worker_realtime_events_total', table='word_requests', action='skipped')
+        return
+    try:
+        pushed_requests.put_nowait(req_id)
+        pushed_request_ids.add(req_id)
+        metrics.inc('worker_realtime_events_total', table='word_requests', action='enqueued')
+    except asyncio.QueueFull:
+        logging.warning(f"⚠️ Очередь Realtime переполнена, заявку id={req_id} подхватит опрос.")
+
+def take_pushed_requests(limit):
+    """Забирает до limit заявок из очереди Realtime (уже захваченные опросом отбрасываются)."""
+    ids = []
+    while len(ids) < limit and not pushed_requests.empty():
+        req_id = pushed_requests.get_nowait()
+        pushed_request_ids.discard(req_id)
+        if req_id not in request_leases.held:
+            ids.append(req_id)
+    return ids
+
+# Единый планировщик работы: заявки пользователей строго первыми, затем слова, цитаты и force-режим по весам.
+# Слоты заявок зарезервированы, поэтому фоновые задачи не могут занять их все.
+scheduler = PriorityScheduler(WORD_CONSUMERS + args.request_concurrency, user_reserve=args.request_concurrency)
+
+# Сигнал остановки (SIGINT/SIGTERM): циклы перестают брать новую работу и дорабатывают начатую
+shutdown_event = asyncio.Event()
+
+async def wait_for_shutdown(timeout):
+    """Сон, прерываемый сигналом остановки. Возвращает True, если пора останавливаться."""
+    try:
+        await asyncio.wait_for(shutdown_event.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    return shutdown_event.is_set()
+
+# Отложенная пакетная запись ссылок на медиа в vocabulary
+media_writer = WriteBehindBuffer(
+    supabase, on_failure=lambda row_id, e: failure_ledger.record_failure(row_id, type(e).__name__, e),
+    on_flushed=failure_ledger.flush_written,
+)
+
+async def _timed(stage, coro):
+    """Замер полного времени обработчика (генерация + загрузка) для сводки по стадиям."""
+    with metrics.span(stage):
+        return await coro
 
 async def _generate_content_for_word(session, row):
     """Генерация контента для слова (аудио, картинки)"""
@@ -181,10 +334,10 @@ async def _generate_content_for_word(session, row):
     word_hash = hashlib.md5(word.encode('utf-8')).hexdigest()
 
     tasks = [
-        tts_handler.handle_main_audio(row, word, word_hash, args.force_audio),
-        tts_handler.handle_male_audio(row, word, word_hash, args.force_audio),
-        tts_handler.handle_example_audio(row, example, args.force_audio),
-        ai_handler.handle_image(session, row, translation, word_hash, args.force_images)
+        _timed('handler_main_audio', tts_handler.handle_main_audio(row, word, word_hash, args.force_audio)),
+        _timed('handler_male_audio', tts_handler.handle_male_audio(row, word, word_hash, args.force_audio)),
+        _timed('handler_example_audio', tts_handler.handle_example_audio(row, example, args.force_audio)),
+        _timed('handler_image', ai_handler.handle_image(session, row, translation, word_hash, args.force_images))
     ]
     
     results = await asyncio.gather(*tasks)
@@ -200,116 +353,347 @@ def _handle_processing_error(e, word, error_counter):
        'timeout' in err_str or 'connection' in err_str or 'network' in err_str:
         logging.warning(f"🌐 Сетевая ошибка при обработке '{word}': {e}")
         error_counter['network'] += 1
+        metrics.inc('worker_errors_total', kind='network', error_class=type(e).__name__)
     else:
         logging.error(f"❌ Ошибка обработки слова '{word}': {e}")
         error_counter['other'] += 1
+        metrics.inc('worker_errors_total', kind='other', error_class=type(e).__name__)
 
-async def process_word(sem, session, row, error_counter):
-    """Обработка одного слова (асинхронно)"""
-    async with sem: # Ограничиваем количество одновременных задач
-        row_id = row.get('id')
-        word = row.get('word_kr')
-        
-        if not isinstance(row, dict) or not word or not isinstance(word, str):
-            return row_id
+async def process_word(session, row, error_counter, on_error=None):
+    """Обработка одного слова (асинхронно). Возвращает словарь обновлений или None при ошибке."""
+    word = row.get('word_kr') if isinstance(row, dict) else None
+    if not word or not isinstance(word, str):
+        return None
 
-        try:
-            updates_to_make = await _generate_content_for_word(session, row)
-            
-            if updates_to_make:
-                builder = supabase.table(DB_TABLES['VOCABULARY']).update(updates_to_make).eq("id", row_id)
-                await execute_supabase_query(builder)
-                return None # Успех
-            else:
-                return row_id
-        except Exception as e:
-            _handle_processing_error(e, word, error_counter)
-            return row_id
+    try:
+        return await _generate_content_for_word(session, row)
+    except Exception as e:
+        _handle_processing_error(e, word, error_counter)
+        if on_error:
+            await on_error(row, type(e).__name__, e)
+        return None
+
+async def write_word_updates(row, updates, on_written=None):
+    """Стадия writer конвейера: ставит ссылки на медиа в буфер пакетной записи.
+    on_written(row_id) вызывается, когда буфер записал строку в БД."""
+    row_id = row.get('id')
+    # Строки из vocabulary_media_queue несут failure_attempts; у строк из Realtime и force-режима
+    # состояние журнала неизвестно, поэтому для них запись удаляется всегда. Удаление идет
+    # одним запросом на сброс буфера и только для записанных строк (отмечаем до add — он может сбросить буфер)
+    if row.get('failure_attempts') or failure_ledger.has_failed(row_id) or 'failure_attempts' not in row:
+        failure_ledger.schedule_clear(row_id)
+    await media_writer.add(row_id, updates, on_written=on_written)
+    return True
 
-async def process_quote(sem, session, row):
-    """Асинхронная обработка одной цитаты"""
-    async with sem:
-        row_id = row.get('id')
+async def process_quote(work_class, row):
+    """Асинхронная обработка одной цитаты (слот планировщика класса work_class).
+    Возвращает True, если аудио записано; ошибки логируются, а не пробрасываются."""
+    row_id = row.get('id')
+    if row_id in quotes_in_flight:
+        return False
+    quotes_in_flight.add(row_id)
+    async with scheduler.slot(work_class):
         try:
             updates = await tts_handler.handle_quote_audio(row, args.force_audio or args.force_quotes)
             if updates:
-                builder = supabase.table(DB_TABLES['QUOTES']).update(updates).eq('id', row_id)
+                builder = db.table(DB_TABLES['QUOTES']).update(updates).eq('id', row_id)
                 await execute_supabase_query(builder)
+            return bool(updates)
         except Exception as e:
             logging.error(f"❌ Ошибка цитаты {row_id}: {e}")
+            return False
+        finally:
+            quotes_in_flight.discard(row_id)
 
-async def measure_network_quality():
-    """Измеряет задержку сети и возвращает оптимальное количество потоков."""
-    logging.info("📡 Анализ скорости соединения...")
-    test_url = "https://www.google.com"
-    start = time.time()
-    try:
-        async with aiohttp.ClientSession() as session:
-            # Делаем 3 легких запроса для усреднения
-            for _ in range(3):
-                async with session.get(test_url, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                    await response.read()
-        
-        duration = time.time() - start
-        avg_latency = duration / 3
-        
-        logging.info(f"⏱ Средний отклик: {avg_latency:.3f} сек.")
-        
-        if avg_latency < 0.15: return 25 # Отличный интернет
-        if avg_latency < 0.30: return 15 # Хороший
-        if avg_latency < 0.60: return 8  # Средний
-        if avg_latency < 1.00: return 4  # Медленный
-        return 2 # Очень медленный
-        
-    except Exception as e:
-        logging.warning(f"⚠️ Не удалось измерить скорость ({e}). Использую значение по умолчанию (5).")
-        return 5
+async def run_word_request(sem, session, req):
+    """Обработка одной заявки пользователя с ограничением по времени"""
+    async with sem, scheduler.slot(PriorityScheduler.USER):
+        req_id = req.get('id')
+        start = time.time()
+        cancelled = False
+        try:
+            await asyncio.wait_for(
+                ai_handler.process_word_request(req, session=session, content_gen_callback=_generate_content_for_word),
+                timeout=args.request_timeout
+            )
+            logging.info(f"⏱ Заявка '{req.get('word_kr')}' обработана за {time.time() - start:.1f} сек.")
+            metrics.inc('worker_requests_processed_total', result='ok')
+        except asyncio.TimeoutError:
+            logging.error(f"❌ Заявка '{req.get('word_kr')}' не уложилась в {args.request_timeout} сек.")
+            metrics.inc('worker_requests_processed_total', result='timeout')
+            metrics.inc('worker_errors_total', kind='request', error_class='TimeoutError')
+            try:
+                builder = db.table(DB_TABLES['WORD_REQUESTS']).update({'status': WORD_REQUEST_STATUS['ERROR'], 'my_notes': 'Worker Timeout'}).eq('id', req_id)
+                await execute_supabase_query(builder)
+            except Exception as e:
+                logging.warning(f"⚠️ Не удалось отметить заявку {req_id} как ошибочную: {e}")
+        except Exception as e:
+            logging.error(f"❌ Ошибка обработки заявки {req_id}: {e}")
+            metrics.inc('worker_requests_processed_total', result='error')
+            metrics.inc('worker_errors_total', kind='request', error_class=type(e).__name__)
+        except asyncio.CancelledError:
+            # Остановка не дождалась заявки — она останется за воркером и вернется в очередь (requeue_held)
+            cancelled = True
+            logging.warning(f"🛑 Заявка '{req.get('word_kr')}' прервана остановкой воркера.")
+            raise
+        finally:
+            if not cancelled:
+                request_leases.release(req_id)
 
 async def user_requests_loop(trigger_event):
     """Приоритетный цикл для обработки заявок пользователей"""
-    logging.info("👀 Запущен мониторинг пользовательских заявок (Приоритетный поток)...")
+    request_concurrency = max(1, args.request_concurrency)
+    logging.info(f"👀 Запущен мониторинг пользовательских заявок (Приоритетный поток, слотов: {request_concurrency})...")
     
     # Настройки Backoff (умного ожидания)
     min_sleep = 2
     max_sleep = 30
     current_sleep = min_sleep
 
-    while True:
+    sem = asyncio.Semaphore(request_concurrency)
+    in_flight = set()
+
+    session = http_pool.session
+    while not shutdown_event.is_set():
         try:
-            # Всегда проверяем заявки
-            builder = supabase.table(DB_TABLES['WORD_REQUESTS']).select("*").eq('status', WORD_REQUEST_STATUS['PENDING']).limit(5)
-            reqs = await execute_supabase_query(builder)
-            if reqs and reqs.data:
-                logging.info(f"⚡ Найдено {len(reqs.data)} новых заявок от пользователей.")
-                async with aiohttp.ClientSession() as session:
-                    for req in reqs.data:
-                        await ai_handler.process_word_request(req, session=session, content_gen_callback=_generate_content_for_word)
+            # Захватываем ровно столько заявок, сколько есть свободных слотов
+            free_slots = request_concurrency - len(in_flight)
+            reqs = []
+            if free_slots > 0:
+                # Сначала заявки из Realtime: захват по id без поиска по таблице
+                pushed = take_pushed_requests(free_slots)
+                if pushed:
+                    reqs = await request_leases.claim_ids(pushed)
+                    if not reqs:
+                        # Заявки перехватил другой воркер — обычный опрос на следующем круге
+                        continue
+                else:
+                    reqs = await request_leases.claim(free_slots)
+            if reqs:
+                logging.info(f"⚡ Захвачено {len(reqs)} новых заявок от пользователей (в работе: {len(in_flight) + len(reqs)}).")
+                for req in reqs:
+                    task = asyncio.create_task(run_word_request(sem, session, req))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
                 # Если были задачи, сбрасываем таймер и проверяем снова быстро
                 current_sleep = min_sleep
                 await asyncio.sleep(0.1)
+                continue
+
+            # Ждем события от Realtime, освобождения слота, остановки ИЛИ истечения таймера (Backoff)
+            waiter = asyncio.create_task(trigger_event.wait())
+            stopper = asyncio.create_task(shutdown_event.wait())
+            done, _ = await asyncio.wait({waiter, stopper, *in_flight}, timeout=current_sleep, return_when=asyncio.FIRST_COMPLETED)
+            stopper.cancel()
+            if stopper in done:
+                waiter.cancel()
+                break
+            if waiter in done:
+                trigger_event.clear() # Сбрасываем событие
+                logging.info("⚡ Воркер разбужен событием Realtime!")
+                current_sleep = min_sleep # Сразу сбрасываем сон для быстрой реакции
             else:
-                # Ждем события от Realtime ИЛИ истечения таймера (Backoff)
-                try:
-                    await asyncio.wait_for(trigger_event.wait(), timeout=current_sleep)
-                    trigger_event.clear() # Сбрасываем событие
-                    logging.info("⚡ Воркер разбужен событием Realtime!")
-                    current_sleep = min_sleep # Сразу сбрасываем сон для быстрой реакции
-                except asyncio.TimeoutError:
+                waiter.cancel()
+                if done:
+                    # Освободился слот — сразу проверяем очередь снова
+                    current_sleep = min_sleep
+                else:
                     # Если событие не пришло за время current_sleep, увеличиваем время сна
                     current_sleep = min(current_sleep * 1.5, max_sleep)
-                    
+
         except Exception as e:
             logging.error(f"❌ Ошибка в цикле заявок: {e}")
-            await asyncio.sleep(5)
+            await wait_for_shutdown(5)
+
+    # Остановка: новые заявки не берем, дорабатываем начатые в пределах drain-timeout
+    if in_flight:
+        logging.info(f"⏳ Дорабатываю {len(in_flight)} заявок (до {args.drain_timeout:.0f} сек)...")
+        _, pending = await asyncio.wait(set(in_flight), timeout=args.drain_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logging.warning(f"🛑 {len(pending)} заявок не успели завершиться и будут возвращены в очередь.")
+
+async def process_realtime_word(row):
+    """Немедленная обработка слова из Realtime: те же стадии, что у конвейера опроса."""
+    row_id = row.get('id')
+    error_counter = {'network': 0, 'other': 0}
+
+    async def record_failure(row, error_class, error):
+        await failure_ledger.record_failure(row.get('id'), error_class, error)
+
+    try:
+        async with scheduler.slot('words'):
+            updates = await process_word(http_pool.session, row, error_counter, on_error=record_failure)
+        if updates is None:
+            metrics.inc('worker_words_processed_total', result='error')
+        elif not updates:
+            metrics.inc('worker_words_processed_total', result='empty')
+            await record_failure(row, 'NoContent', 'No media generated')
+        else:
+            metrics.inc('worker_words_processed_total', result='ok')
+            await write_word_updates(row, updates)
+    finally:
+        mark_processed(row_id)
+
+async def realtime_media_loop():
+    """Разбирает очередь Realtime: слова и цитаты уходят в работу сразу (через планировщик).
+
+    Следующее событие берется из очереди только при свободном месте (REALTIME_CONSUMERS),
+    поэтому лимит очереди действует: при массовом импорте лишние события отбрасываются
+    и подхватываются опросом, а не копятся тысячами задач.
+    """
+    in_flight = set()
+    capacity = asyncio.Semaphore(REALTIME_CONSUMERS)
+    while not shutdown_event.is_set():
+        try:
+            await asyncio.wait_for(capacity.acquire(), timeout=1)
+        except asyncio.TimeoutError:
+            continue
+        try:
+            kind, row = await asyncio.wait_for(realtime_media_queue.get(), timeout=1)
+        except asyncio.TimeoutError:
+            capacity.release()
+            continue
+        if kind == 'word':
+            logging.info(f"⚡ Realtime: слово '{row.get('word_kr')}' (id={row.get('id')}) отправлено на генерацию медиа.")
+            coro = process_realtime_word(row)
+        else:
+            logging.info(f"⚡ Realtime: цитата id={row.get('id')} отправлена на озвучку.")
+            coro = process_quote('quotes', row)
+        task = asyncio.create_task(coro)
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        task.add_done_callback(lambda _: capacity.release())
+
+    if in_flight:
+        _, pending = await asyncio.wait(set(in_flight), timeout=args.drain_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+async def quotes_loop():
+    """Озвучка цитат через общий планировщик (класс 'quotes', при --force-audio/--force-quotes — 'force').
+
+    Цитаты читаются страницами по ключу (id > cursor) и идут в планировщик наравне со словами
+    по весам, поэтому не задерживают обработку словаря и не голодают сами.
+    """
+    force = args.force_audio or args.force_quotes
+    work_class = 'force' if force else 'quotes'
+    cursor = None
+    min_sleep, max_sleep = 5, 300
+    current_sleep = min_sleep
+
+    while not shutdown_event.is_set():
+        try:
+            q_query = db.table(DB_TABLES['QUOTES']).select("*")
+            if not force:
+                # Обрабатываем те, у которых нет аудио (NULL или пустая строка)
+                q_query = q_query.or_("audio_url.is.null,audio_url.eq.")
+            if cursor is not None:
+                q_query = q_query.gt("id", cursor)
+            q_res = await execute_supabase_query(q_query.order("id").limit(QUOTES_PAGE_SIZE))
+            quotes = [q for q in (q_res.data if q_res else []) if isinstance(q, dict)]
+
+            if quotes:
+                logging.info(f"📜 Найдено {len(quotes)} цитат для озвучки.")
+                cursor = quotes[-1].get('id')
+                await asyncio.gather(*[process_quote(work_class, r) for r in quotes])
+                current_sleep = min_sleep
+                if len(quotes) == QUOTES_PAGE_SIZE:
+                    continue
+
+            # Дошли до конца таблицы
+            cursor = None
+            if force:
+                logging.info("🏁 Обработка цитат завершена.")
+                break
+            await wait_for_shutdown(current_sleep)
+            # Новые цитаты приходят через Realtime; опрос — редкая страховка
+            current_sleep = min(current_sleep * 2, SAFETY_NET_POLL_INTERVAL if realtime_handler.is_connected() else max_sleep)
+        except Exception as e:
+            logging.warning(f"⚠️ Пропуск цитат (возможно нет колонки audio_url): {e}")
+            await wait_for_shutdown(60)
+
+async def warm_tts_cache():
+    """Прогрев кэша TTS: озвучивает слова (оба голоса), примеры и цитаты из БД.
+
+    Ничего не загружает в Storage и не меняет строки — после прогрева обычный
+    прогон (в том числе с --force-audio) берет аудио с диска, а не из edge-tts.
+    Уже закэшированные фразы edge-tts не вызывают, поэтому прогрев можно прерывать и повторять.
+    """
+    if not tts_gen.cache:
+        logging.error("❌ Кэш TTS отключен (--tts-cache-mb 0) — прогревать нечего.")
+        return
+
+    sem = asyncio.Semaphore(WORD_CONSUMERS)
+    done = 0
+
+    async def synth(generate, *call_args):
+        nonlocal done
+        async with sem:
+            if shutdown_event.is_set():
+                return
+            await generate(*call_args)
+            done += 1
+
+    def word_jobs(row):
+        word = row.get('word_kr')
+        jobs = []
+        if word:
+            jobs.append(synth(tts_gen.generate_audio_file, word, tts_gen.voice_female))
+            jobs.append(synth(tts_gen.generate_audio_file, word, tts_gen.voice_male))
+        example = row.get('example_kr')
+        if example and isinstance(example, str):
+            # Тот же выбор, что в TTSHandler.handle_example_audio
+            if re.search(r'(^|\n)[AaBb가나]\s*:', example):
+                jobs.append(synth(tts_gen.generate_dialogue, example))
+            else:
+                jobs.append(synth(tts_gen.generate_audio_file, example, tts_gen.voice_female))
+        return jobs
+
+    logging.info(f"🔥 Прогрев кэша TTS ({TTS_CACHE_DIR})...")
+    def quote_jobs(row):
+        text = row.get('quote_kr')
+        return [synth(tts_gen.generate_audio_file, text, tts_gen.voice_female)] if text else []
+
+    # (таблица, колонки, размер страницы, задачи по строке, делится ли по шардам)
+    tables = [(DB_TABLES['VOCABULARY'], "id,word_kr,example_kr", WORDS_PAGE_SIZE, word_jobs, True)]
+    if IS_PRIMARY_SHARD:
+        tables.append((DB_TABLES['QUOTES'], "id,quote_kr", QUOTES_PAGE_SIZE, quote_jobs, False))
+
+    for table, columns, page_size, make_jobs, sharded in tables:
+        cursor = None
+        while not shutdown_event.is_set():
+            query = db.table(table).select(columns)
+            if cursor is not None:
+                query = query.gt("id", cursor)
+            res = await execute_supabase_query(query.order("id").limit(page_size))
+            rows = [r for r in (res.data if res else []) if isinstance(r, dict)]
+            if not rows:
+                break
+            cursor = rows[-1].get('id')
+            jobs = [job for row in rows if not sharded or in_shard(row.get('id')) for job in make_jobs(row)]
+            await asyncio.gather(*jobs)
+            logging.info(f"🔥 {table}: до id {cursor}, озвучено фраз {done}")
+            tts_gen.cache.log_state()
+            if len(rows) < page_size:
+                break
+
+    logging.info(f"🏁 Прогрев кэша TTS завершен: фраз {done}.")
+    tts_gen.cache.log_state()
 
 async def background_tasks_loop(initial_concurrency):
     """Фоновый цикл для обслуживания контента (цитаты, пропуски)"""
-    concurrency = initial_concurrency
-    logging.info(f"🛠 Запущены фоновые задачи (Начальных потоков: {concurrency})...")
+    global active_pipeline
+    if initial_concurrency:
+        limiters.set_initial_limits(initial_concurrency)
+    logging.info(f"🛠 Запущены фоновые задачи (Стартовый лимит зависимостей: {initial_concurrency or 'по умолчанию'})...")
     
     last_reset_time = 0
 
-    # Локальный кэш игнорируемых ID (чтобы не долбить одни и те же ошибки)
+    # Локальный кэш игнорируемых ID — только если журнал media_failures недоступен
     ignore_ids = set()
 
     # Настройки Backoff
@@ -317,116 +701,171 @@ async def background_tasks_loop(initial_concurrency):
     max_sleep = 120 # До 2 минут простоя, если нет задач
     current_sleep = min_sleep
 
-    while True:
+    while not shutdown_event.is_set():
         try:
-            # Автоматический сброс ошибок каждые 10 минут (600 сек)
-            if time.time() - last_reset_time > 600:
-                await reset_failed_requests(supabase)
-                last_reset_time = time.time()
+            # Обслуживание — только в основном шарде
+            if IS_PRIMARY_SHARD:
+                # Автоматический сброс ошибок каждые 10 минут (600 сек)
+                if time.time() - last_reset_time > 600:
+                    await reset_failed_requests(db)
+                    last_reset_time = time.time()
 
-            cleanup_temp_files()
-            
-            # 0.5. Обработка цитат (Quotes)
-            try:
-                q_query = supabase.table(DB_TABLES['QUOTES']).select("*")
-                if not (args.force_audio or args.force_quotes):
-                    # Обрабатываем те, у которых нет аудио (NULL или пустая строка)
-                    q_query = q_query.or_("audio_url.is.null,audio_url.eq.")
-                
-                # FIX: Ограничиваем лимит цитат за раз, чтобы чаще проверять заявки пользователей
-                q_query = q_query.limit(5)
-                q_res = await execute_supabase_query(q_query)
-                quotes = q_res.data if q_res else []
-                
-                if quotes:
-                    logging.info(f"📜 Найдено {len(quotes)} цитат для озвучки.")
-                    q_sem = asyncio.Semaphore(concurrency)
-                    async with aiohttp.ClientSession() as session:
-                        await asyncio.gather(*[process_quote(q_sem, session, r) for r in quotes])
-            except Exception as e:
-                logging.warning(f"⚠️ Пропуск цитат (возможно нет колонки audio_url): {e}")
+                cleanup_temp_files()
 
-            # Запрос к БД (синхронный, но быстрый)
-            try:
-                # Если включен режим только для цитат, пропускаем слова
-                if args.force_quotes and not (args.force_images or args.force_audio):
-                    words = []
+            if shutdown_event.is_set():
+                break
+
+            # Если включен режим только для цитат, пропускаем слова (цитаты обрабатывает quotes_loop)
+            if args.force_quotes and not (args.force_images or args.force_audio):
+                break
+
+            force_mode = args.force_images or args.force_audio
+            error_counter = {'network': 0, 'other': 0}
+
+            # Курсор сохраняется на диск: после перезапуска скан продолжится с места остановки
+            scan_key = f"vocabulary:{'force' if force_mode else 'missing'}:{args.topic or ''}:{args.word or ''}"
+            scan_cursor = ScanCursor(scan_key, path=SCAN_STATE_FILE)
+            if scan_cursor.committed is not None:
+                logging.info(f"↪️ Продолжаю сканирование словаря с id > {scan_cursor.committed}")
+
+            # Обычный режим читает представление, которое скрывает слова с еще не наступившим повтором
+            use_media_queue = failure_ledger.enabled and not force_mode
+            source_table = DB_TABLES['VOCABULARY_MEDIA_QUEUE'] if use_media_queue else DB_TABLES['VOCABULARY']
+            columns = f"{WORD_MEDIA_COLUMNS},failure_attempts" if use_media_queue else WORD_MEDIA_COLUMNS
+
+            async def fetch_words_page(cursor):
+                """Страница слов по ключу (id > cursor), без повторного чтения уже пройденных строк."""
+                query = db.table(source_table).select(columns)
+                if not force_mode:
+                    query = query.or_("audio_url.is.null,audio_male.is.null,image.is.null,example_audio.is.null")
+                if args.topic:
+                    query = query.ilike("topic", f"%{args.topic}%")
+                if args.word:
+                    query = query.eq("word_kr", args.word)
+                if cursor is not None:
+                    query = query.gt("id", cursor)
+                query = query.order("id").limit(WORDS_PAGE_SIZE)
+
+                response = await execute_supabase_query(query)
+                rows = [w for w in (response.data if response else []) if isinstance(w, dict)]
+                next_cursor = rows[-1].get('id') if len(rows) == WORDS_PAGE_SIZE else None
+                # Фильтруем слова, которые уже пытались обработать и не смогли, и слова чужих шардов
+                kept = [w for w in rows if w.get('id') not in ignore_ids and in_shard(w.get('id'))]
+                if rows:
+                    scan_cursor.page_fetched(rows[-1].get('id'), [w.get('id') for w in kept])
+                return kept, next_cursor
+
+            async def record_row_failure(row, error_class, error):
+                if failure_ledger.enabled:
+                    await failure_ledger.record_failure(row.get('id'), error_class, error, known_attempts=row.get('failure_attempts'))
                 else:
-                    if args.force_images or args.force_audio:
-                        query = supabase.table(DB_TABLES['VOCABULARY']).select("*")
-                    else:
-                        # Берем больше слов за раз для эффективности
-                        query = supabase.table(DB_TABLES['VOCABULARY']).select("*").or_("audio_url.is.null,audio_male.is.null,image.is.null,example_audio.is.null").limit(200)
-                    
-                    if args.topic:
-                        query = query.ilike("topic", f"%{args.topic}%")
-
-                    if args.word:
-                        query = query.eq("word_kr", args.word)
-
-                    response = await execute_supabase_query(query)
-                    words = response.data if response else []
-                    # Фильтруем слова, которые уже пытались обработать и не смогли
-                    words = [w for w in words if isinstance(w, dict) and w.get('id') not in ignore_ids]
-            except Exception as e:
-                logging.error(f"Ошибка БД: {e}")
-                words = []
+                    # Без журнала — не пытаемся снова в этой сессии
+                    ignore_ids.add(row.get('id'))
 
-            if not words:
-                if args.force_quotes:
-                    logging.info("🏁 Обработка цитат завершена.")
-                    break
-                elif not args.force_images and not args.force_audio:
-                    if current_sleep < max_sleep:
-                        logging.info(f"💤 Нет новых слов. Сплю {current_sleep:.1f} сек...")
-                    await asyncio.sleep(current_sleep)
-                    current_sleep = min(current_sleep * 1.5, max_sleep)
+            work_class = 'force' if force_mode else 'words'
+
+            # Строки, чьи обновления ждут записи в буфере: курсор по ним сдвигает сам буфер после записи,
+            # иначе сбой до сброса буфера оставил бы курсор за строками, которых нет в БД
+            awaiting_write = set()
+
+            async def write_row(row, updates):
+                row_id = row.get('id')
+                awaiting_write.add(row_id)
+                def written(rid):
+                    awaiting_write.discard(rid)
+                    scan_cursor.row_done(rid)
+                return await write_word_updates(row, updates, on_written=written)
+
+            def on_row_done(row):
+                if row.get('id') not in awaiting_write:
+                    scan_cursor.row_done(row.get('id'))
+
+            async def process_row(row):
+                row_id = row.get('id')
+                if row_id in media_in_flight:
+                    # Слово уже обрабатывается по событию Realtime
+                    return {}
+                media_in_flight.add(row_id)
+                try:
+                    async with scheduler.slot(work_class):
+                        updates = await process_word(session, row, error_counter, on_error=record_row_failure)
+                finally:
+                    mark_processed(row_id)
+                if updates is None:
+                    metrics.inc('worker_words_processed_total', result='error')
+                elif not updates:
+                    # Ничего не удалось сгенерировать — тоже считаем попыткой
+                    metrics.inc('worker_words_processed_total', result='empty')
+                    await record_row_failure(row, 'NoContent', 'No media generated')
                 else:
+                    metrics.inc('worker_words_processed_total', result='ok')
+                return updates
+
+            logging.info(f"🔥 Запуск конвейера обработки слов... (Обработчиков: {WORD_CONSUMERS})")
+
+            session = http_pool.session
+            pipeline = active_pipeline = MediaPipeline(
+                fetch_words_page, process_row, write_row, consumers=WORD_CONSUMERS,
+                start_cursor=scan_cursor.committed, on_row_done=on_row_done
+            )
+            # По сигналу остановки конвейер перестает брать строки и дорабатывает начатые
+            stop_watcher = asyncio.create_task(shutdown_event.wait())
+            stop_watcher.add_done_callback(lambda t: None if t.cancelled() else pipeline.stop())
+            try:
+                stats = await pipeline.run()
+            finally:
+                active_pipeline = None
+                stop_watcher.cancel()
+            await media_writer.flush()
+            if pipeline.stopped:
+                # Проход не закончен: курсор не сбрасываем, следующий запуск продолжит с него
+                logging.info(f"🛑 Проход прерван остановкой: {pipeline.report()}; отложено строк: {pipeline.dropped}")
+                metrics.log_pass_summary()
+                break
+            # Проход дошел до конца таблицы — следующий начнется сначала
+            scan_cursor.reset()
+            batch_size = stats['process'].count
+            logging.info(f"📊 Итог прохода: {pipeline.report()}")
+            metrics.log_pass_summary()
+            media_writer.log_stats()
+            http_pool.log_stats()
+
+            if batch_size == 0:
+                if force_mode:
                     logging.info("🏁 Обработка завершена (force mode).")
                     break
+                if current_sleep < max_sleep:
+                    logging.info(f"💤 Нет новых слов. Сплю {current_sleep:.1f} сек...")
+                await wait_for_shutdown(current_sleep)
+                # Новые слова приходят через Realtime; опрос — редкая страховка
+                current_sleep = min(current_sleep * 1.5, SAFETY_NET_POLL_INTERVAL if realtime_handler.is_connected() else max_sleep)
                 continue
-            
+
             # Если задачи найдены - сбрасываем таймер сна
             current_sleep = min_sleep
 
-            logging.info(f"🔥 Запуск обработки {len(words)} слов... (Потоков: {concurrency})")
-            
-            sem = asyncio.Semaphore(concurrency)
-            error_counter = {'network': 0, 'other': 0}
+            # Параллелизм каждой зависимости (TTS, Storage, Edge image) подстраивается своим AIMD-лимитером
+            limiters.log_state()
+            network_quality.log_state()
+            rate_limits.log_state()
+            scheduler.log_state()
+            audio_index.log_state()
+            single_flight.log_state()
+            if tts_gen.cache:
+                tts_gen.cache.log_state()
+            if error_counter['network'] or error_counter['other']:
+                logging.info(f"🌐 Ошибок за проход: сетевых {error_counter['network']}, прочих {error_counter['other']}")
 
-            async with aiohttp.ClientSession() as session:
-                tasks = [process_word(sem, session, row, error_counter) for row in words]
-                results = await asyncio.gather(*tasks)
-                
-                # Добавляем проблемные ID в список игнорирования
-                for res in results:
-                    if res: ignore_ids.add(res)
-                
-                await asyncio.sleep(0.1) # Yield to event loop to prevent socket starvation on Windows
-
-            # --- Логика адаптивной конкурентности ---
-            batch_size = len(words)
-            if batch_size > 0:
-                network_error_rate = (error_counter['network'] / batch_size) * 100
-                
-                # Снижаем, если >15% задач в пачке упали с сетевой ошибкой
-                if network_error_rate > 15.0:
-                    new_concurrency = max(1, int(concurrency * 0.7)) # Уменьшаем на 30%
-                    if new_concurrency < concurrency:
-                        logging.warning(f"📉 Высокий уровень сетевых ошибок ({network_error_rate:.1f}%). Снижаю количество потоков с {concurrency} до {new_concurrency}.")
-                        concurrency = new_concurrency
-                # Повышаем, если не было ошибок и мы не на максимуме
-                elif error_counter['network'] == 0 and concurrency < 25:
-                    new_concurrency = min(25, concurrency + 1) # Увеличиваем на 1
-                    if new_concurrency > concurrency:
-                        logging.info(f"📈 Сеть стабильна. Увеличиваю количество потоков до {new_concurrency}.")
-                        concurrency = new_concurrency
-
-            logging.info(f"✨ Пачка обработана. Проблемных в этой сессии: {len(ignore_ids)}")
+            ls = failure_ledger.stats
+            logging.info(f"✨ Проход завершен. Ошибок в журнале: +{ls['recorded']} (исчерпали бюджет: {ls['exhausted']}, вылечено: {ls['healed']}), в памяти: {len(ignore_ids)}")
+
+            if force_mode:
+                logging.info("🏁 Обработка завершена (force mode).")
+                break
 
         except Exception as main_e:
             logging.error(f"🔥 Критическая ошибка цикла: {main_e}")
-            await asyncio.sleep(60)
+            await wait_for_shutdown(60)
 
 def check_schema_health():
     """Проверяет наличие необходимых колонок в ключевых таблицах."""
@@ -440,7 +879,8 @@ def check_schema_health():
             'grammar_info', 'created_by', 'is_public'
         ],
         DB_TABLES['WORD_REQUESTS']: [
-            'id', 'word_kr', 'status', 'my_notes', 'target_list_id', 'user_id', 'translation'
+            'id', 'word_kr', 'status', 'my_notes', 'target_list_id', 'user_id', 'translation',
+            'claimed_by', 'lease_expires_at'
         ],
         DB_TABLES['QUOTES']: [
             'id', 'quote_kr', 'audio_url'
@@ -487,33 +927,209 @@ def validate_gemini_key():
     except Exception as e:
         logging.error(f"❌ Ошибка проверки ключа Gemini API: {e}")
 
+def apply_rate_limit_args():
+    """Применяет лимиты частоты из --rate-limit KEY=RATE[/BURST]."""
+    for spec in args.rate_limit:
+        try:
+            key, value = spec.split('=', 1)
+            rate, _, burst = value.partition('/')
+            rate_limits.set_rate(key.strip(), float(rate), int(burst) if burst else None)
+            logging.info(f"🪣 Лимит частоты {key.strip()}: {rate}/сек" + (f", всплеск {burst}" if burst else ""))
+        except ValueError:
+            logging.warning(f"⚠️ Некорректный --rate-limit '{spec}' (ожидается KEY=RATE[/BURST]).")
+
+def collect_worker_gauges():
+    """Текущее состояние воркера для /metrics: очереди, заявки в работе, лимиты зависимостей.
+    Вызывается в event loop (metrics.refresh_gauges), поток HTTP-сервера читает только снимок."""
+    gauges = [
+        ('worker_queue_depth', {'queue': 'write_behind'}, len(media_writer.pending)),
+        ('worker_queue_depth', {'queue': 'realtime'}, realtime_media_queue.qsize()),
+        ('worker_requests_in_flight', {}, len(request_leases.held)),
+    ]
+    if active_pipeline is not None:
+        gauges.append(('worker_queue_depth', {'queue': 'pipeline_work'}, active_pipeline.work_queue.qsize()))
+        gauges.append(('worker_queue_depth', {'queue': 'pipeline_results'}, active_pipeline.result_queue.qsize()))
+    for cls, s in scheduler.snapshot().items():
+        gauges.append(('worker_scheduler_in_use', {'work_class': cls}, s['in_use']))
+        gauges.append(('worker_scheduler_waiting', {'work_class': cls}, s['waiting']))
+    for name, s in limiters.snapshot().items():
+        gauges.append(('worker_concurrency_limit', {'dependency': name}, s['limit']))
+        gauges.append(('worker_concurrency_in_flight', {'dependency': name}, s['in_flight']))
+    for name, s in network_quality.snapshot().items():
+        if s['latency_ewma'] is not None:
+            gauges.append(('worker_endpoint_latency_seconds', {'endpoint': name, 'stat': 'ewma'}, s['latency_ewma']))
+            gauges.append(('worker_endpoint_latency_seconds', {'endpoint': name, 'stat': 'p95'}, s['latency_p95']))
+        if s['throughput'] is not None:
+            gauges.append(('worker_endpoint_throughput_bytes_per_second', {'endpoint': name}, s['throughput']))
+        gauges.append(('worker_endpoint_error_ratio', {'endpoint': name}, s['error_rate']))
+    return gauges
+
+def start_metrics_server():
+    if args.metrics_port <= 0:
+        return None
+    metrics.describe('worker_queue_depth', 'gauge', 'Глубина очередей (конвейер, буфер записи)')
+    metrics.describe('worker_requests_in_flight', 'gauge', 'Заявки пользователей в работе')
+    metrics.describe('worker_concurrency_limit', 'gauge', 'Текущий AIMD-лимит параллелизма зависимости')
+    metrics.describe('worker_concurrency_in_flight', 'gauge', 'Вызовы зависимости в работе')
+    metrics.describe('worker_scheduler_in_use', 'gauge', 'Занятые слоты планировщика по классу работы')
+    metrics.describe('worker_scheduler_waiting', 'gauge', 'Задачи, ожидающие слот планировщика')
+    metrics.describe('worker_endpoint_latency_seconds', 'gauge', 'Скользящая задержка внешнего сервиса (EWMA и p95)')
+    metrics.describe('worker_endpoint_throughput_bytes_per_second', 'gauge', 'Скользящая пропускная способность внешнего сервиса')
+    metrics.describe('worker_endpoint_error_ratio', 'gauge', 'Скользящая доля ошибок вызовов внешнего сервиса')
+    metrics.describe('worker_storage_reused_total', 'counter', 'Файлы, взятые из Storage без синтеза и загрузки')
+    metrics.describe('worker_singleflight_shared_total', 'counter', 'Вызовы TTS и Gemini, дождавшиеся уже идущего одинакового вызова')
+    metrics.describe('worker_tts_cache_total', 'counter', 'Обращения к дисковому кэшу TTS (попадание / промах / вытеснение)')
+    metrics.describe('worker_http_requests_total', 'counter', 'HTTP-запросы через общий пул aiohttp (Edge Functions, картинки)')
+    metrics.describe('worker_http_connections_total', 'counter', 'Соединения пула aiohttp: открытые заново и взятые из пула')
+    metrics.describe('worker_http_dns_cache_total', 'counter', 'Обращения к DNS-кэшу пула aiohttp (попадание / промах)')
+    metrics.describe('worker_realtime_events_total', 'counter', 'События Realtime по таблице и решению (в очередь / пропущено)')
+    metrics.register_gauge_callback(collect_worker_gauges)
+    try:
+        return metrics.start_server(args.metrics_port, args.metrics_host)
+    except OSError as e:
+        logging.warning(f"⚠️ Не удалось запустить сервер метрик на порту {args.metrics_port}: {e}")
+        return None
+
+def install_signal_handlers(main_task):
+    """SIGINT/SIGTERM запускают мягкую остановку; повторный сигнал прерывает воркер сразу."""
+    loop = asyncio.get_running_loop()
+
+    def request_shutdown(sig_name):
+        if shutdown_event.is_set():
+            logging.warning(f"⛔ Повторный {sig_name}: немедленная остановка.")
+            main_task.cancel()
+            return
+        logging.info(f"🛑 Получен {sig_name}: прекращаю прием работы, дорабатываю начатое (до {args.drain_timeout:.0f} сек)...")
+        shutdown_event.set()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, sig.name)
+        except (NotImplementedError, RuntimeError):
+            # Windows: add_signal_handler не поддерживается, используем обычный обработчик
+            signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(request_shutdown, signal.Signals(signum).name))
+
 async def main_loop():
-    logging.info("🚀 Воркер запущен (Parallel Mode).")
+    global db
+    logging.info(f"🚀 Воркер запущен (Parallel Mode). ID: {request_leases.worker_id}")
+    install_signal_handlers(asyncio.current_task())
+    apply_rate_limit_args()
+    if IS_SHARDED:
+        # Квоты сервисов общие для всех процессов — каждому шарду достается своя доля
+        rate_limits.scale_all(1 / args.shard_count)
+        logging.info(f"🧩 Шард {args.shard_index} из {args.shard_count}: слова с id % {args.shard_count} == {args.shard_index}.")
+    metrics_server = start_metrics_server()
+    if args.timings_jsonl:
+        metrics.set_span_log(args.timings_jsonl)
     
-    concurrency = args.concurrency
-    if concurrency == 0:
-        concurrency = await measure_network_quality()
-        logging.info(f"⚡ Автоматически установлено потоков для фона: {concurrency}")
+    # Качество связи оценивается по реальным вызовам Supabase, edge-tts и Gemini
+    metrics.add_span_listener(network_quality.on_span)
+
+    # Повторный синтез одинаковых фраз (перезапуски, --force-audio, совпадающие примеры) берется с диска
+    if args.tts_cache_mb > 0:
+        # Лимит общий на все процессы — каждому шарду достается своя доля
+        tts_gen.set_cache(TTSCache(TTS_CACHE_DIR, args.tts_cache_mb * 1024 * 1024 // args.shard_count))
     
+    ensure_buckets()
+
     # Проверка схемы перед запуском
     if not check_schema_health():
         sys.exit(1)
         
     # Проверка ключа AI
     validate_gemini_key()
+
+    # Неблокирующий путь к БД через async клиент
+    try:
+        db = await init_async_supabase(SUPABASE_URL, SUPABASE_KEY)
+        ai_handler.set_db_client(db)
+        request_leases.set_db_client(db)
+        media_writer.set_db_client(db)
+        failure_ledger.set_db_client(db)
+        logging.info("✅ Запросы к БД идут через Async Supabase клиент.")
+    except Exception as e:
+        logging.warning(f"⚠️ Async клиент недоступен ({e}). Запросы к БД пойдут через пул потоков.")
     
+    # Журнал ошибок медиа (если миграция не применена — работаем по-старому, с кэшем в памяти)
+    await failure_ledger.check()
+
+    if args.warm_tts_cache:
+        try:
+            await warm_tts_cache()
+        finally:
+            if metrics_server:
+                metrics_server.shutdown()
+            metrics.set_span_log(None)
+        return
+
     # Сброс ошибок при старте
-    await reset_failed_requests(supabase)
+    if IS_PRIMARY_SHARD:
+        await reset_failed_requests(db)
+
+    # Список уже загруженного аудио (без него обработчики просто синтезируют всё, как раньше)
+    try:
+        await audio_index.refresh(full=True)
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось прочитать список файлов бакета '{DB_BUCKETS['AUDIO']}': {e}")
     
     # Событие для пробуждения воркера
     request_trigger = asyncio.Event()
-    
-    # Запускаем оба цикла параллельно
-    await asyncio.gather(
-        user_requests_loop(request_trigger),
-        background_tasks_loop(concurrency),
-        realtime_loop(request_trigger, SUPABASE_URL, SUPABASE_KEY)
-    )
+
+    # Единая HTTP-сессия с пулом соединений на всё время работы воркера
+    await http_pool.start()
+    # Рабочие циклы завершаются сами по сигналу остановки, служебные — отменяются после них
+    workers = [
+        asyncio.create_task(user_requests_loop(request_trigger)),
+        asyncio.create_task(background_tasks_loop(args.concurrency)),
+    ]
+    if IS_PRIMARY_SHARD:
+        # У цитат нет аренды — их обрабатывает только основной шард
+        workers.append(asyncio.create_task(quotes_loop()))
+    workers.append(asyncio.create_task(realtime_media_loop()))
+    services = [
+        asyncio.create_task(realtime_loop(
+            request_trigger, SUPABASE_URL, SUPABASE_KEY,
+            on_request=enqueue_realtime_request,
+            on_vocabulary=None if args.force_images or args.force_audio else enqueue_realtime_word,
+            on_quote=enqueue_realtime_quote if IS_PRIMARY_SHARD else None
+        )),
+        asyncio.create_task(request_leases.renew_loop()),
+        asyncio.create_task(audio_index.refresh_loop()),
+        asyncio.create_task(media_writer.run()),
+        asyncio.create_task(metrics.monitor_loop_lag()),
+    ]
+    try:
+        stopper = asyncio.create_task(shutdown_event.wait())
+        # Ждем сигнала остановки; падение любого цикла тоже завершает воркер
+        running = {stopper, *workers, *services}
+        while stopper in running:
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not stopper and not task.cancelled() and task.exception():
+                    raise task.exception()
+        # Дорабатываем начатое (аренда заявок продолжает продлеваться)
+        _, pending = await asyncio.wait(workers, timeout=args.drain_timeout + 5)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    finally:
+        shutdown_event.set()
+        for task in services + workers:
+            task.cancel()
+        await asyncio.gather(*services, *workers, return_exceptions=True)
+        # Дописываем накопленные обновления медиа и возвращаем незавершенные заявки в очередь
+        await media_writer.close()
+        try:
+            await request_leases.requeue_held()
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось вернуть заявки в очередь: {e}")
+        media_writer.log_stats()
+        http_pool.log_stats()
+        await http_pool.close()
+        if metrics_server:
+            metrics_server.shutdown()
+        metrics.set_span_log(None)
+        logging.info("🛑 Воркер остановлен.")
 
 if __name__ == "__main__":
     try:
@@ -522,6 +1138,12 @@ if __name__ == "__main__":
         # if sys.platform == 'win32':
         #     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
             
-        asyncio.run(main_loop())
-    except KeyboardInterrupt:
+        if args.processes > 1:
+            WorkerSupervisor(
+                os.path.abspath(__file__), sys.argv[1:], args.processes,
+                metrics_port=args.metrics_port, metrics_host=args.metrics_host, drain_timeout=args.drain_timeout
+            ).run()
+        else:
+            asyncio.run(main_loop())
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logging.info("🛑 Остановка воркера.")
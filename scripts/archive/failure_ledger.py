@@ -0,0 +1,140 @@
+import time
+import random
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from app_utils import execute_supabase_query # type: ignore
+from constants import DB_TABLES
+
+# Бюджет попыток на одно слово; после него слово больше не берется автоматически
+MAX_ATTEMPTS = 8
+# Экспоненциальная задержка между попытками: 10 мин, 20 мин, 40 мин ... но не больше суток
+BASE_DELAY = 600
+MAX_DELAY = 24 * 3600
+# Сколько последних упавших слов помнить в памяти (старые вытесняются, их попытки читаются из БД)
+MAX_TRACKED = 10000
+
+class FailureLedger:
+    """Постоянный журнал неудачной генерации медиа (таблица media_failures).
+
+    Для каждого слова хранится число попыток, класс последней ошибки и время
+    следующей попытки (next_attempt_at). Представление vocabulary_media_queue
+    отдает только те слова, для которых попытка уже разрешена, поэтому
+    перезапуск не долбит одни и те же сломанные строки, а временные ошибки
+    лечатся сами после паузы.
+    """
+    def __init__(self, db_client, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY, max_tracked=MAX_TRACKED):
+        self.db = db_client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_tracked = max_tracked
+        self.enabled = True
+        # row_id -> {'attempts', 'retry_at' (time.time()), 'exhausted'}, от старых записей к свежим
+        self._attempts = OrderedDict()
+        # Слова, запись которых удалить после сохранения медиа (одним запросом на сброс буфера)
+        self._to_clear = set()
+        self.stats = {'recorded': 0, 'exhausted': 0, 'healed': 0}
+
+    def set_db_client(self, db_client):
+        """Переключает запросы на другой клиент (например, async)."""
+        self.db = db_client
+
+    async def check(self):
+        """Проверяет наличие таблицы и представления; без них журнал отключается."""
+        try:
+            await execute_supabase_query(self.db.table(DB_TABLES['MEDIA_FAILURES']).select('vocabulary_id').limit(1))
+            await execute_supabase_query(self.db.table(DB_TABLES['VOCABULARY_MEDIA_QUEUE']).select('id').limit(1))
+            self.enabled = True
+        except Exception as e:
+            self.enabled = False
+            logging.warning(f"⚠️ Журнал ошибок медиа недоступен ({e}). Запустите migrate_schema.py. Ошибки будут храниться только в памяти.")
+        return self.enabled
+
+    def is_backing_off(self, row_id):
+        """Слово падало в этой сессии и время повтора еще не наступило (или бюджет исчерпан)."""
+        entry = self._attempts.get(row_id)
+        if entry is None:
+            return False
+        return entry['exhausted'] or time.time() < entry['retry_at']
+
+    def has_failed(self, row_id):
+        """Слово падало в этой сессии (запись в журнале надо удалить после успеха)."""
+        return row_id in self._attempts
+
+    def _remember(self, row_id, attempts, delay, exhausted):
+        self._attempts.pop(row_id, None)
+        self._attempts[row_id] = {'attempts': attempts, 'retry_at': time.time() + delay, 'exhausted': exhausted}
+        while len(self._attempts) > self.max_tracked:
+            self._attempts.popitem(last=False)
+
+    def next_delay(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.9, 1.1)
+
+    async def _current_attempts(self, row_id):
+        if row_id in self._attempts:
+            return self._attempts[row_id]['attempts']
+        builder = self.db.table(DB_TABLES['MEDIA_FAILURES']).select('attempts').eq('vocabulary_id', row_id)
+        res = await execute_supabase_query(builder)
+        rows = res.data if res and res.data else []
+        return (rows[0].get('attempts') or 0) if rows else 0
+
+    async def record_failure(self, row_id, error_class, error_text="", known_attempts=None):
+        """Увеличивает счетчик попыток и откладывает следующую попытку."""
+        if not self.enabled or row_id is None:
+            return
+        try:
+            self._to_clear.discard(row_id)
+            attempts = known_attempts if known_attempts is not None else await self._current_attempts(row_id)
+            attempts += 1
+            exhausted = attempts >= self.max_attempts
+            delay = self.next_delay(attempts)
+            self._remember(row_id, attempts, delay, exhausted)
+            next_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+            builder = self.db.table(DB_TABLES['MEDIA_FAILURES']).upsert({
+                'vocabulary_id': row_id,
+                'attempts': attempts,
+                'last_error_class': error_class,
+                'last_error': str(error_text)[:500],
+                'next_attempt_at': next_at.isoformat(),
+                'exhausted': exhausted,
+                'updated_at': datetime.now(timezone.utc).isoformat(),
+            })
+            await execute_supabase_query(builder)
+            self.stats['recorded'] += 1
+            if exhausted:
+                self.stats['exhausted'] += 1
+                logging.warning(f"🪦 Слово id={row_id} исчерпало бюджет попыток ({attempts}). Последняя ошибка: {error_class}")
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось записать ошибку медиа для id={row_id}: {e}")
+
+    async def clear(self, row_id):
+        """Удаляет запись после успешной обработки."""
+        if row_id is not None:
+            await self.clear_many([row_id])
+
+    async def clear_many(self, row_ids):
+        """Удаляет записи нескольких слов одним запросом."""
+        row_ids = list(row_ids)
+        if not self.enabled or not row_ids:
+            return
+        try:
+            builder = self.db.table(DB_TABLES['MEDIA_FAILURES']).delete().in_('vocabulary_id', row_ids)
+            res = await execute_supabase_query(builder)
+            healed = {rid for rid in row_ids if self._attempts.pop(rid, None) is not None}
+            healed.update(r.get('vocabulary_id') for r in (res.data if res and res.data else []))
+            self.stats['healed'] += len(healed)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось очистить журнал ошибок для {len(row_ids)} слов: {e}")
+
+    def schedule_clear(self, row_id):
+        """Отмечает слово, запись которого удалится после сохранения его медиа (flush_written)."""
+        if self.enabled and row_id is not None:
+            self._to_clear.add(row_id)
+
+    async def flush_written(self, row_ids):
+        """Колбэк буфера записи: удаляет записи отмеченных слов из сохраненного пакета."""
+        ids = [rid for rid in row_ids if rid in self._to_clear]
+        self._to_clear.difference_update(ids)
+        await self.clear_many(ids)
@@ -0,0 +1,99 @@
+import logging
+import aiohttp
+import metrics
+
+class HttpPool:
+    """Единая долгоживущая aiohttp-сессия воркера с настроенным пулом соединений.
+
+    Соединения к Edge Functions переиспользуются между пачками и циклами,
+    а счетчики trace-сигналов показывают, сколько соединений открыто заново,
+    а сколько взято из пула (они же экспортируются в /metrics).
+    """
+    def __init__(self, limit=100, limit_per_host=30, keepalive_timeout=60, ttl_dns_cache=300, happy_eyeballs_delay=0.25):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self._session = None
+        self.counters = {'requests': 0, 'connections_created': 0, 'connections_reused': 0, 'dns_cache_hits': 0, 'dns_cache_misses': 0}
+
+    def _build_trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_end(session, ctx, params):
+            self.counters['requests'] += 1
+            metrics.inc('worker_http_requests_total')
+
+        async def on_connection_create_end(session, ctx, params):
+            self.counters['connections_created'] += 1
+            metrics.inc('worker_http_connections_total', result='created')
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.counters['connections_reused'] += 1
+            metrics.inc('worker_http_connections_total', result='reused')
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self.counters['dns_cache_hits'] += 1
+            metrics.inc('worker_http_dns_cache_total', result='hit')
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self.counters['dns_cache_misses'] += 1
+            metrics.inc('worker_http_dns_cache_total', result='miss')
+
+        trace.on_request_end.append(on_request_end)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace
+
+    def _build_connector(self):
+        options = dict(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.ttl_dns_cache,
+            use_dns_cache=True,
+            enable_cleanup_closed=True,
+        )
+        try:
+            return aiohttp.TCPConnector(happy_eyeballs_delay=self.happy_eyeballs_delay, **options)
+        except TypeError:
+            # Старые версии aiohttp (< 3.10) не поддерживают Happy Eyeballs
+            return aiohttp.TCPConnector(**options)
+
+    async def start(self):
+        """Создает сессию (должно вызываться внутри работающего event loop)."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=self._build_connector(),
+                trace_configs=[self._build_trace_config()]
+            )
+            logging.info(f"🔌 HTTP пул создан (limit={self.limit}, на хост={self.limit_per_host}, keep-alive={self.keepalive_timeout}с).")
+        return self._session
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HttpPool не запущен: вызовите await start()")
+        return self._session
+
+    def stats(self):
+        """Счетчики переиспользования соединений."""
+        created = self.counters['connections_created']
+        reused = self.counters['connections_reused']
+        total = created + reused
+        return {**self.counters, 'reuse_ratio': (reused / total) if total else 0.0}
+
+    def log_stats(self):
+        s = self.stats()
+        logging.info(
+            f"🔌 HTTP пул: запросов {s['requests']}, новых соединений {s['connections_created']}, "
+            f"переиспользовано {s['connections_reused']} ({s['reuse_ratio'] * 100:.0f}%)"
+        )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,138 @@
+import time
+import asyncio
+import logging
+import network_quality
+
+# Настройки AIMD-лимитеров для каждой внешней зависимости воркера.
+# latency_target — задержка (сек), выше которой считаем зависимость перегруженной;
+# endpoint — сервис в network_quality, чья скользящая оценка задержки сравнивается с целью.
+DEFAULT_LIMITS = {
+    'tts': {'initial': 10, 'min_limit': 1, 'max_limit': 30, 'latency_target': 8.0, 'endpoint': 'edge_tts'},
+    'storage': {'initial': 10, 'min_limit': 1, 'max_limit': 30, 'latency_target': 5.0, 'endpoint': 'supabase_storage'},
+    'edge_image': {'initial': 4, 'min_limit': 1, 'max_limit': 10, 'latency_target': 20.0, 'endpoint': 'supabase_edge'},
+}
+
+class _Slot:
+    """Занятый слот лимитера; fail() помечает вызов как неудачный, даже если исключения не было."""
+    def __init__(self):
+        self.ok = True
+
+    def fail(self):
+        self.ok = False
+
+class AIMDLimiter:
+    """Лимитер параллелизма с аддитивным ростом и мультипликативным снижением (AIMD).
+
+    Каждый успешный и быстрый вызов увеличивает лимит на 1/limit (≈ +1 за «окно»),
+    ошибка или превышение latency_target уменьшает лимит в decrease_factor раз,
+    но не чаще одного раза за cooldown секунд. Если задан endpoint, с целью сравнивается
+    скользящая оценка задержки сервиса (network_quality), а не единичный вызов —
+    одна долгая фраза TTS не считается перегрузкой.
+    """
+    def __init__(self, name, initial=8, min_limit=1, max_limit=25, latency_target=5.0, decrease_factor=0.7, cooldown=2.0, endpoint=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+        self._last_decrease = 0.0
+        self.stats = {'calls': 0, 'errors': 0, 'slow': 0, 'decreases': 0, 'latency_ewma': 0.0}
+
+    @property
+    def current(self):
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.current)
+            self.in_flight += 1
+
+    async def release(self, duration, ok):
+        async with self._cond:
+            self.in_flight -= 1
+            self._adjust(duration, ok)
+            self._cond.notify_all()
+
+    def _adjust(self, duration, ok):
+        s = self.stats
+        s['calls'] += 1
+        s['latency_ewma'] = duration if s['calls'] == 1 else 0.8 * s['latency_ewma'] + 0.2 * duration
+        estimate = network_quality.latency(self.endpoint) if self.endpoint else None
+        slow = (estimate if estimate is not None else duration) > self.latency_target
+        if not ok:
+            s['errors'] += 1
+        if slow:
+            s['slow'] += 1
+
+        if not ok or slow:
+            now = time.time()
+            if now - self._last_decrease >= self.cooldown:
+                new_limit = max(self.min_limit, self.limit * self.decrease_factor)
+                if int(new_limit) < int(self.limit):
+                    logging.warning(f"📉 [{self.name}] {'Ошибка' if not ok else 'Медленный ответ'} ({duration:.1f} сек, в среднем {estimate or duration:.1f}). Лимит {self.current} -> {int(new_limit)}.")
+                self.limit = new_limit
+                self._last_decrease = now
+                s['decreases'] += 1
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def __call__(self):
+        return _LimiterContext(self)
+
+    def snapshot(self):
+        return {
+            'limit': self.current,
+            'in_flight': self.in_flight,
+            'calls': self.stats['calls'],
+            'errors': self.stats['errors'],
+            'slow': self.stats['slow'],
+            'decreases': self.stats['decreases'],
+            'latency_ewma': round(self.stats['latency_ewma'], 3),
+        }
+
+class _LimiterContext:
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.slot = _Slot()
+        self.start = 0.0
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        self.start = time.time()
+        return self.slot
+
+    async def __aexit__(self, exc_type, exc, tb):
+        ok = self.slot.ok and exc_type is None
+        await self.limiter.release(time.time() - self.start, ok)
+        return False
+
+_limiters = {}
+
+def get_limiter(name):
+    """Возвращает лимитер зависимости (создает с настройками по умолчанию)."""
+    if name not in _limiters:
+        _limiters[name] = AIMDLimiter(name, **DEFAULT_LIMITS.get(name, {}))
+    return _limiters[name]
+
+def limit(name):
+    """Контекстный менеджер для вызова зависимости: async with limit('tts') as slot: ..."""
+    return get_limiter(name)()
+
+def set_initial_limits(initial):
+    """Задает стартовый лимит всем зависимостям (не выше их максимума)."""
+    for name in DEFAULT_LIMITS:
+        limiter = get_limiter(name)
+        limiter.limit = float(max(limiter.min_limit, min(initial, limiter.max_limit)))
+
+def snapshot():
+    return {name: limiter.snapshot() for name, limiter in _limiters.items()}
+
+def log_state():
+    parts = [f"{name}={s['limit']} (в работе {s['in_flight']}, ошибок {s['errors']}, ~{s['latency_ewma']:.1f}с)" for name, s in snapshot().items()]
+    if parts:
+        logging.info(f"🎚 Лимиты зависимостей: {'; '.join(parts)}")
@@ -0,0 +1,678 @@
+# Локальная замена Supabase (PostgREST + Storage) для нагрузочных тестов без сети.
+#
+# Поддерживается подмножество, которым пользуются скрипты: цепочки table().select().eq().or_()...,
+# insert/update/upsert/delete, rpc (claim_word_requests, bulk_update_vocabulary_media),
+# storage.from_().upload/remove/list/download. Данные хранятся в SQLite (файл или память),
+# к каждому вызову добавляется настраиваемая задержка.
+#
+# Подключение: SUPABASE_URL=local:///tmp/topik.db?latency=0.05&jitter=0.3 (или local://memory)
+# Наполнение:  python local_supabase.py seed local:///tmp/topik.db --vocabulary 1000000 --media-share 0.5
+
+import re
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, parse_qs, quote
+
+LOCAL_URL_PREFIX = "local://"
+# Первичные ключи таблиц (для upsert); у остальных таблиц ключ — id
+PRIMARY_KEYS = {
+    'media_failures': ('vocabulary_id',),
+    'user_progress': ('user_id', 'word_id'),
+    'list_items': ('list_id', 'word_id'),
+    'user_global_stats': ('user_id',),
+}
+_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def is_local_url(url):
+    return bool(url) and url.startswith(LOCAL_URL_PREFIX)
+
+def _utc_now():
+    return datetime.now(timezone.utc)
+
+def _col(name):
+    if not _NAME_RE.match(name):
+        raise LocalAPIError('42703', f"column \"{name}\" does not exist")
+    return f"json_extract(data, '$.{name}')"
+
+def _coerce(value):
+    """Значение фильтра из строки PostgREST (or_) в тип, с которым сравнивает SQLite."""
+    if not isinstance(value, str):
+        return value
+    if value.startswith('"') and value.endswith('"') and len(value) >= 2:
+        return value[1:-1]
+    if value in ('true', 'false'):
+        return value == 'true'
+    if value == 'null':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+class LocalAPIError(Exception):
+    """Ошибка в формате PostgREST (code + message), чтобы код воркера узнавал ее так же, как настоящую."""
+    def __init__(self, code, message):
+        super().__init__(str({'code': code, 'message': message}))
+        self.code = code
+        self.message = message
+
+class LocalResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+class Latency:
+    """Задержка вызова: медиана и логнормальный разброс."""
+    def __init__(self, median=0.0, jitter=0.0):
+        self.median = median
+        self.jitter = jitter
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return self.median * random.lognormvariate(0, self.jitter) if self.jitter > 0 else self.median
+
+# --- Фильтры ---
+
+def _simple_filter(col, op, value):
+    """SQL-условие для одного фильтра PostgREST."""
+    expr = _col(col)
+    if op == 'is':
+        value = _coerce(value) if isinstance(value, str) else value
+        if value is None:
+            return f"{expr} IS NULL", []
+        return f"{expr} IS ?", [value]
+    if op == 'in':
+        values = value
+        if isinstance(value, str):
+            values = [_coerce(v.strip()) for v in value.strip('()').split(',') if v.strip()]
+        if not values:
+            return "0", []
+        return f"{expr} IN ({','.join('?' * len(values))})", list(values)
+    value = _coerce(value)
+    if op == 'eq':
+        return (f"{expr} IS NULL", []) if value is None else (f"{expr} = ?", [value])
+    if op == 'neq':
+        return f"({expr} IS NULL OR {expr} != ?)", [value]
+    if op in ('gt', 'gte', 'lt', 'lte'):
+        sql_op = {'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}[op]
+        return f"{expr} {sql_op} ?", [value]
+    if op in ('like', 'ilike'):
+        pattern = str(value).replace('*', '%')
+        if op == 'ilike':
+            return f"lower({expr}) LIKE lower(?)", [pattern]
+        return f"{expr} LIKE ?", [pattern]
+    raise LocalAPIError('PGRST100', f"unsupported operator: {op}")
+
+def _split_top_level(text):
+    parts, depth, quoted, current = [], 0, False, []
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0 and not quoted:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+    if current:
+        parts.append(''.join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+def _logic_filter(text, joiner):
+    """Разбирает выражение or_()/and() PostgREST: "a.is.null,and(b.eq.1,c.lt.2)"."""
+    clauses, params = [], []
+    for part in _split_top_level(text):
+        nested = re.match(r'^(not\.)?(and|or)\((.*)\)$', part)
+        if nested:
+            sql, p = _logic_filter(nested.group(3), ' AND ' if nested.group(2) == 'and' else ' OR ')
+            if nested.group(1):
+                sql = f"NOT ({sql})"
+        else:
+            col, rest = part.split('.', 1)
+            negate = rest.startswith('not.')
+            if negate:
+                rest = rest[4:]
+            op, value = rest.split('.', 1) if '.' in rest else (rest, '')
+            sql, p = _simple_filter(col, op, value)
+            if negate:
+                sql = f"NOT ({sql})"
+        clauses.append(f"({sql})")
+        params.extend(p)
+    return joiner.join(clauses) or "1", params
+
+# --- Хранилище ---
+
+class LocalStore:
+    """Таблицы (строки как JSON в SQLite) и файлы Storage одного локального «проекта»."""
+    def __init__(self, path=':memory:', latency=0.0, jitter=0.0, public_url='http://localhost:54321'):
+        self.path = path
+        self.latency = Latency(latency, jitter)
+        self.public_url = public_url.rstrip('/')
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL" if path != ':memory:' else "PRAGMA journal_mode=MEMORY")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS storage_buckets (id TEXT PRIMARY KEY, public INTEGER)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS storage_objects (bucket TEXT, name TEXT, data BLOB, size INTEGER, "
+            "content_type TEXT, created_at TEXT, PRIMARY KEY (bucket, name))"
+        )
+        self._tables = set()
+        self._next_id = {}
+
+    def delay(self):
+        return self.latency.sample()
+
+    # Таблицы
+
+    def table_name(self, name):
+        if not _NAME_RE.match(name):
+            raise LocalAPIError('42P01', f"relation \"public.{name}\" does not exist")
+        return f"t_{name}"
+
+    def ensure_table(self, name):
+        if name in self._tables:
+            return
+        table = self.table_name(name)
+        with self.lock:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (rowid INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+            for col in set(PRIMARY_KEYS.get(name, ('id',))) | {'id'}:
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{col}" ON "{table}" ({_col(col)})')
+            self._tables.add(name)
+
+    def source(self, name):
+        """Откуда читать строки: (FROM, выражение строки, условие источника, параметры, можно ли писать).
+
+        Представление vocabulary_media_queue эмулируется соединением таблиц, как в migrate_schema.py:
+        слова без записи в журнале или с наступившим временем повтора. Фильтры и сортировка
+        применяются к колонкам словаря (v.data), чтобы работал индекс по id.
+        """
+        if name == 'vocabulary_media_queue':
+            self.ensure_table('vocabulary')
+            self.ensure_table('media_failures')
+            return (
+                "t_vocabulary v LEFT JOIN t_media_failures f ON json_extract(f.data, '$.vocabulary_id') = json_extract(v.data, '$.id')",
+                "json_set(v.data, '$.failure_attempts', json_extract(f.data, '$.attempts'))",
+                "(f.rowid IS NULL OR (NOT coalesce(json_extract(f.data, '$.exhausted'), 0) AND json_extract(f.data, '$.next_attempt_at') <= ?))",
+                [_utc_now().isoformat()],
+                False,
+            )
+        self.ensure_table(name)
+        return f'"{self.table_name(name)}"', "data", "1", [], True
+
+    def _assign_defaults(self, name, row):
+        row = dict(row)
+        keys = PRIMARY_KEYS.get(name, ('id',))
+        if keys == ('id',) and row.get('id') is None:
+            if name not in self._next_id:
+                cur = self.conn.execute(f'SELECT max({_col("id")}) FROM "{self.table_name(name)}"').fetchone()[0]
+                self._next_id[name] = (cur if isinstance(cur, int) else 0) + 1
+            row['id'] = self._next_id[name]
+            self._next_id[name] += 1
+        elif isinstance(row.get('id'), int) and name in self._next_id:
+            self._next_id[name] = max(self._next_id[name], row['id'] + 1)
+        row.setdefault('created_at', _utc_now().isoformat())
+        return row
+
+    def insert_rows(self, name, rows):
+        self.ensure_table(name)
+        with self.lock:
+            prepared = [self._assign_defaults(name, r) for r in rows]
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                f'INSERT INTO "{self.table_name(name)}" (data) VALUES (?)',
+                [(json.dumps(r, ensure_ascii=False, default=str),) for r in prepared]
+            )
+            self.conn.execute("COMMIT")
+            return prepared
+
+    def upsert_rows(self, name, rows, on_conflict=None, ignore_duplicates=False):
+        self.ensure_table(name)
+        keys = tuple(k.strip() for k in on_conflict.split(',')) if on_conflict else PRIMARY_KEYS.get(name, ('id',))
+        table = self.table_name(name)
+        result = []
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for row in rows:
+                    existing = None
+                    if all(row.get(k) is not None for k in keys):
+                        where = ' AND '.join(f"{_col(k)} = ?" for k in keys)
+                        existing = self.conn.execute(f'SELECT rowid, data FROM "{table}" WHERE {where} LIMIT 1', [row[k] for k in keys]).fetchone()
+                    if existing is None:
+                        row = self._assign_defaults(name, row)
+                        self.conn.execute(f'INSERT INTO "{table}" (data) VALUES (?)', (json.dumps(row, ensure_ascii=False, default=str),))
+                        result.append(row)
+                    elif not ignore_duplicates:
+                        merged = dict(json.loads(existing[1]), **row)
+                        self.conn.execute(f'UPDATE "{table}" SET data = ? WHERE rowid = ?', (json.dumps(merged, ensure_ascii=False, default=str), existing[0]))
+                        result.append(merged)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def run_query(self, q):
+        source, data_expr, source_where, source_params, writable = self.source(q.table)
+        where = ' AND '.join([source_where] + [f"({c})" for c in q.filters])
+        order = ', '.join(f"{_col(c)} {'DESC' if desc else 'ASC'}" for c, desc in q.orders)
+        if data_expr != "data":
+            where = where.replace("json_extract(data,", "json_extract(v.data,")
+            order = order.replace("json_extract(data,", "json_extract(v.data,")
+        params = source_params + q.params
+        with self.lock:
+            if q.op == 'select':
+                sql = f"SELECT {data_expr} FROM {source} WHERE {where}"
+                count = None
+                if q.count:
+                    count = self.conn.execute(f"SELECT count(*) FROM {source} WHERE {where}", params).fetchone()[0]
+                if order:
+                    sql += f" ORDER BY {order}"
+                if q.limit_n is not None or q.offset_n:
+                    sql += f" LIMIT {int(q.limit_n) if q.limit_n is not None else -1} OFFSET {int(q.offset_n or 0)}"
+                rows = [json.loads(r[0]) for r in self.conn.execute(sql, params)]
+                return LocalResponse([q.project(r) for r in rows], count)
+
+            if not writable:
+                raise LocalAPIError('42809', f"cannot modify view \"{q.table}\"")
+            if q.op == 'insert':
+                return LocalResponse(self.insert_rows(q.table, q.payload))
+            if q.op == 'upsert':
+                return LocalResponse(self.upsert_rows(q.table, q.payload, q.on_conflict, q.ignore_duplicates))
+
+            table = self.table_name(q.table)
+            sql = f'SELECT rowid, data FROM "{table}" WHERE {where}'
+            if order:
+                sql += f" ORDER BY {order}"
+            if q.limit_n is not None:
+                sql += f" LIMIT {int(q.limit_n)}"
+            matched = self.conn.execute(sql, params).fetchall()
+            self.conn.execute("BEGIN")
+            try:
+                if q.op == 'update':
+                    out = []
+                    for rowid, data in matched:
+                        row = dict(json.loads(data), **q.payload)
+                        self.conn.execute(f'UPDATE "{table}" SET data = ? WHERE rowid = ?', (json.dumps(row, ensure_ascii=False, default=str), rowid))
+                        out.append(row)
+                else:
+                    out = [json.loads(data) for _, data in matched]
+                    self.conn.executemany(f'DELETE FROM "{table}" WHERE rowid = ?', [(rowid,) for rowid, _ in matched])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            return LocalResponse(out)
+
+    # RPC из migrate_schema.py
+
+    def run_rpc(self, name, params):
+        params = params or {}
+        if name == 'claim_word_requests':
+            return LocalResponse(self._claim_word_requests(params.get('p_worker'), params.get('p_limit', 5), params.get('p_lease_seconds', 120)))
+        if name == 'bulk_update_vocabulary_media':
+            return LocalResponse(self._bulk_update_vocabulary_media(params.get('p_rows') or []))
+        if name == 'exec_sql':
+            logging.info("ℹ️ Локальный Supabase: exec_sql пропущен (схема создается автоматически).")
+            return LocalResponse(None)
+        raise LocalAPIError('PGRST202', f"Could not find the function public.{name} in the schema cache")
+
+    def _claim_word_requests(self, worker, limit, lease_seconds):
+        self.ensure_table('word_requests')
+        now = _utc_now()
+        q = LocalQuery(self, 'word_requests')
+        q.or_(f"status.eq.pending,and(status.eq.processing,lease_expires_at.lt.\"{now.isoformat()}\")")
+        q.order('created_at').limit(limit)
+        q.update({
+            'status': 'processing',
+            'claimed_by': worker,
+            'lease_expires_at': (now + timedelta(seconds=lease_seconds)).isoformat(),
+        })
+        return self.run_query(q).data
+
+    def _bulk_update_vocabulary_media(self, rows):
+        self.ensure_table('vocabulary')
+        updated = []
+        for item in rows:
+            changes = {k: item[k] for k in ('audio_url', 'audio_male', 'example_audio', 'image', 'image_source') if k in item}
+            q = LocalQuery(self, 'vocabulary').update(changes).eq('id', item.get('id'))
+            if self.run_query(q).data:
+                updated.append(item.get('id'))
+        return updated
+
+class LocalQuery:
+    """Цепочка запроса в стиле postgrest-py; execute() выполняет ее синхронно."""
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self.op = 'select'
+        self.columns = None
+        self.count = None
+        self.payload = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.filters = []
+        self.params = []
+        self.orders = []
+        self.limit_n = None
+        self.offset_n = None
+        self._negate = False
+
+    # Операции
+
+    def select(self, columns='*', count=None, **kwargs):
+        self.op = 'select'
+        cols = [c.strip() for c in columns.split(',') if c.strip()]
+        self.columns = None if not cols or '*' in cols else cols
+        self.count = count
+        return self
+
+    def insert(self, payload, **kwargs):
+        self.op = 'insert'
+        self.payload = payload if isinstance(payload, list) else [payload]
+        return self
+
+    def upsert(self, payload, on_conflict=None, ignore_duplicates=False, **kwargs):
+        self.op = 'upsert'
+        self.payload = payload if isinstance(payload, list) else [payload]
+        self.on_conflict = on_conflict or None
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, payload, **kwargs):
+        self.op = 'update'
+        self.payload = dict(payload)
+        return self
+
+    def delete(self, **kwargs):
+        self.op = 'delete'
+        return self
+
+    # Фильтры
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _add(self, sql, params):
+        if self._negate:
+            sql = f"NOT ({sql})"
+            self._negate = False
+        self.filters.append(sql)
+        self.params.extend(params)
+        return self
+
+    def eq(self, col, value): return self._add(*_simple_filter(col, 'eq', value))
+    def neq(self, col, value): return self._add(*_simple_filter(col, 'neq', value))
+    def gt(self, col, value): return self._add(*_simple_filter(col, 'gt', value))
+    def gte(self, col, value): return self._add(*_simple_filter(col, 'gte', value))
+    def lt(self, col, value): return self._add(*_simple_filter(col, 'lt', value))
+    def lte(self, col, value): return self._add(*_simple_filter(col, 'lte', value))
+    def like(self, col, pattern): return self._add(*_simple_filter(col, 'like', pattern))
+    def ilike(self, col, pattern): return self._add(*_simple_filter(col, 'ilike', pattern))
+    def is_(self, col, value): return self._add(*_simple_filter(col, 'is', value))
+    def in_(self, col, values): return self._add(*_simple_filter(col, 'in', list(values)))
+
+    def or_(self, filters, **kwargs):
+        return self._add(*_logic_filter(filters, ' OR '))
+
+    def match(self, query):
+        for col, value in query.items():
+            self.eq(col, value)
+        return self
+
+    # Порядок и страницы
+
+    def order(self, column, desc=False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size, **kwargs):
+        self.limit_n = size
+        return self
+
+    def range(self, start, end, **kwargs):
+        self.offset_n = start
+        self.limit_n = end - start + 1
+        return self
+
+    def project(self, row):
+        if self.columns is None:
+            return row
+        return {c: row.get(c) for c in self.columns}
+
+    def execute(self):
+        time.sleep(self.store.delay())
+        return self.store.run_query(self)
+
+class AsyncLocalQuery(LocalQuery):
+    """То же, но execute() — корутина, как у async-клиента (execute_supabase_query ждет ее напрямую)."""
+    async def execute(self):
+        await asyncio.sleep(self.store.delay())
+        return await asyncio.get_running_loop().run_in_executor(None, self.store.run_query, self)
+
+class LocalRpc:
+    def __init__(self, store, name, params):
+        self.store = store
+        self.name = name
+        self.rpc_params = params
+
+    def _run(self):
+        with self.store.lock:
+            return self.store.run_rpc(self.name, self.rpc_params)
+
+    def execute(self):
+        time.sleep(self.store.delay())
+        return self._run()
+
+class AsyncLocalRpc(LocalRpc):
+    async def execute(self):
+        await asyncio.sleep(self.store.delay())
+        return await asyncio.get_running_loop().run_in_executor(None, self._run)
+
+# --- Storage ---
+
+class LocalBucketInfo:
+    def __init__(self, bucket_id, public):
+        self.id = bucket_id
+        self.name = bucket_id
+        self.public = bool(public)
+
+class LocalBucket:
+    """storage.from_(bucket): upload/remove/list/download/get_public_url."""
+    def __init__(self, store, bucket):
+        self.store = store
+        self.bucket = bucket
+
+    def upload(self, path, file, file_options=None):
+        time.sleep(self.store.delay())
+        options = file_options or {}
+        data = file.read() if hasattr(file, 'read') else bytes(file)
+        upsert = str(options.get('upsert', options.get('x-upsert', 'false'))).lower() == 'true'
+        with self.store.lock:
+            exists = self.store.conn.execute("SELECT 1 FROM storage_objects WHERE bucket = ? AND name = ?", (self.bucket, path)).fetchone()
+            if exists and not upsert:
+                raise LocalAPIError('409', f"The resource already exists: {self.bucket}/{path}")
+            self.store.conn.execute(
+                "INSERT OR REPLACE INTO storage_objects (bucket, name, data, size, content_type, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.bucket, path, data, len(data), options.get('content-type'), _utc_now().isoformat())
+            )
+        return {'Key': f"{self.bucket}/{path}", 'path': path}
+
+    def remove(self, paths):
+        time.sleep(self.store.delay())
+        removed = []
+        with self.store.lock:
+            for path in paths:
+                cur = self.store.conn.execute("DELETE FROM storage_objects WHERE bucket = ? AND name = ?", (self.bucket, path))
+                if cur.rowcount:
+                    removed.append({'name': path, 'bucket_id': self.bucket})
+        return removed
+
+    def list(self, path=None, options=None):
+        time.sleep(self.store.delay())
+        options = options or {}
+        prefix = f"{path.strip('/')}/" if path else ''
+        sort = options.get('sortBy') or {}
+        column = sort.get('column') if sort.get('column') in ('name', 'created_at') else 'name'
+        order = 'DESC' if str(sort.get('order', 'asc')).lower() == 'desc' else 'ASC'
+        with self.store.lock:
+            rows = self.store.conn.execute(
+                "SELECT name, size, content_type, created_at FROM storage_objects WHERE bucket = ? AND name LIKE ? "
+                f"ORDER BY {column} {order}, name LIMIT ? OFFSET ?",
+                (self.bucket, prefix.replace('%', r'\%') + '%', int(options.get('limit', 100)), int(options.get('offset', 0)))
+            ).fetchall()
+        return [
+            {'name': name[len(prefix):], 'id': f"{self.bucket}/{name}", 'created_at': created,
+             'metadata': {'size': size, 'mimetype': ctype}}
+            for name, size, ctype, created in rows
+        ]
+
+    def download(self, path):
+        time.sleep(self.store.delay())
+        with self.store.lock:
+            row = self.store.conn.execute("SELECT data FROM storage_objects WHERE bucket = ? AND name = ?", (self.bucket, path)).fetchone()
+        if row is None:
+            raise LocalAPIError('404', f"Object not found: {self.bucket}/{path}")
+        return row[0]
+
+    def get_public_url(self, path):
+        return f"{self.store.public_url}/storage/v1/object/public/{self.bucket}/{quote(path)}"
+
+class LocalStorage:
+    def __init__(self, store):
+        self.store = store
+
+    def from_(self, bucket):
+        return LocalBucket(self.store, bucket)
+
+    def list_buckets(self):
+        with self.store.lock:
+            rows = self.store.conn.execute("SELECT id, public FROM storage_buckets ORDER BY id").fetchall()
+        return [LocalBucketInfo(bucket_id, public) for bucket_id, public in rows]
+
+    def get_bucket(self, bucket_id):
+        for bucket in self.list_buckets():
+            if bucket.id == bucket_id:
+                return bucket
+        raise LocalAPIError('404', f"Bucket not found: {bucket_id}")
+
+    def create_bucket(self, bucket_id, name=None, options=None):
+        with self.store.lock:
+            self.store.conn.execute("INSERT OR IGNORE INTO storage_buckets (id, public) VALUES (?, ?)", (bucket_id, int(bool((options or {}).get('public')))))
+        return {'name': bucket_id}
+
+    def update_bucket(self, bucket_id, options=None):
+        with self.store.lock:
+            self.store.conn.execute("UPDATE storage_buckets SET public = ? WHERE id = ?", (int(bool((options or {}).get('public'))), bucket_id))
+        return {'message': 'Successfully updated'}
+
+# --- Клиенты ---
+
+class LocalClient:
+    """Заменяет supabase.Client: table(), rpc(), storage."""
+    query_class = LocalQuery
+    rpc_class = LocalRpc
+
+    def __init__(self, store):
+        self.store = store
+        self.storage = LocalStorage(store)
+
+    def table(self, name):
+        return self.query_class(self.store, name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, name, params=None):
+        return self.rpc_class(self.store, name, params)
+
+class AsyncLocalClient(LocalClient):
+    """Заменяет AsyncClient: execute() у запросов — корутина. Storage остается синхронным."""
+    query_class = AsyncLocalQuery
+    rpc_class = AsyncLocalRpc
+
+_stores = {}
+
+def open_store(url):
+    """Хранилище по адресу local://...; клиенты с одним адресом видят одни и те же данные."""
+    parts = urlsplit(url)
+    path = (parts.netloc + parts.path) or 'memory'
+    if path in ('memory', ':memory:'):
+        path = ':memory:'
+    opts = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+    key = (path, parts.query)
+    if key not in _stores:
+        _stores[key] = LocalStore(path, latency=float(opts.get('latency', 0)), jitter=float(opts.get('jitter', 0)))
+        logging.info(f"🧪 Локальный Supabase: {path} (задержка {_stores[key].latency.median * 1000:.0f} мс)")
+    return _stores[key]
+
+def create_local_client(url, is_async=False):
+    store = open_store(url)
+    return AsyncLocalClient(store) if is_async else LocalClient(store)
+
+# --- Наполнение тестовыми данными ---
+
+def seed(url, vocabulary=0, quotes=0, requests=0, media_share=0.0, batch=10000):
+    """Быстро создает много строк (и файлов для доли слов с медиа) для нагрузочных тестов."""
+    client = create_local_client(url)
+    store = client.store
+    for bucket in ('audio-files', 'image-files'):
+        client.storage.create_bucket(bucket, options={'public': True})
+    audio = client.storage.from_('audio-files')
+    for start in range(0, vocabulary, batch):
+        rows, files = [], []
+        for i in range(start + 1, min(vocabulary, start + batch) + 1):
+            row = {'id': i, 'word_kr': f"단어{i}", 'translation': f"слово {i}", 'example_kr': f"단어{i}를 써요.", 'topic': '기타', 'is_public': True}
+            if random.random() < media_share:
+                name = f"w{i}.mp3"
+                row.update({'audio_url': audio.get_public_url(name), 'audio_male': audio.get_public_url(name),
+                            'example_audio': audio.get_public_url(name), 'image': f"{store.public_url}/img/{i}.jpg", 'image_source': 'pixabay'})
+                files.append(name)
+            rows.append(row)
+        store.insert_rows('vocabulary', rows)
+        with store.lock:
+            store.conn.executemany(
+                "INSERT OR REPLACE INTO storage_objects (bucket, name, data, size, content_type, created_at) VALUES ('audio-files', ?, ?, ?, 'audio/mpeg', ?)",
+                [(name, b'\x00' * 1024, 1024, _utc_now().isoformat()) for name in files]
+            )
+        logging.info(f"🌱 vocabulary: {min(vocabulary, start + batch)}/{vocabulary}")
+    if quotes:
+        store.insert_rows('quotes', [{'id': i, 'quote_kr': f"명언 {i}", 'quote_ru': f"цитата {i}"} for i in range(1, quotes + 1)])
+    if requests:
+        store.insert_rows('word_requests', [{'id': i, 'word_kr': f"요청{i}", 'status': 'pending'} for i in range(1, requests + 1)])
+    logging.info(f"✅ Готово: слов {vocabulary}, цитат {quotes}, заявок {requests}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Локальная замена Supabase для нагрузочных тестов")
+    sub = parser.add_subparsers(dest="command", required=True)
+    seed_parser = sub.add_parser("seed", help="Наполнить локальную базу тестовыми строками")
+    seed_parser.add_argument("url", help="Адрес вида local:///tmp/topik.db")
+    seed_parser.add_argument("--vocabulary", type=int, default=0, help="Сколько слов создать")
+    seed_parser.add_argument("--quotes", type=int, default=0, help="Сколько цитат создать")
+    seed_parser.add_argument("--requests", type=int, default=0, help="Сколько заявок word_requests создать")
+    seed_parser.add_argument("--media-share", type=float, default=0.0, help="Доля слов, у которых уже есть медиа (и файлы в Storage)")
+    cli_args = parser.parse_args()
+    if not is_local_url(cli_args.url):
+        print(f"❌ Ожидается адрес {LOCAL_URL_PREFIX}...")
+        sys.exit(2)
+    seed(cli_args.url, cli_args.vocabulary, cli_args.quotes, cli_args.requests, cli_args.media_share)
@@ -0,0 +1,319 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Границы корзин гистограмм размеров (байты)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Сколько последних замеров стадии хранить для перцентилей в сводке прохода
+SUMMARY_SAMPLES = 2000
+# Если event loop не отзывался дольше этого времени, /healthz отвечает 503
+HEALTH_STALE_AFTER = 30.0
+
+_HELP = {
+    'worker_stage_seconds': ('histogram', 'Длительность стадий обработки (TTS, upload, delete, DB update, Edge image)'),
+    'worker_stage_bytes': ('histogram', 'Объем данных стадий обработки (байты)'),
+    'worker_words_processed_total': ('counter', 'Обработанные слова словаря по результату'),
+    'worker_requests_processed_total': ('counter', 'Обработанные заявки пользователей по результату'),
+    'worker_errors_total': ('counter', 'Ошибки по типу и классу исключения'),
+    'worker_event_loop_lag_seconds': ('gauge', 'Задержка event loop (опоздание таймера)'),
+    'worker_uptime_seconds': ('gauge', 'Время работы воркера'),
+}
+
+_lock = threading.Lock()
+_counters = {} # (name, labels) -> value
+_histograms = {} # (name, labels) -> [bucket_counts, sum, count, bounds]
+_gauges = {} # (name, labels) -> value
+_gauge_callbacks = [] # fn() -> [(name, labels_dict, value), ...]
+_callback_gauges = {} # снимок значений _gauge_callbacks, обновляется в event loop
+_started_at = time.time()
+_last_heartbeat = time.time()
+_pass_stats = {} # stage -> агрегаты за текущий проход (для сводки)
+_span_log = None # файл JSON lines со всеми замерами (опционально)
+_span_listeners = [] # fn(span) — вызывается после каждого замера
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def describe(name, kind, help_text):
+    """Регистрирует тип и описание метрики для # HELP / # TYPE."""
+    _HELP[name] = (kind, help_text)
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    with _lock:
+        key = _key(name, labels)
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * len(buckets), 0.0, 0, buckets]
+        for i, bound in enumerate(hist[3]):
+            if value <= bound:
+                hist[0][i] += 1
+        hist[1] += value
+        hist[2] += 1
+
+class Span:
+    """Замер одной стадии; внутри блока можно указать объем данных (span.bytes) и доп. поля (span.attrs)."""
+    __slots__ = ('stage', 'bytes', 'ok', 'attrs', 'duration')
+
+    def __init__(self, stage, attrs):
+        self.stage = stage
+        self.bytes = None
+        self.ok = True
+        self.attrs = attrs
+        self.duration = 0.0
+
+@contextmanager
+def span(stage, **attrs):
+    """Замер стадии: with metrics.span('tts', voice=voice) as sp: ...; sp.bytes = len(data)
+
+    Длительность и байты попадают в гистограммы /metrics, в сводку прохода
+    и (если включено) в файл JSON lines.
+    """
+    sp = Span(stage, attrs)
+    start = time.perf_counter()
+    try:
+        yield sp
+    except BaseException:
+        sp.ok = False
+        raise
+    finally:
+        sp.duration = time.perf_counter() - start
+        _record_span(sp)
+
+def _record_span(sp):
+    observe('worker_stage_seconds', sp.duration, stage=sp.stage)
+    if sp.bytes is not None:
+        observe('worker_stage_bytes', sp.bytes, buckets=BYTES_BUCKETS, stage=sp.stage)
+    with _lock:
+        agg = _pass_stats.get(sp.stage)
+        if agg is None:
+            agg = _pass_stats[sp.stage] = {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0, 'bytes': 0, 'samples': []}
+        agg['count'] += 1
+        agg['total'] += sp.duration
+        agg['max'] = max(agg['max'], sp.duration)
+        if not sp.ok:
+            agg['errors'] += 1
+        if sp.bytes:
+            agg['bytes'] += sp.bytes
+        if len(agg['samples']) < SUMMARY_SAMPLES:
+            agg['samples'].append(sp.duration)
+        else:
+            agg['samples'][agg['count'] % SUMMARY_SAMPLES] = sp.duration
+    if _span_log is not None:
+        record = {'ts': round(time.time(), 3), 'stage': sp.stage, 'duration': round(sp.duration, 4), 'ok': sp.ok}
+        if sp.bytes is not None:
+            record['bytes'] = sp.bytes
+        record.update(sp.attrs)
+        try:
+            _span_log.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        except Exception as e:
+            logging.debug(f"Не удалось записать замер: {e}")
+    for fn in _span_listeners:
+        try:
+            fn(sp)
+        except Exception as e:
+            logging.debug(f"Ошибка слушателя замеров: {e}")
+
+def add_span_listener(fn):
+    """fn(span) вызывается после каждого замера (например, для оценки качества связи)."""
+    _span_listeners.append(fn)
+
+def set_span_log(path):
+    """Включает запись каждого замера в файл JSON lines (None — выключает)."""
+    global _span_log
+    if _span_log is not None:
+        _span_log.close()
+        _span_log = None
+    if path:
+        _span_log = open(path, 'a', encoding='utf-8', buffering=1)
+        logging.info(f"🧾 Замеры стадий пишутся в {path}")
+
+def _percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def pass_summary(reset=True):
+    """Сводка по стадиям за проход: {stage: {count, errors, total, avg, p50, p95, max, bytes}}."""
+    with _lock:
+        stats = {stage: dict(agg, samples=list(agg['samples'])) for stage, agg in _pass_stats.items()}
+        if reset:
+            _pass_stats.clear()
+    summary = {}
+    for stage, agg in stats.items():
+        summary[stage] = {
+            'count': agg['count'],
+            'errors': agg['errors'],
+            'total': round(agg['total'], 3),
+            'avg': round(agg['total'] / agg['count'], 3) if agg['count'] else 0.0,
+            'p50': round(_percentile(agg['samples'], 0.5), 3),
+            'p95': round(_percentile(agg['samples'], 0.95), 3),
+            'max': round(agg['max'], 3),
+            'bytes': agg['bytes'],
+        }
+    return summary
+
+def _fmt_bytes(n):
+    if n >= 1048576:
+        return f"{n / 1048576:.1f} МБ"
+    return f"{n / 1024:.1f} КБ"
+
+def log_pass_summary(reset=True):
+    """Печатает сводку по стадиям (по убыванию суммарного времени) и пишет ее в JSON lines."""
+    summary = pass_summary(reset)
+    if not summary:
+        return summary
+    logging.info("⏱ Время по стадиям за проход:")
+    for stage, s in sorted(summary.items(), key=lambda item: item[1]['total'], reverse=True):
+        size = f", {_fmt_bytes(s['bytes'])}" if s['bytes'] else ""
+        logging.info(
+            f"   {stage}: {s['count']} шт., всего {s['total']:.1f} сек, ср. {s['avg']:.2f}, "
+            f"p50 {s['p50']:.2f}, p95 {s['p95']:.2f}, макс {s['max']:.2f}, ошибок {s['errors']}{size}"
+        )
+    if _span_log is not None:
+        try:
+            _span_log.write(json.dumps({'ts': round(time.time(), 3), 'summary': summary}, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logging.debug(f"Не удалось записать сводку: {e}")
+    return summary
+
+def register_gauge_callback(fn):
+    """fn() возвращает список (name, labels, value).
+
+    Колбэк читает состояние event loop (очереди, словари лимитеров), поэтому вызывается
+    только в нем — из monitor_loop_lag раз в секунду; /metrics отдает последний снимок.
+    """
+    _gauge_callbacks.append(fn)
+    refresh_gauges()
+
+def refresh_gauges():
+    """Пересчитывает значения колбэков (вызывать в потоке event loop)."""
+    global _callback_gauges
+    gauges = {}
+    for fn in list(_gauge_callbacks):
+        try:
+            for name, labels, value in fn():
+                gauges[_key(name, labels)] = value
+        except Exception as e:
+            logging.debug(f"Ошибка сбора метрики: {e}")
+    with _lock:
+        _callback_gauges = gauges
+
+def _fmt_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for k, v in labels:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+def _fmt_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def render():
+    """Все метрики в текстовом формате Prometheus (безопасно вызывать из потока HTTP-сервера)."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: (list(v[0]), v[1], v[2], v[3]) for k, v in _histograms.items()}
+        gauges = dict(_callback_gauges)
+        gauges.update(_gauges)
+    gauges[_key('worker_uptime_seconds', {})] = round(time.time() - _started_at, 3)
+
+    by_name = {}
+    for (name, labels), value in counters.items():
+        by_name.setdefault(name, []).append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+    for (name, labels), value in gauges.items():
+        by_name.setdefault(name, []).append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+    for (name, labels), (buckets, total, count, bounds) in histograms.items():
+        lines = by_name.setdefault(name, [])
+        for bound, n in zip(bounds, buckets):
+            lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', bound),))} {n}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(round(total, 6))}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {count}")
+
+    out = []
+    for name in sorted(by_name):
+        kind, help_text = _HELP.get(name, ('untyped', name))
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(by_name[name])
+    return '\n'.join(out) + '\n'
+
+def health():
+    """(ok, описание) — жив ли event loop воркера."""
+    age = time.time() - _last_heartbeat
+    if age > HEALTH_STALE_AFTER:
+        return False, f"event loop не отвечает {age:.0f} сек"
+    return True, "ok"
+
+async def monitor_loop_lag(interval=1.0):
+    """Фоновая задача: измеряет задержку event loop, обновляет heartbeat для /healthz
+    и снимок метрик-колбэков для /metrics."""
+    global _last_heartbeat
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        set_gauge('worker_event_loop_lag_seconds', round(lag, 4))
+        _last_heartbeat = time.time()
+        refresh_gauges()
+        if lag > 1.0:
+            logging.warning(f"🐢 Event loop заблокирован на {lag:.1f} сек.")
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics — метрики Prometheus, GET /healthz — проба живости."""
+    def render_metrics(self):
+        return render()
+
+    def health_status(self):
+        return health()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            self._reply(200, self.render_metrics(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif path == '/healthz':
+            ok, text = self.health_status()
+            self._reply(200 if ok else 503, text + '\n', 'text/plain; charset=utf-8')
+        else:
+            self._reply(404, 'not found\n', 'text/plain; charset=utf-8')
+
+    def _reply(self, status, body, content_type):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Не засоряем log.txt запросами Prometheus
+        pass
+
+def start_server(port, host='127.0.0.1', handler=MetricsHandler):
+    """Запускает HTTP-сервер метрик в фоновом потоке (не блокирует event loop)."""
+    server = HTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logging.info(f"📈 Метрики: http://{host}:{server.server_port}/metrics, проба: /healthz")
+    return server
@@ -51,6 +51,106 @@ def run_migration():
 
     ALTER TABLE public.vocabulary
     ADD COLUMN IF NOT EXISTS grammar_info text;
+
+    -- Аренда заявок: позволяет запускать несколько воркеров параллельно
+    ALTER TABLE public.word_requests
+    ADD COLUMN IF NOT EXISTS claimed_by text,
+    ADD COLUMN IF NOT EXISTS lease_expires_at timestamp with time zone;
+
+    CREATE INDEX IF NOT EXISTS idx_word_requests_lease ON public.word_requests (status, lease_expires_at);
+
+    -- Атомарный захват заявок (pending или с просроченной арендой)
+    CREATE OR REPLACE FUNCTION public.claim_word_requests(p_worker text, p_limit int DEFAULT 5, p_lease_seconds int DEFAULT 120)
+    RETURNS SETOF public.word_requests
+    LANGUAGE plpgsql
+    SECURITY DEFINER
+    SET search_path = public
+    AS $$
+    BEGIN
+        RETURN QUERY
+        UPDATE public.word_requests wr
+        SET status = 'processing',
+            claimed_by = p_worker,
+            lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+        WHERE wr.id IN (
+            SELECT id FROM public.word_requests
+            WHERE status = 'pending' OR (status = 'processing' AND lease_expires_at < now())
+            ORDER BY created_at
+            LIMIT p_limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING wr.*;
+    END;
+    $$;
+
+    REVOKE EXECUTE ON FUNCTION public.claim_word_requests(text, int, int) FROM public, anon, authenticated;
+    GRANT EXECUTE ON FUNCTION public.claim_word_requests(text, int, int) TO service_role;
+
+    -- Пакетная запись ссылок на медиа (одно обращение к БД вместо UPDATE на каждое слово).
+    -- Обновляются только переданные ключи, остальные колонки не трогаются.
+    CREATE OR REPLACE FUNCTION public.bulk_update_vocabulary_media(p_rows jsonb)
+    RETURNS SETOF bigint
+    LANGUAGE plpgsql
+    SECURITY DEFINER
+    SET search_path = public
+    AS $$
+    BEGIN
+        RETURN QUERY
+        UPDATE public.vocabulary v
+        SET audio_url = CASE WHEN r.item ? 'audio_url' THEN r.item->>'audio_url' ELSE v.audio_url END,
+            audio_male = CASE WHEN r.item ? 'audio_male' THEN r.item->>'audio_male' ELSE v.audio_male END,
+            example_audio = CASE WHEN r.item ? 'example_audio' THEN r.item->>'example_audio' ELSE v.example_audio END,
+            image = CASE WHEN r.item ? 'image' THEN r.item->>'image' ELSE v.image END,
+            image_source = CASE WHEN r.item ? 'image_source' THEN r.item->>'image_source' ELSE v.image_source END
+        FROM jsonb_array_elements(p_rows) AS r(item)
+        WHERE v.id = (r.item->>'id')::bigint
+        RETURNING v.id;
+    END;
+    $$;
+
+    REVOKE EXECUTE ON FUNCTION public.bulk_update_vocabulary_media(jsonb) FROM public, anon, authenticated;
+    GRANT EXECUTE ON FUNCTION public.bulk_update_vocabulary_media(jsonb) TO service_role;
+
+    -- Журнал неудачной генерации медиа (повторы с экспоненциальной задержкой)
+    CREATE TABLE IF NOT EXISTS public.media_failures (
+        vocabulary_id bigint PRIMARY KEY REFERENCES public.vocabulary(id) ON DELETE CASCADE,
+        attempts int NOT NULL DEFAULT 0,
+        last_error_class text,
+        last_error text,
+        next_attempt_at timestamp with time zone,
+        exhausted boolean NOT NULL DEFAULT false,
+        updated_at timestamp with time zone DEFAULT now()
+    );
+    ALTER TABLE public.media_failures ENABLE ROW LEVEL SECURITY;
+    CREATE INDEX IF NOT EXISTS idx_media_failures_next_attempt ON public.media_failures (next_attempt_at);
+
+    -- Очередь на генерацию медиа: слова без записи в журнале или с наступившим временем повтора
+    CREATE OR REPLACE VIEW public.vocabulary_media_queue AS
+    SELECT v.id, v.word_kr, v.translation, v.example_kr, v.topic,
+           v.audio_url, v.audio_male, v.example_audio, v.image, v.image_source,
+           f.attempts AS failure_attempts
+    FROM public.vocabulary v
+    LEFT JOIN public.media_failures f ON f.vocabulary_id = v.id
+    WHERE f.vocabulary_id IS NULL OR (NOT f.exhausted AND f.next_attempt_at <= now());
+    REVOKE ALL ON public.vocabulary_media_queue FROM anon, authenticated;
+
+    -- Realtime: воркер слушает изменения заявок, словаря и цитат
+    DO $$
+    DECLARE t text;
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_publication WHERE pubname = 'supabase_realtime') THEN
+            FOREACH t IN ARRAY ARRAY['word_requests', 'vocabulary', 'quotes'] LOOP
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_publication_tables
+                    WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = t
+                ) THEN
+                    EXECUTE format('ALTER PUBLICATION supabase_realtime ADD TABLE public.%I', t);
+                END IF;
+            END LOOP;
+        END IF;
+    END $$;
+
+    NOTIFY pgrst, 'reload';
     """
 
     try:
@@ -0,0 +1,91 @@
+import time
+import logging
+from collections import deque
+
+# Вес нового замера в EWMA (0.2 ≈ усреднение по последним ~10 вызовам)
+EWMA_ALPHA = 0.2
+# Сколько последних замеров хранить для p95
+WINDOW = 200
+# Стадии замеров (metrics.span) -> внешний сервис, к которому они относятся.
+# db_write сюда не входит: запросы к БД уже замеряются в execute_supabase_query.
+STAGE_ENDPOINTS = {
+    'tts': 'edge_tts',
+    'storage_upload': 'supabase_storage',
+    'storage_delete': 'supabase_storage',
+    'storage_list': 'supabase_storage',
+    'edge_image': 'supabase_edge',
+    'gemini': 'gemini',
+}
+
+class EndpointEstimate:
+    """Скользящая оценка качества связи с одним сервисом по реальным вызовам:
+    EWMA и p95 задержки, EWMA пропускной способности (байт/сек) и доли ошибок."""
+    def __init__(self, name):
+        self.name = name
+        self.samples = 0
+        self.latency_ewma = None
+        self.throughput_ewma = None
+        self.error_ewma = 0.0
+        self.updated_at = 0.0
+        self._window = deque(maxlen=WINDOW)
+
+    def record(self, duration, nbytes=None, ok=True):
+        self.samples += 1
+        self.updated_at = time.time()
+        self._window.append(duration)
+        self.latency_ewma = duration if self.latency_ewma is None else (1 - EWMA_ALPHA) * self.latency_ewma + EWMA_ALPHA * duration
+        self.error_ewma = (1 - EWMA_ALPHA) * self.error_ewma + EWMA_ALPHA * (0.0 if ok else 1.0)
+        if nbytes and duration > 0:
+            rate = nbytes / duration
+            self.throughput_ewma = rate if self.throughput_ewma is None else (1 - EWMA_ALPHA) * self.throughput_ewma + EWMA_ALPHA * rate
+
+    @property
+    def p95(self):
+        if not self._window:
+            return None
+        ordered = sorted(self._window)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def snapshot(self):
+        return {
+            'samples': self.samples,
+            'latency_ewma': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            'latency_p95': round(self.p95, 3) if self.p95 is not None else None,
+            'throughput': round(self.throughput_ewma) if self.throughput_ewma is not None else None,
+            'error_rate': round(self.error_ewma, 3),
+        }
+
+_estimates = {}
+
+def get(endpoint):
+    """Оценка сервиса (создается при первом замере)."""
+    if endpoint not in _estimates:
+        _estimates[endpoint] = EndpointEstimate(endpoint)
+    return _estimates[endpoint]
+
+def record(endpoint, duration, nbytes=None, ok=True):
+    get(endpoint).record(duration, nbytes, ok)
+
+def latency(endpoint):
+    """EWMA задержки сервиса или None, если вызовов еще не было."""
+    estimate = _estimates.get(endpoint)
+    return estimate.latency_ewma if estimate else None
+
+def on_span(sp):
+    """Слушатель metrics.span: переносит замеры стадий в оценки сервисов."""
+    endpoint = STAGE_ENDPOINTS.get(sp.stage)
+    if endpoint:
+        record(endpoint, sp.duration, sp.bytes, sp.ok)
+
+def snapshot():
+    return {name: estimate.snapshot() for name, estimate in _estimates.items()}
+
+def log_state():
+    parts = []
+    for name, s in snapshot().items():
+        if s['latency_ewma'] is None:
+            continue
+        speed = f", {s['throughput'] / 1024:.0f} КБ/с" if s['throughput'] else ""
+        parts.append(f"{name}: ~{s['latency_ewma']:.2f}с, p95 {s['latency_p95']:.2f}с{speed}, ошибок {s['error_rate'] * 100:.0f}%")
+    if parts:
+        logging.info(f"📡 Качество связи: {'; '.join(parts)}")
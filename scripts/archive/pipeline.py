@@ -0,0 +1,186 @@
+import time
+import asyncio
+import logging
+
+# Маркер завершения потока для очередей конвейера
+_DONE = object()
+# Пауза перед повторным чтением страницы после ошибки: 2, 4, 8 ... сек, но не больше минуты
+FETCH_RETRY_BASE = 2.0
+FETCH_RETRY_MAX = 60.0
+
+class StageStats:
+    """Счетчики одной стадии конвейера (количество, ошибки, суммарное время работы)."""
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.busy = 0.0
+
+    def record(self, duration, ok=True):
+        self.count += 1
+        self.busy += duration
+        if not ok:
+            self.errors += 1
+
+    def summary(self, elapsed):
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        avg = self.busy / self.count if self.count else 0.0
+        return f"{self.name}: {self.count} шт. ({rate:.2f}/сек, ср. {avg:.2f} сек, ошибок {self.errors})"
+
+class MediaPipeline:
+    """Потоковый конвейер: fetcher -> очередь -> N обработчиков -> очередь -> writer.
+
+    fetch_page(cursor) -> (rows, next_cursor); next_cursor=None означает конец прохода.
+    process(row) -> result; None — ошибка обработки, пустой результат — записывать нечего.
+    write(row, result) -> bool (успешна ли запись).
+    on_row_done(row) вызывается, когда строка полностью прошла конвейер (в т.ч. с ошибкой).
+    Очереди ограничены, поэтому медленный writer или обработчики притормаживают fetcher.
+    stop() прекращает прием новых строк: начатые дорабатываются и записываются,
+    а строки из очереди отбрасываются без on_row_done (курсор их не пропустит).
+    Ошибка чтения страницы не прерывает проход: страница перечитывается с паузой.
+    Writer всегда дорабатывает очередь результатов, поэтому загруженные медиа не теряются.
+    """
+    def __init__(self, fetch_page, process, write, consumers, writers=4, report_interval=30, start_cursor=None, on_row_done=None):
+        self.fetch_page = fetch_page
+        self.process = process
+        self.write = write
+        self.start_cursor = start_cursor
+        self.on_row_done = on_row_done
+        self.consumers = max(1, consumers)
+        self.writers = max(1, writers)
+        self.report_interval = report_interval
+        self.work_queue = asyncio.Queue(maxsize=self.consumers * 2)
+        self.result_queue = asyncio.Queue(maxsize=self.consumers * 2)
+        self.stats = {
+            'fetch': StageStats('fetch'),
+            'process': StageStats('process'),
+            'write': StageStats('write'),
+        }
+        self.started_at = None
+        self.stopped = False
+        self.dropped = 0
+        self._stop_event = asyncio.Event()
+        self._unqueued = [] # результаты отмененных обработчиков, не успевшие попасть в очередь
+
+    def _row_done(self, row):
+        if self.on_row_done:
+            try:
+                self.on_row_done(row)
+            except Exception as e:
+                logging.warning(f"⚠️ Ошибка обработчика завершения строки: {e}")
+
+    def stop(self):
+        """Остановка приема: новые страницы не читаются, очередь не обрабатывается."""
+        if not self.stopped:
+            self.stopped = True
+            self._stop_event.set()
+            logging.info("🛑 Конвейер останавливается: дорабатываются начатые строки...")
+
+    async def _fetch_with_retry(self, cursor):
+        """Читает страницу, повторяя при ошибках; None — конвейер остановили, пока ждали повтора."""
+        failures = 0
+        while not self.stopped:
+            start = time.time()
+            try:
+                page = await self.fetch_page(cursor)
+                self.stats['fetch'].busy += time.time() - start
+                return page
+            except Exception as e:
+                self.stats['fetch'].busy += time.time() - start
+                self.stats['fetch'].errors += 1
+                delay = min(FETCH_RETRY_MAX, FETCH_RETRY_BASE * (2 ** failures))
+                failures += 1
+                logging.warning(f"⚠️ Ошибка чтения страницы (после id {cursor}): {e}. Повтор через {delay:.0f} сек...")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    async def _fetcher(self):
+        cursor = self.start_cursor
+        while not self.stopped:
+            page = await self._fetch_with_retry(cursor)
+            if page is None:
+                break
+            rows, cursor = page
+            for row in rows:
+                if self.stopped:
+                    self.dropped += 1
+                    continue
+                self.stats['fetch'].count += 1
+                await self.work_queue.put(row)
+            if cursor is None:
+                break
+        for _ in range(self.consumers):
+            await self.work_queue.put(_DONE)
+
+    async def _consumer(self):
+        while True:
+            row = await self.work_queue.get()
+            if row is _DONE:
+                break
+            if self.stopped:
+                self.dropped += 1
+                continue
+            start = time.time()
+            result = None
+            try:
+                result = await self.process(row)
+            except Exception as e:
+                logging.error(f"❌ Необработанная ошибка конвейера: {e}")
+            self.stats['process'].record(time.time() - start, ok=result is not None)
+            if result:
+                try:
+                    await self.result_queue.put((row, result))
+                except asyncio.CancelledError:
+                    # Медиа уже загружены — результат допишет writer при завершении прохода
+                    self._unqueued.append((row, result))
+                    raise
+            else:
+                self._row_done(row)
+
+    async def _writer(self):
+        while True:
+            item = await self.result_queue.get()
+            if item is _DONE:
+                break
+            row, result = item
+            start = time.time()
+            ok = False
+            try:
+                ok = await self.write(row, result)
+            except Exception as e:
+                logging.error(f"❌ Ошибка записи результата (id={row.get('id')}): {e}")
+            self.stats['write'].record(time.time() - start, ok=bool(ok))
+            self._row_done(row)
+
+    async def _reporter(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            logging.info(f"📊 Конвейер: {self.report()} | очередь: {self.work_queue.qsize()}/{self.result_queue.qsize()}")
+
+    def report(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        return "; ".join(s.summary(elapsed) for s in self.stats.values())
+
+    async def run(self):
+        """Выполняет один полный проход и возвращает статистику по стадиям."""
+        self.started_at = time.time()
+        reporter = asyncio.create_task(self._reporter())
+        writers = [asyncio.create_task(self._writer()) for _ in range(self.writers)]
+        consumers = [asyncio.create_task(self._consumer()) for _ in range(self.consumers)]
+        try:
+            await asyncio.gather(self._fetcher(), *consumers)
+        finally:
+            reporter.cancel()
+            for t in consumers:
+                t.cancel()
+            # Очередь результатов закрывается маркером: writer дописывает всё, что уже сгенерировано
+            await asyncio.gather(*consumers, return_exceptions=True)
+            for item in self._unqueued:
+                await self.result_queue.put(item)
+            for _ in range(self.writers):
+                await self.result_queue.put(_DONE)
+            await asyncio.gather(*writers)
+        return self.stats
@@ -0,0 +1,164 @@
+import re
+import time
+import asyncio
+import logging
+
+# Квоты внешних сервисов: запросов в секунду (rate) и допустимый всплеск (burst).
+# Лимиты моделей Gemini взяты с запасом ~10% ниже квоты (RPM / 60), чтобы не ловить 429.
+# Ключ 'gemini' — общий лимит провайдера, 'gemini:<model>' — лимит конкретной модели.
+RATE_LIMITS = {
+    'gemini': {'rate': 1.0, 'burst': 4},
+    'gemini:gemini-2.5-flash': {'rate': 9 / 60, 'burst': 3},
+    'gemini:gemini-2.5-pro': {'rate': 4.5 / 60, 'burst': 2},
+    'gemini:gemini-2.0-flash': {'rate': 13.5 / 60, 'burst': 3},
+    'gemini:gemini-2.0-flash-lite': {'rate': 27 / 60, 'burst': 5},
+    'tts': {'rate': 10.0, 'burst': 20},
+    'storage': {'rate': 20.0, 'burst': 40},
+    'edge_image': {'rate': 2.0, 'burst': 4},
+}
+# Лимит для моделей, которых нет в таблице
+DEFAULT_MODEL_LIMIT = {'rate': 4.5 / 60, 'burst': 2}
+# Пауза по умолчанию после 429, если сервис не прислал retryDelay
+DEFAULT_PENALTY = 5.0
+
+class TokenBucket:
+    """Корзина токенов: пополняется со скоростью `rate` в секунду, вмещает не больше `burst`.
+
+    Токен резервируется сразу (баланс может уйти в минус), а ожидание идет уже
+    без блокировки: каждый следующий вызов ждет дольше предыдущего, поэтому
+    очередь остается FIFO, а всплеск запросов растягивается во времени.
+    """
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = float(max(1, burst))
+        self.tokens = self.burst
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self.stats = {'acquired': 0, 'waited': 0, 'wait_time': 0.0, 'penalties': 0, 'rejected': 0}
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_time(self, now, tokens):
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self, tokens=1, max_wait=None):
+        """Берет токен, при необходимости дожидаясь его.
+
+        Если ждать пришлось бы дольше max_wait секунд (с учетом уже стоящих в очереди),
+        сразу возвращает False, ничего не забирая.
+        """
+        # Резерв считается без await, поэтому между вызовами гонок нет и блокировка не нужна
+        now = time.monotonic()
+        self._refill(now)
+        wait = self._wait_time(now, tokens)
+        if max_wait is not None and wait > max_wait:
+            self.stats['rejected'] += 1
+            return False
+        self.tokens -= tokens
+        self.stats['acquired'] += 1
+        if wait <= 0:
+            return True
+
+        self.stats['waited'] += 1
+        self.stats['wait_time'] += wait
+        try:
+            await asyncio.sleep(wait)
+            # Пока ждали, сервис мог ответить 429 — пауза (penalize) касается и зарезервированных токенов
+            while self.blocked_until > time.monotonic():
+                await asyncio.sleep(self.blocked_until - time.monotonic())
+        except asyncio.CancelledError:
+            # Вызов отменен — возвращаем резерв следующим в очереди
+            self.tokens = min(self.burst, self.tokens + tokens)
+            raise
+        return True
+
+    def penalize(self, seconds):
+        """Сервис ответил 429: опустошаем корзину и не выдаем токены `seconds` секунд."""
+        now = time.monotonic()
+        self._refill(now)
+        # Долг уже зарезервированных токенов сохраняется
+        self.tokens = min(self.tokens, 0.0)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.stats['penalties'] += 1
+
+    def snapshot(self):
+        return {
+            'rate': round(self.rate, 3),
+            'burst': int(self.burst),
+            'acquired': self.stats['acquired'],
+            'waited': self.stats['waited'],
+            'wait_time': round(self.stats['wait_time'], 2),
+            'penalties': self.stats['penalties'],
+            'rejected': self.stats['rejected'],
+        }
+
+_buckets = {}
+
+def get_bucket(name):
+    """Возвращает корзину по ключу (создает по настройкам RATE_LIMITS)."""
+    if name not in _buckets:
+        conf = RATE_LIMITS.get(name)
+        if conf is None:
+            conf = DEFAULT_MODEL_LIMIT if name.startswith('gemini:') else {'rate': 10.0, 'burst': 10}
+        _buckets[name] = TokenBucket(name, conf['rate'], conf['burst'])
+    return _buckets[name]
+
+def model_key(provider, model):
+    return f"{provider}:{model}"
+
+async def acquire(name, model=None, max_wait=None):
+    """Берет токен у провайдера (и у модели, если указана). False — модель перегружена дольше max_wait."""
+    if model is not None and not await get_bucket(model_key(name, model)).acquire(max_wait=max_wait):
+        return False
+    return await get_bucket(name).acquire()
+
+def penalize(name, seconds=None, model=None):
+    key = model_key(name, model) if model is not None else name
+    seconds = DEFAULT_PENALTY if seconds is None else seconds
+    get_bucket(key).penalize(seconds)
+    logging.warning(f"⏳ [{key}] Превышена квота (429). Пауза {seconds:.0f} сек.")
+
+def is_rate_limited(error):
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text
+
+_RETRY_DELAY_RE = re.compile(r"retry[_ ]?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE)
+
+def retry_delay(error):
+    """Достает retryDelay из ответа 429 (Gemini отдает его в details), иначе None."""
+    match = _RETRY_DELAY_RE.search(str(error))
+    return float(match.group(1)) if match else None
+
+def set_rate(name, rate, burst=None):
+    """Переопределяет лимит (например, из аргументов командной строки)."""
+    conf = {'rate': float(rate), 'burst': burst if burst is not None else max(1, int(rate))}
+    RATE_LIMITS[name] = conf
+    if name in _buckets:
+        bucket = _buckets[name]
+        bucket.rate = conf['rate']
+        bucket.burst = float(max(1, conf['burst']))
+        bucket.tokens = min(bucket.tokens, bucket.burst)
+
+def scale_all(factor):
+    """Делит квоты между процессами (шардами): каждый получает долю `factor` от общего лимита."""
+    for name, conf in list(RATE_LIMITS.items()):
+        set_rate(name, conf['rate'] * factor, max(1, int(conf['burst'] * factor)))
+    DEFAULT_MODEL_LIMIT['rate'] *= factor
+    DEFAULT_MODEL_LIMIT['burst'] = max(1, int(DEFAULT_MODEL_LIMIT['burst'] * factor))
+
+def snapshot():
+    return {name: bucket.snapshot() for name, bucket in _buckets.items()}
+
+def log_state():
+    parts = [
+        f"{name}: {s['acquired']} (ждали {s['waited']}, {s['wait_time']:.1f}с, 429: {s['penalties']})"
+        for name, s in snapshot().items() if s['acquired'] or s['penalties']
+    ]
+    if parts:
+        logging.info(f"🪣 Лимиты частоты: {'; '.join(parts)}")
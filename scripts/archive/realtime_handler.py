@@ -2,6 +2,32 @@ import asyncio
 import logging
 import aiohttp
 from supabase import create_async_client
+from local_supabase import is_local_url
+
+# Состояние подписки: пока она активна, опрос таблиц нужен только как редкая страховка
+_state = {'connected': False}
+
+def is_connected():
+    return _state['connected']
+
+def payload_record(payload):
+    """Достает новую версию строки из payload postgres_changes (формат отличается между версиями realtime)."""
+    if not isinstance(payload, dict):
+        return None
+    data = payload.get('data') if isinstance(payload.get('data'), dict) else payload
+    record = data.get('record') or data.get('new')
+    return record if isinstance(record, dict) else None
+
+def _safe_callback(name, handler):
+    """Оборачивает обработчик, чтобы ошибка в нем не роняла канал Realtime."""
+    def callback(payload):
+        try:
+            record = payload_record(payload)
+            if record is not None:
+                handler(record)
+        except Exception as e:
+            logging.warning(f"⚠️ Ошибка обработки события Realtime ({name}): {e}")
+    return callback
 
 async def check_internet_connection():
     """Проверяет доступность интернета перед подключением к Realtime"""
@@ -12,11 +38,24 @@ async def check_internet_connection():
     except:
         return False
 
-async def realtime_loop(trigger_event: asyncio.Event, supabase_url: str, supabase_key: str):
-    """Асинхронный цикл для Realtime подписки (требует async client)"""
+async def realtime_loop(trigger_event: asyncio.Event, supabase_url: str, supabase_key: str, on_request=None, on_vocabulary=None, on_quote=None):
+    """Асинхронный цикл для Realtime подписки (требует async client)
+
+    on_request(record) получает вставленную заявку word_requests прямо из payload,
+    чтобы воркер не перечитывал таблицу. on_vocabulary(record) / on_quote(record)
+    получают новую версию строки при INSERT/UPDATE в vocabulary и quotes,
+    чтобы медиа генерировались сразу, а не при следующем опросе.
+    """
+    if is_local_url(supabase_url):
+        logging.info("🧪 Локальный Supabase: Realtime недоступен, работаю в режиме опроса.")
+        return
+
+    request_callback = _safe_callback("word_requests INSERT", on_request) if on_request else None
 
     def on_insert_callback(payload):
         logging.info("🔔 Realtime: Получена новая заявка!")
+        if request_callback:
+            request_callback(payload)
         trigger_event.set()
         
     retry_delay = 5
@@ -42,10 +81,25 @@ async def realtime_loop(trigger_event: asyncio.Event, supabase_url: str, supabas
                 table="word_requests",
                 callback=on_insert_callback
             )
+
+            subscriptions = []
+            if on_vocabulary:
+                subscriptions.append(("vocabulary", on_vocabulary))
+            if on_quote:
+                subscriptions.append(("quotes", on_quote))
+            for table, handler in subscriptions:
+                for event in ("INSERT", "UPDATE"):
+                    channel.on_postgres_changes(
+                        event=event,
+                        schema="public",
+                        table=table,
+                        callback=_safe_callback(f"{table} {event}", handler)
+                    )
             
             logging.info("🟢 Realtime Listener: Подписка...")
             await channel.subscribe()
             logging.info("🟢 Realtime Listener: Подписка активна.")
+            _state['connected'] = True
             
             # Сброс задержки при успешном подключении
             retry_delay = 5
@@ -56,14 +110,17 @@ async def realtime_loop(trigger_event: asyncio.Event, supabase_url: str, supabas
                 await asyncio.sleep(60)
             
             logging.info("♻️ Плановый перезапуск Realtime соединения (TTL)...")
+            _state['connected'] = False
             await channel.unsubscribe()
                 
         except AttributeError as e:
+            _state['connected'] = False
             if "has no attribute" in str(e):
                 logging.error(f"❌ Ошибка версии библиотеки Realtime ({e}). Попробуйте: pip install --upgrade supabase")
                 logging.warning("⚠️ Переход в режим Polling (опрос раз в 30 сек).")
                 return 
         except Exception as e:
+            _state['connected'] = False
             logging.warning(f"⚠️ Ошибка Realtime: {e}. Реконнект через {retry_delay} сек...")
             await asyncio.sleep(retry_delay)
             retry_delay = min(retry_delay * 1.5, 60)
\ No newline at end of file
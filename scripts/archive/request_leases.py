@@ -0,0 +1,158 @@
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from app_utils import execute_supabase_query # type: ignore
+from constants import DB_TABLES, WORD_REQUEST_STATUS
+
+# Время аренды заявки (сек). Если воркер умер, заявку подхватит другой после истечения.
+LEASE_SECONDS = 120
+# Как часто продлеваем аренду удерживаемых заявок
+RENEW_INTERVAL = 40
+
+def make_worker_id():
+    """Уникальный идентификатор экземпляра воркера (хост:pid:случайный суффикс)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def _utc_iso(dt):
+    return dt.astimezone(timezone.utc).isoformat()
+
+class RequestLeaseManager:
+    """Атомарный захват заявок word_requests с арендой (lease).
+
+    Заявка переводится в статус 'processing' одним условным UPDATE (RPC
+    claim_word_requests или фоллбэк через PostgREST), поэтому два воркера
+    никогда не получат одну и ту же заявку. Просроченные аренды подхватываются повторно.
+    """
+    def __init__(self, supabase_client, worker_id=None, lease_seconds=LEASE_SECONDS):
+        self.db = supabase_client
+        self.worker_id = worker_id or make_worker_id()
+        self.lease_seconds = lease_seconds
+        self.held = set()
+        self.use_rpc = True
+
+    def set_db_client(self, db_client):
+        """Переключает запросы на другой клиент (например, async)."""
+        self.db = db_client
+
+    def _claimable_filter(self, now):
+        return (
+            f"status.eq.{WORD_REQUEST_STATUS['PENDING']},"
+            f"and(status.eq.{WORD_REQUEST_STATUS['PROCESSING']},lease_expires_at.lt.\"{_utc_iso(now)}\")"
+        )
+
+    def _lease_payload(self, now):
+        return {
+            'status': WORD_REQUEST_STATUS['PROCESSING'],
+            'claimed_by': self.worker_id,
+            'lease_expires_at': _utc_iso(now + timedelta(seconds=self.lease_seconds)),
+        }
+
+    async def claim(self, limit=5):
+        """Захватывает до `limit` заявок и возвращает их строки."""
+        rows = None
+        if self.use_rpc:
+            try:
+                builder = self.db.rpc('claim_word_requests', {
+                    'p_worker': self.worker_id,
+                    'p_limit': limit,
+                    'p_lease_seconds': self.lease_seconds,
+                })
+                res = await execute_supabase_query(builder)
+                rows = res.data if res and res.data else []
+            except Exception as e:
+                err_str = str(e)
+                if 'claim_word_requests' in err_str or 'PGRST202' in err_str:
+                    logging.warning("⚠️ RPC claim_word_requests не найдена (запустите migrate_schema.py). Использую условный UPDATE.")
+                    self.use_rpc = False
+                else:
+                    raise
+
+        if rows is None:
+            rows = await self._claim_fallback(limit)
+
+        rows = [r for r in rows if isinstance(r, dict) and r.get('id')]
+        for r in rows:
+            self.held.add(r['id'])
+        return rows
+
+    async def claim_ids(self, ids):
+        """Захватывает конкретные заявки (например, пришедшие через Realtime) одним условным UPDATE.
+        Заявки, которые уже забрал другой воркер, просто не вернутся."""
+        ids = [i for i in ids if i not in self.held]
+        if not ids:
+            return []
+        now = datetime.now(timezone.utc)
+        builder = self.db.table(DB_TABLES['WORD_REQUESTS']).update(self._lease_payload(now)).in_('id', ids).or_(self._claimable_filter(now))
+        res = await execute_supabase_query(builder)
+        rows = [r for r in (res.data if res and res.data else []) if isinstance(r, dict) and r.get('id')]
+        for r in rows:
+            self.held.add(r['id'])
+        return rows
+
+    async def _claim_fallback(self, limit):
+        """Захват без RPC: выбираем кандидатов и забираем их одним условным UPDATE.
+        Повторная проверка условия внутри UPDATE гарантирует, что конкурирующий воркер
+        не получит ту же строку."""
+        table = DB_TABLES['WORD_REQUESTS']
+        now = datetime.now(timezone.utc)
+        claimable = self._claimable_filter(now)
+
+        builder = self.db.table(table).select('id').or_(claimable).order('created_at').limit(limit)
+        res = await execute_supabase_query(builder)
+        ids = [r['id'] for r in (res.data if res and res.data else [])]
+        if not ids:
+            return []
+
+        builder = self.db.table(table).update(self._lease_payload(now)).in_('id', ids).or_(claimable)
+        res = await execute_supabase_query(builder)
+        return res.data if res and res.data else []
+
+    async def renew(self):
+        """Продлевает аренду всех удерживаемых заявок."""
+        if not self.held:
+            return
+        snapshot = set(self.held)
+        now = datetime.now(timezone.utc)
+        builder = self.db.table(DB_TABLES['WORD_REQUESTS']).update({
+            'lease_expires_at': _utc_iso(now + timedelta(seconds=self.lease_seconds))
+        }).in_('id', list(snapshot)).eq('claimed_by', self.worker_id).eq('status', WORD_REQUEST_STATUS['PROCESSING'])
+        res = await execute_supabase_query(builder)
+        renewed = {r.get('id') for r in (res.data if res and res.data else [])}
+        lost = snapshot - renewed
+        if lost:
+            # Заявка уже завершена или аренду перехватил другой воркер — больше её не держим
+            self.held -= lost
+
+    def release(self, req_id):
+        """Отпускает заявку после завершения обработки (статус уже выставлен обработчиком)."""
+        self.held.discard(req_id)
+
+    async def requeue_held(self):
+        """Возвращает все удерживаемые заявки в очередь (status=pending) при остановке воркера,
+        чтобы другой экземпляр подхватил их сразу, не дожидаясь истечения аренды."""
+        if not self.held:
+            return 0
+        ids = list(self.held)
+        builder = self.db.table(DB_TABLES['WORD_REQUESTS']).update({
+            'status': WORD_REQUEST_STATUS['PENDING'],
+            'claimed_by': None,
+            'lease_expires_at': None,
+        }).in_('id', ids).eq('claimed_by', self.worker_id).eq('status', WORD_REQUEST_STATUS['PROCESSING'])
+        res = await execute_supabase_query(builder)
+        self.held.clear()
+        returned = len(res.data) if res and res.data else 0
+        if returned:
+            logging.info(f"↩️ {returned} незавершенных заявок возвращены в очередь.")
+        return returned
+
+    async def renew_loop(self):
+        """Фоновое продление аренды."""
+        while True:
+            await asyncio.sleep(RENEW_INTERVAL)
+            try:
+                await self.renew()
+            except Exception as e:
+                logging.warning(f"⚠️ Ошибка продления аренды заявок: {e}")
@@ -0,0 +1,80 @@
+import os
+import json
+import logging
+from collections import deque
+
+# Файл состояния воркера (курсоры сканирования), рядом с log.txt
+STATE_FILE = 'worker_state.json'
+
+class ScanCursor:
+    """Сохраняемый курсор keyset-сканирования (id > cursor).
+
+    Курсор сдвигается только тогда, когда все строки страницы и всех
+    предыдущих страниц обработаны, поэтому после перезапуска скан продолжится
+    с места остановки и не пропустит строки, которые еще стояли в очереди.
+    """
+    def __init__(self, key, path=STATE_FILE):
+        self.key = key
+        self.path = path
+        self.committed = self._load()
+        self._pages = deque() # [{'end': id, 'left': n}]
+        self._row_page = {}
+
+    def _load_all(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось прочитать {self.path}: {e}")
+            return {}
+
+    def _load(self):
+        return self._load_all().get('cursors', {}).get(self.key)
+
+    def _save(self):
+        data = self._load_all()
+        cursors = data.setdefault('cursors', {})
+        if self.committed is None:
+            cursors.pop(self.key, None)
+        else:
+            cursors[self.key] = self.committed
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось сохранить курсор сканирования: {e}")
+
+    def page_fetched(self, page_end, row_ids):
+        """Регистрирует прочитанную страницу: page_end — последний id страницы, row_ids — строки, ушедшие в работу."""
+        page = {'end': page_end, 'left': 0}
+        for rid in row_ids:
+            self._row_page[rid] = page
+            page['left'] += 1
+        self._pages.append(page)
+        self._advance()
+
+    def row_done(self, row_id):
+        page = self._row_page.pop(row_id, None)
+        if page is not None:
+            page['left'] -= 1
+            self._advance()
+
+    def _advance(self):
+        moved = False
+        while self._pages and self._pages[0]['left'] <= 0:
+            self.committed = self._pages.popleft()['end']
+            moved = True
+        if moved:
+            self._save()
+
+    def reset(self):
+        """Скан дошел до конца таблицы — следующий проход начнется сначала."""
+        self._pages.clear()
+        self._row_page.clear()
+        self.committed = None
+        self._save()
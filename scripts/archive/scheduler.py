@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from collections import deque
+
+# Веса фоновых классов (доля слотов при конкуренции). Класс 'user' обслуживается строго первым.
+DEFAULT_WEIGHTS = {'words': 4, 'quotes': 1, 'force': 1}
+# Пока есть заявки пользователей, фоновая работа занимает не больше этой доли слотов
+BACKGROUND_SHARE_WHEN_BUSY = 0.5
+
+class _SlotContext:
+    def __init__(self, scheduler, cls):
+        self.scheduler = scheduler
+        self.cls = cls
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.cls)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.scheduler.release(self.cls)
+        return False
+
+class PriorityScheduler:
+    """Общий планировщик слотов работы для заявок пользователей, слов, цитат и force-перегенерации.
+
+    - 'user' — строгий приоритет: свободный слот всегда отдается заявке, если она ждет;
+      `user_reserve` слотов фоновые классы не занимают никогда.
+    - Фоновые классы делят остальное по весам (stride scheduling): при конкуренции
+      'words' получает в weight раз больше слотов, чем 'quotes', и никто не голодает.
+    - Вытеснение: пока заявки пользователей ждут или выполняются, новые фоновые задачи
+      не стартуют, если фон уже занимает больше BACKGROUND_SHARE_WHEN_BUSY слотов.
+      Уже начатые задачи дорабатывают (вытеснение на границе задач).
+    """
+    USER = 'user'
+
+    def __init__(self, capacity, user_reserve=0, weights=None, busy_share=BACKGROUND_SHARE_WHEN_BUSY):
+        self.capacity = max(1, capacity)
+        self.user_reserve = max(0, min(user_reserve, self.capacity - 1))
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.busy_share = busy_share
+        self.waiters = {self.USER: deque(), **{cls: deque() for cls in self.weights}}
+        self.in_use = {cls: 0 for cls in self.waiters}
+        self.granted = {cls: 0 for cls in self.waiters}
+        self._pass = {cls: 0.0 for cls in self.weights}
+        self._vtime = 0.0
+
+    def slot(self, cls):
+        """async with scheduler.slot('words'): ... — выполнить единицу работы класса cls."""
+        if cls not in self.waiters:
+            raise ValueError(f"Неизвестный класс работы: {cls}")
+        return _SlotContext(self, cls)
+
+    @property
+    def total_in_use(self):
+        return sum(self.in_use.values())
+
+    @property
+    def background_in_use(self):
+        return self.total_in_use - self.in_use[self.USER]
+
+    @property
+    def user_pressure(self):
+        return bool(self.waiters[self.USER]) or self.in_use[self.USER] > 0
+
+    def _background_limit(self):
+        limit = self.capacity - self.user_reserve
+        if self.user_pressure:
+            limit = min(limit, max(1, int(self.capacity * self.busy_share)))
+        return limit
+
+    async def acquire(self, cls):
+        fut = asyncio.get_running_loop().create_future()
+        if cls != self.USER and not self.waiters[cls]:
+            # Класс, вернувшийся после простоя, не копит «долг» и не забирает все слоты разом
+            self._pass[cls] = max(self._pass[cls], self._vtime)
+        self.waiters[cls].append(fut)
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Слот уже выдан, но задачу отменили — возвращаем его
+                self.release(cls)
+            else:
+                self.waiters[cls].remove(fut)
+            raise
+
+    def release(self, cls):
+        self.in_use[cls] -= 1
+        self._dispatch()
+
+    def _grant(self, cls):
+        fut = self.waiters[cls].popleft()
+        self.in_use[cls] += 1
+        self.granted[cls] += 1
+        fut.set_result(None)
+
+    def _next_background_class(self):
+        candidates = [cls for cls in self.weights if self.waiters[cls]]
+        if not candidates:
+            return None
+        # Класс с наименьшим «проходом» получает слот; проход растет обратно весу
+        cls = min(candidates, key=lambda c: self._pass[c])
+        self._vtime = self._pass[cls]
+        self._pass[cls] += 1.0 / self.weights[cls]
+        return cls
+
+    def _dispatch(self):
+        while self.total_in_use < self.capacity:
+            if self.waiters[self.USER]:
+                self._grant(self.USER)
+                continue
+            if self.background_in_use >= self._background_limit():
+                break
+            cls = self._next_background_class()
+            if cls is None:
+                break
+            self._grant(cls)
+
+    def snapshot(self):
+        return {
+            cls: {'waiting': len(self.waiters[cls]), 'in_use': self.in_use[cls], 'granted': self.granted[cls]}
+            for cls in self.waiters
+        }
+
+    def log_state(self):
+        parts = [f"{cls}: {s['in_use']} в работе, {s['waiting']} ждут, всего {s['granted']}" for cls, s in self.snapshot().items() if s['granted'] or s['waiting']]
+        if parts:
+            logging.info(f"🗂 Планировщик ({self.capacity} слотов): {'; '.join(parts)}")
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import metrics
+
+class SingleFlight:
+    """Схлопывание одинаковых одновременных вызовов.
+
+    Пока вызов с ключом key выполняется, остальные вызовы с тем же ключом
+    не запускают работу заново, а ждут общий результат (или общее исключение).
+    Работа идет в отдельной задаче: отмена одного из ожидающих не прерывает ее для остальных.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._in_flight = {}
+        self.stats = {'calls': 0, 'shared': 0}
+
+    async def do(self, key, func):
+        """Выполняет func() или присоединяется к уже идущему вызову с тем же key."""
+        self.stats['calls'] += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.stats['shared'] += 1
+            metrics.inc('worker_singleflight_shared_total', group=self.name)
+        return await asyncio.shield(task)
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+_groups = {}
+
+def group(name):
+    """Группа схлопывания (создается при первом обращении)."""
+    if name not in _groups:
+        _groups[name] = SingleFlight(name)
+    return _groups[name]
+
+def snapshot():
+    return {name: dict(g.stats, in_flight=g.in_flight) for name, g in _groups.items()}
+
+def log_state():
+    parts = [f"{name}: {s['shared']} из {s['calls']}" for name, s in snapshot().items() if s['shared']]
+    if parts:
+        logging.info(f"🔗 Схлопнуто одинаковых вызовов: {'; '.join(parts)}")
@@ -0,0 +1,130 @@
+import time
+import asyncio
+import logging
+from urllib.parse import unquote
+from limiters import limit
+import rate_limits
+import metrics
+from constants import MIN_FILE_SIZE
+
+# Объектов на страницу при листинге бакета (максимум Storage API — 1000)
+LIST_PAGE_SIZE = 1000
+# Как часто дочитывать новые объекты (сек)
+REFRESH_INTERVAL = 300
+# Раз в столько секунд бакет перечитывается целиком (чтобы заметить удаленные объекты)
+FULL_REFRESH_INTERVAL = 3600
+
+class StorageIndex:
+    """Индекс существующих объектов бакета Storage.
+
+    Файлы аудио называются детерминированно (md5 текста), поэтому если объект
+    с нужным именем уже лежит в бакете (от прерванного прогона или другой строки),
+    обработчик просто ставит его публичный URL — без синтеза и загрузки.
+
+    Бакет листается целиком при старте и раз в FULL_REFRESH_INTERVAL, а между
+    полными проходами дочитываются только новые объекты (сортировка по created_at).
+    Свои загрузки и удаления воркер отмечает сразу через add/discard.
+    """
+    def __init__(self, supabase, bucket):
+        self.supabase = supabase
+        self.bucket = bucket
+        self.ready = False
+        self.stats = {'reused': 0, 'listed': 0}
+        self._names = set()
+        self._watermark = None # created_at самого нового объекта из прочитанных
+        self._last_full = 0.0
+
+    def _list_page(self, offset, newest_first):
+        options = {'limit': LIST_PAGE_SIZE, 'offset': offset}
+        if newest_first:
+            options['sortBy'] = {'column': 'created_at', 'order': 'desc'}
+        else:
+            options['sortBy'] = {'column': 'name', 'order': 'asc'}
+        return self.supabase.storage.from_(self.bucket).list(None, options) or []
+
+    async def _fetch_page(self, offset, newest_first):
+        loop = asyncio.get_running_loop()
+        await rate_limits.acquire('storage')
+        async with limit('storage'):
+            with metrics.span('storage_list', bucket=self.bucket):
+                return await loop.run_in_executor(None, self._list_page, offset, newest_first)
+
+    @staticmethod
+    def _is_valid(item):
+        # У папок нет id и метаданных; файлы меньше MIN_FILE_SIZE — битые
+        if not item.get('name') or not item.get('id'):
+            return False
+        size = (item.get('metadata') or {}).get('size')
+        return size is None or size >= MIN_FILE_SIZE
+
+    async def refresh(self, full=False):
+        """Перечитывает бакет: целиком (full или первый вызов) или только новые объекты."""
+        full = full or not self.ready
+        started = time.time()
+        names = set() if full else None
+        watermark = self._watermark
+        newest = watermark
+        added = 0
+        offset = 0
+        while True:
+            page = await self._fetch_page(offset, newest_first=not full)
+            for item in page:
+                created = item.get('created_at')
+                if created and (newest is None or created > newest):
+                    newest = created
+                if not full and watermark and created and created < watermark:
+                    # Дальше только объекты, прочитанные прошлым проходом
+                    page = []
+                    break
+                if not self._is_valid(item):
+                    continue
+                if full:
+                    names.add(item['name'])
+                elif item['name'] not in self._names:
+                    self._names.add(item['name'])
+                    added += 1
+            if len(page) < LIST_PAGE_SIZE:
+                break
+            offset += LIST_PAGE_SIZE
+
+        self._watermark = newest
+        if full:
+            self._names = names
+            self._last_full = time.time()
+            self.ready = True
+            logging.info(f"📇 Индекс бакета '{self.bucket}': {len(names)} объектов ({time.time() - started:.1f}с)")
+        elif added:
+            logging.info(f"📇 Индекс бакета '{self.bucket}': +{added} новых объектов")
+        self.stats['listed'] += 1
+
+    async def refresh_loop(self):
+        """Фоновое обновление индекса."""
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await self.refresh(full=time.time() - self._last_full >= FULL_REFRESH_INTERVAL)
+            except Exception as e:
+                logging.warning(f"⚠️ Не удалось обновить индекс бакета '{self.bucket}': {e}")
+
+    def exists(self, name):
+        return self.ready and name in self._names
+
+    def add(self, name):
+        self._names.add(name)
+
+    def discard_url(self, url):
+        """Убирает из индекса объект по его публичному URL (после удаления файла)."""
+        if url:
+            self._names.discard(unquote(url.split('/')[-1].split('?')[0]))
+
+    def public_url(self, name):
+        """Публичный URL объекта, если он уже есть в бакете, иначе None."""
+        if not self.exists(name):
+            return None
+        self.stats['reused'] += 1
+        metrics.inc('worker_storage_reused_total', bucket=self.bucket)
+        return self.supabase.storage.from_(self.bucket).get_public_url(name)
+
+    def log_state(self):
+        if self.stats['reused']:
+            logging.info(f"📇 Индекс бакета '{self.bucket}': {len(self._names)} объектов, переиспользовано {self.stats['reused']}")
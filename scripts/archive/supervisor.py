@@ -0,0 +1,209 @@
+import sys
+import time
+import signal
+import logging
+import subprocess
+import urllib.request
+import metrics
+
+# Пауза перед перезапуском упавшего процесса: 5, 10, 20 ... сек, но не больше 2 минут
+RESTART_BASE_DELAY = 5
+RESTART_MAX_DELAY = 120
+# Процесс, проработавший дольше этого, считается стабильным — счетчик пауз сбрасывается
+STABLE_AFTER = 60
+
+class ShardProcess:
+    """Один дочерний воркер (шард) и его история перезапусков."""
+    def __init__(self, index, command, metrics_port):
+        self.index = index
+        self.command = command
+        self.metrics_port = metrics_port
+        self.proc = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.failures_in_row = 0
+        self.restart_at = None
+        self.finished = False
+
+    def start(self):
+        # POSIX: свой сеанс и группа процессов — Ctrl-C терминала получает только супервизор
+        # и передает шарду один SIGTERM (иначе шард видит два сигнала и прерывает дренаж)
+        options = {} if sys.platform == 'win32' else {'start_new_session': True}
+        self.proc = subprocess.Popen(self.command, **options)
+        self.started_at = time.time()
+        self.restart_at = None
+        logging.info(f"🧩 Шард {self.index}: запущен процесс pid={self.proc.pid}")
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+class ShardMetricsHandler(metrics.MetricsHandler):
+    """/metrics супервизора: метрики всех шардов с меткой shard, /healthz — все ли шарды живы."""
+    def render_metrics(self):
+        return self.server.supervisor.render_metrics()
+
+    def health_status(self):
+        return self.server.supervisor.health()
+
+def _add_label(sample, label):
+    """Добавляет метку в строку сэмпла Prometheus: name{a="1"} 2 -> name{label,a="1"} 2."""
+    name_end = min(i for i in (sample.find('{'), sample.find(' ')) if i != -1)
+    name, rest = sample[:name_end], sample[name_end:]
+    if rest.startswith('{'):
+        return f"{name}{{{label},{rest[1:]}"
+    return f"{name}{{{label}}}{rest}"
+
+def merge_metrics(texts):
+    """Склеивает тексты /metrics шардов в один, сохраняя группировку семейств метрик."""
+    families = {}
+    for shard, text in texts:
+        family = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith('# '):
+                parts = line.split(' ', 3)
+                family = families.setdefault(parts[2], {'meta': [], 'samples': []})
+                if line not in family['meta']:
+                    family['meta'].append(line)
+                continue
+            if family is None:
+                family = families.setdefault(line.split('{')[0].split(' ')[0], {'meta': [], 'samples': []})
+            family['samples'].append(_add_label(line, f'shard="{shard}"'))
+    out = []
+    for family in families.values():
+        out.extend(family['meta'])
+        out.extend(family['samples'])
+    return '\n'.join(out) + '\n'
+
+class WorkerSupervisor:
+    """Запускает N процессов content_worker, каждый обрабатывает свой шард словаря (id % N).
+
+    У каждого процесса свой event loop, пул соединений и курсор сканирования.
+    Упавшие процессы перезапускаются с нарастающей паузой, метрики шардов
+    собираются в общий /metrics. SIGINT/SIGTERM передаются шардам для мягкой остановки.
+    """
+    def __init__(self, script_path, base_args, processes, metrics_port=0, metrics_host='127.0.0.1', drain_timeout=60):
+        self.processes = processes
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.drain_timeout = drain_timeout
+        self.stopping = False
+        self.shards = []
+        for i in range(processes):
+            shard_port = metrics_port + 1 + i if metrics_port > 0 else 0
+            command = [
+                sys.executable, script_path, *base_args,
+                '--processes', '1',
+                '--shard-index', str(i),
+                '--shard-count', str(processes),
+                '--metrics-port', str(shard_port),
+                '--metrics-host', '127.0.0.1',
+            ]
+            self.shards.append(ShardProcess(i, command, shard_port))
+
+    def _restart_delay(self, shard):
+        return min(RESTART_MAX_DELAY, RESTART_BASE_DELAY * (2 ** max(0, shard.failures_in_row - 1)))
+
+    def _check_shard(self, shard):
+        if shard.finished or shard.alive:
+            return
+        now = time.time()
+        if shard.restart_at is None:
+            code = shard.proc.returncode
+            if code == 0:
+                shard.finished = True
+                logging.info(f"🏁 Шард {shard.index}: процесс завершился штатно.")
+                return
+            if now - shard.started_at > STABLE_AFTER:
+                shard.failures_in_row = 0
+            shard.failures_in_row += 1
+            delay = self._restart_delay(shard)
+            shard.restart_at = now + delay
+            logging.error(f"💥 Шард {shard.index}: процесс упал (код {code}). Перезапуск через {delay} сек.")
+        elif now >= shard.restart_at:
+            shard.restarts += 1
+            shard.start()
+
+    def _request_stop(self, signum, frame):
+        if self.stopping:
+            logging.warning("⛔ Повторный сигнал: немедленная остановка шардов.")
+            for shard in self.shards:
+                if shard.alive:
+                    shard.proc.kill()
+            return
+        self.stopping = True
+        logging.info(f"🛑 Супервизор: остановка, шарды дорабатывают начатое (до {self.drain_timeout:.0f} сек)...")
+        if sys.platform != 'win32':
+            # На Windows Ctrl-C получают все процессы консоли сами
+            for shard in self.shards:
+                if shard.alive:
+                    shard.proc.send_signal(signal.SIGTERM)
+
+    def _wait_children(self):
+        deadline = time.time() + self.drain_timeout + 15
+        for shard in self.shards:
+            if not shard.alive:
+                continue
+            try:
+                shard.proc.wait(timeout=max(0.1, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                logging.warning(f"⛔ Шард {shard.index} не остановился вовремя, завершаю принудительно.")
+                shard.proc.kill()
+                shard.proc.wait()
+
+    def render_metrics(self):
+        texts = []
+        for shard in self.shards:
+            if not shard.metrics_port or not shard.alive:
+                continue
+            try:
+                url = f"http://127.0.0.1:{shard.metrics_port}/metrics"
+                with urllib.request.urlopen(url, timeout=2) as resp:
+                    texts.append((shard.index, resp.read().decode('utf-8')))
+            except Exception as e:
+                logging.debug(f"Шард {shard.index}: метрики недоступны ({e})")
+        own = [
+            "# HELP worker_shard_up Процесс шарда запущен",
+            "# TYPE worker_shard_up gauge",
+            *[f'worker_shard_up{{shard="{s.index}"}} {1 if s.alive else 0}' for s in self.shards],
+            "# HELP worker_shard_restarts_total Перезапуски процесса шарда",
+            "# TYPE worker_shard_restarts_total counter",
+            *[f'worker_shard_restarts_total{{shard="{s.index}"}} {s.restarts}' for s in self.shards],
+        ]
+        return '\n'.join(own) + '\n' + merge_metrics(texts)
+
+    def health(self):
+        down = [str(s.index) for s in self.shards if not s.alive and not s.finished]
+        if down:
+            return False, f"шарды не работают: {', '.join(down)}"
+        return True, "ok"
+
+    def run(self):
+        logging.info(f"🧩 Супервизор: запуск {self.processes} процессов (шардирование по id % {self.processes}).")
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        server = None
+        if self.metrics_port > 0:
+            try:
+                server = metrics.start_server(self.metrics_port, self.metrics_host, handler=ShardMetricsHandler)
+                server.supervisor = self
+            except OSError as e:
+                logging.warning(f"⚠️ Не удалось запустить сервер метрик супервизора: {e}")
+
+        for shard in self.shards:
+            shard.start()
+        try:
+            while not self.stopping:
+                for shard in self.shards:
+                    self._check_shard(shard)
+                if all(s.finished for s in self.shards):
+                    break
+                time.sleep(1)
+        finally:
+            self.stopping = True
+            self._wait_children()
+            if server:
+                server.shutdown()
+            logging.info("🛑 Супервизор остановлен.")
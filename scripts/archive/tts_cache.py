@@ -0,0 +1,182 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+from collections import OrderedDict
+import metrics
+
+# Размер кэша по умолчанию (байт); при превышении удаляются давно не использованные файлы
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# После очистки кэш занимает не больше этой доли лимита (чтобы не чистить на каждой записи)
+EVICT_TO = 0.9
+# Временные файлы старше этого (сек) считаются брошенными прерванным процессом
+STALE_TMP_AGE = 3600
+
+class TTSCache:
+    """Дисковый кэш синтезированного аудио с адресацией по содержимому.
+
+    Ключ — sha256 от (текст, голос, формат), поэтому одинаковые фразы разных слов,
+    повторная озвучка цитат и прогоны с --force-audio берут готовый файл вместо edge-tts.
+    Запись атомарная (временный файл + os.replace), размер ограничен с вытеснением LRU
+    (по времени последнего обращения).
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+        self._entries = OrderedDict() # путь -> размер, от давно не использованных к свежим
+        self._total = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def key(text, voice, fmt):
+        return hashlib.sha256(f"{fmt}\0{voice}\0{text}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def _load_index(self):
+        found = []
+        stale_before = time.time() - STALE_TMP_AGE
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith('.tmp'):
+                    # Недописанный файл от прерванного процесса; свежие может дописывать другой процесс
+                    if st.st_mtime < stale_before:
+                        self.discard(path)
+                    continue
+                found.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._total += size
+        if found:
+            logging.info(f"🗄 Кэш TTS: {len(found)} файлов, {self._total / 1048576:.1f} МБ ({self.directory})")
+
+    def _miss(self):
+        self.stats['misses'] += 1
+        metrics.inc('worker_tts_cache_total', result='miss')
+
+    def lookup(self, text, voice, fmt):
+        """Путь к готовому файлу (и отметка об использовании) или None."""
+        path = self._path(self.key(text, voice, fmt))
+        try:
+            os.utime(path)
+        except OSError:
+            self._miss()
+            return None
+        if path in self._entries:
+            self._entries.move_to_end(path)
+        else:
+            # Файл есть на диске, но выпал из учета — возвращаем его под лимит размера
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            self._entries[path] = size
+            self._total += size
+        self.stats['hits'] += 1
+        metrics.inc('worker_tts_cache_total', result='hit')
+        return path
+
+    def get(self, text, voice, fmt):
+        path = self.lookup(text, voice, fmt)
+        if not path:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def reserve(self, text, voice, fmt):
+        """Временный файл для записи аудио кусками; затем commit() или discard()."""
+        path = self._path(self.key(text, voice, fmt))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+
+    @staticmethod
+    def discard(tmp):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+    def commit(self, text, voice, fmt, tmp):
+        """Атомарно переносит дописанный временный файл в кэш; возвращает путь или None.
+
+        При ошибке временный файл остается на месте: вызывающий может взять аудио
+        из него и затем удалить через discard().
+        """
+        path = self._path(self.key(text, voice, fmt))
+        try:
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"⚠️ Не удалось записать в кэш TTS: {e}")
+            return None
+        self._total += size - self._entries.pop(path, 0)
+        self._entries[path] = size
+        self.stats['writes'] += 1
+        if self._total > self.max_bytes:
+            self._evict()
+        return path
+
+    def put(self, text, voice, fmt, data):
+        if not data or self.max_bytes <= 0:
+            return
+        tmp = None
+        try:
+            tmp = self.reserve(text, voice, fmt)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            logging.warning(f"⚠️ Не удалось записать в кэш TTS: {e}")
+            if tmp:
+                self.discard(tmp)
+            return
+        if not self.commit(text, voice, fmt, tmp):
+            self.discard(tmp)
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TO
+        busy = []
+        while self._entries and self._total > target:
+            path, size = self._entries.popitem(last=False)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Windows: файл открыт (идет загрузка) — оставляем в учете, удалим при следующей очистке
+                busy.append((path, size))
+                continue
+            self._total -= size
+            self.stats['evictions'] += 1
+            metrics.inc('worker_tts_cache_total', result='evicted')
+        for path, size in reversed(busy):
+            self._entries[path] = size
+            self._entries.move_to_end(path, last=False)
+
+    def snapshot(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return dict(
+            self.stats,
+            files=len(self._entries),
+            bytes=self._total,
+            hit_ratio=round(self.stats['hits'] / lookups, 3) if lookups else 0.0,
+        )
+
+    def log_state(self):
+        s = self.snapshot()
+        if s['hits'] or s['misses']:
+            logging.info(
+                f"🗄 Кэш TTS: попаданий {s['hits']}, промахов {s['misses']} ({s['hit_ratio'] * 100:.0f}%), "
+                f"файлов {s['files']}, {s['bytes'] / 1048576:.1f} МБ, вытеснено {s['evictions']}"
+            )
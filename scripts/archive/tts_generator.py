@@ -1,52 +1,112 @@
+import asyncio
 import logging
 import edge_tts
-from io import BytesIO
-
-# Минимальный размер файла для проверки валидности (в байтах)
-MIN_FILE_SIZE = 500
+from limiters import limit
+import rate_limits
+import metrics
+import single_flight
+from constants import MIN_FILE_SIZE
+# Формат, который edge-tts отдает по умолчанию (входит в ключ кэша)
+OUTPUT_FORMAT = "audio-24khz-48kbitrate-mono-mp3"
+# Сколько реплик одного диалога синтезировать одновременно (общий предел задает лимитер 'tts')
+DIALOGUE_LINE_CONCURRENCY = 4
 
 class TTSGenerator:
     def __init__(self):
         # Голоса
         self.voice_female = "ko-KR-SunHiNeural"
         self.voice_male = "ko-KR-InJoonNeural"
+        self.cache = None
+        # Одинаковые фразы из параллельно обрабатываемых строк синтезируются один раз
+        self.flights = single_flight.group('tts')
+
+    def set_cache(self, cache):
+        """Подключает дисковый кэш аудио (TTSCache); None — синтез без кэша."""
+        self.cache = cache
 
     async def generate_audio(self, text, voice):
         """Генерирует аудио для заданного текста и голоса."""
         if not text:
             return None
+        return await self.flights.do((text, voice), lambda: self._synthesize(text, voice))
+
+    async def _stream(self, text, voice, write):
+        """Синтез edge-tts: куски аудио сразу отдаются в write(); возвращает размер в байтах."""
+        size = 0
+        await rate_limits.acquire('tts')
+        async with limit('tts'):
+            with metrics.span('tts', voice=voice, chars=len(text)) as sp:
+                communicate = edge_tts.Communicate(text, voice)
+                async for chunk in communicate.stream():
+                    if chunk["type"] == "audio":
+                        write(chunk["data"])
+                        size += len(chunk["data"])
+                sp.bytes = size
+        if size < MIN_FILE_SIZE:
+            logging.warning(f"⚠️ Сгенерированное аудио слишком короткое ({size} байт): {text[:20]}...")
+        return size
+
+    async def _synthesize(self, text, voice):
+        if self.cache:
+            cached = self.cache.get(text, voice, OUTPUT_FORMAT)
+            if cached:
+                return cached
         
         try:
-            communicate = edge_tts.Communicate(text, voice)
-            audio_data = BytesIO()
-            
-            async for chunk in communicate.stream():
-                if chunk["type"] == "audio":
-                    audio_data.write(chunk["data"])
-            
-            data = audio_data.getvalue()
-            if len(data) < MIN_FILE_SIZE:
-                logging.warning(f"⚠️ Сгенерированное аудио слишком короткое ({len(data)} байт): {text[:20]}...")
+            chunks = []
+            if await self._stream(text, voice, chunks.append) < MIN_FILE_SIZE:
                 return None
-                
+            data = b"".join(chunks)
+
+            if self.cache:
+                self.cache.put(text, voice, OUTPUT_FORMAT, data)
             return data
         except Exception as e:
             logging.error(f"❌ Ошибка TTS ({voice}): {e}")
             return None
 
-    async def generate_dialogue(self, text):
-        """
-        Генерирует аудио для диалога, склеивая реплики разных голосов.
-        Поддерживает форматы: "A: ... B: ..." или "가: ... 나: ..."
+    async def generate_audio_file(self, text, voice):
+        """Синтезирует аудио прямо в файл кэша и возвращает путь к нему (или None).
+
+        Куски edge-tts пишутся на диск по мере поступления, а загрузка в Storage
+        читает файл потоком — целиком в памяти аудио не держится. Нужен кэш (set_cache).
+        Если готовый файл не удалось перенести в кэш, возвращается аудио в памяти (bytes).
         """
-        if not text:
+        if not text or not self.cache:
             return None
+        return await self.flights.do(('file', text, voice), lambda: self._synthesize_file(text, voice))
 
-        lines = text.split('\n')
-        combined_audio = BytesIO()
-        has_content = False
-        
-        for line in lines:
+    async def _synthesize_file(self, text, voice):
+        path = self.cache.lookup(text, voice, OUTPUT_FORMAT)
+        if path:
+            return path
+
+        tmp = None
+        try:
+            tmp = self.cache.reserve(text, voice, OUTPUT_FORMAT)
+            with open(tmp, 'wb') as f:
+                size = await self._stream(text, voice, f.write)
+            if size < MIN_FILE_SIZE:
+                self.cache.discard(tmp)
+                return None
+            path = self.cache.commit(text, voice, OUTPUT_FORMAT, tmp)
+            if path:
+                return path
+            # Синтез удался, не сработал только кэш — отдаем аудио из временного файла
+            with open(tmp, 'rb') as f:
+                data = f.read()
+            self.cache.discard(tmp)
+            return data
+        except Exception as e:
+            logging.error(f"❌ Ошибка TTS ({voice}): {e}")
+            if tmp:
+                self.cache.discard(tmp)
+            return None
+
+    def _dialogue_lines(self, text):
+        """Разбирает диалог на реплики: список (текст, голос) в исходном порядке."""
+        result = []
+        for line in text.split('\n'):
             line = line.strip()
             if not line: continue
             
@@ -64,19 +124,31 @@ class TTSGenerator:
                 parts = line.split(":", 1)
                 if len(parts) > 1: clean_text = parts[1].strip()
             
-            if not clean_text: continue
-            
-            # Генерация части
-            chunk = await self.generate_audio(clean_text, voice)
-            if chunk:
-                combined_audio.write(chunk)
-                has_content = True
-        
-        if not has_content:
+            if clean_text:
+                result.append((clean_text, voice))
+        return result
+
+    async def generate_dialogue(self, text):
+        """
+        Генерирует аудио для диалога, склеивая реплики разных голосов.
+        Поддерживает форматы: "A: ... B: ..." или "가: ... 나: ..."
+        Реплики синтезируются параллельно (не больше DIALOGUE_LINE_CONCURRENCY сразу)
+        и склеиваются по порядку; каждая реплика кэшируется отдельно, поэтому после
+        правки одной строки заново озвучивается только она.
+        """
+        if not text:
             return None
-            
-        data = combined_audio.getvalue()
+
+        sem = asyncio.Semaphore(DIALOGUE_LINE_CONCURRENCY)
+
+        async def synth_line(clean_text, voice):
+            async with sem:
+                return await self.generate_audio(clean_text, voice)
+
+        chunks = await asyncio.gather(*[synth_line(t, v) for t, v in self._dialogue_lines(text)])
+        # Реплики, которые не удалось озвучить, пропускаются (как и раньше)
+        data = b"".join(chunk for chunk in chunks if chunk)
         if len(data) < MIN_FILE_SIZE:
              return None
              
-        return data
\ No newline at end of file
+        return data
@@ -1,7 +1,6 @@
 import re
 import hashlib
 import logging
-from io import BytesIO
 from app_utils import delete_old_file, upload_to_supabase # type: ignore
 from constants import DB_BUCKETS
 
@@ -10,21 +9,71 @@ class TTSHandler:
     def __init__(self, supabase_client, tts_generator):
         self.supabase = supabase_client
         self.tts_gen = tts_generator
+        self.storage_index = None
+
+    def set_storage_index(self, index):
+        """Подключает индекс бакета аудио (StorageIndex): готовые файлы не синтезируются заново."""
+        self.storage_index = index
+
+    def _existing_url(self, filename, force_audio):
+        """URL файла, который уже лежит в бакете (кроме принудительной перегенерации)."""
+        if force_audio or not self.storage_index:
+            return None
+        url = self.storage_index.public_url(filename)
+        if url:
+            logging.info(f"♻️ Уже в Storage: {filename}")
+        return url
+
+    async def _replace_file(self, old_url, filename, audio_data):
+        """Удаляет старый файл строки и загружает новый; возвращает публичный URL.
+        audio_data — bytes или открытый файл (загружается потоком)."""
+        if old_url:
+            await delete_old_file(self.supabase, DB_BUCKETS['AUDIO'], old_url)
+            if self.storage_index:
+                self.storage_index.discard_url(old_url)
+        await upload_to_supabase(self.supabase, DB_BUCKETS['AUDIO'], filename, audio_data, "audio/mpeg")
+        if self.storage_index:
+            self.storage_index.add(filename)
+        return self.supabase.storage.from_(DB_BUCKETS['AUDIO']).get_public_url(filename)
+
+    async def _synthesize_and_upload(self, old_url, filename, text, voice):
+        """Озвучивает текст и загружает файл; возвращает публичный URL или None.
+
+        С кэшем TTS аудио пишется на диск кусками и загружается из файла потоком;
+        без кэша (или если файл успели вытеснить) — через память, как раньше.
+        """
+        if self.tts_gen.cache:
+            path = await self.tts_gen.generate_audio_file(text, voice)
+            if not path:
+                return None
+            if isinstance(path, bytes):
+                # Файл не попал в кэш (ошибка диска) — загружаем из памяти
+                return await self._replace_file(old_url, filename, path)
+            try:
+                # Открываем сразу: открытый файл переживет вытеснение из кэша
+                audio_file = open(path, 'rb')
+            except OSError:
+                audio_file = None
+            if audio_file:
+                with audio_file:
+                    return await self._replace_file(old_url, filename, audio_file)
+
+        audio_data = await self.tts_gen.generate_audio(text, voice)
+        if not audio_data:
+            return None
+        return await self._replace_file(old_url, filename, audio_data)
 
     async def handle_main_audio(self, row, word, word_hash, force_audio=False):
         """Обработка основного аудио (Женский голос - SunHi)"""
         if row.get('audio_url') and not force_audio: return {}
         
         audio_filename = f"{word_hash}.mp3"
+        existing = self._existing_url(audio_filename, force_audio)
+        if existing: return {'audio_url': existing}
         
-        audio_data = await self.tts_gen.generate_audio(word, "ko-KR-SunHiNeural")
+        url = await self._synthesize_and_upload(row.get('audio_url'), audio_filename, word, "ko-KR-SunHiNeural")
         
-        if audio_data:
-            if row.get('audio_url'):
-                await delete_old_file(self.supabase, DB_BUCKETS['AUDIO'], row.get('audio_url'))
-            
-            await upload_to_supabase(self.supabase, DB_BUCKETS['AUDIO'], audio_filename, BytesIO(audio_data), "audio/mpeg")
-            url = self.supabase.storage.from_(DB_BUCKETS['AUDIO']).get_public_url(audio_filename)
+        if url:
             logging.info(f"✅ Audio Female: {word}")
             return {'audio_url': url}
 
@@ -35,15 +84,12 @@ class TTSHandler:
         if row.get('audio_male') and not force_audio: return {}
         
         male_filename = f"{word_hash}_M.mp3"
+        existing = self._existing_url(male_filename, force_audio)
+        if existing: return {'audio_male': existing}
         
-        audio_data = await self.tts_gen.generate_audio(word, "ko-KR-InJoonNeural")
+        url = await self._synthesize_and_upload(row.get('audio_male'), male_filename, word, "ko-KR-InJoonNeural")
         
-        if audio_data:
-            if row.get('audio_male'):
-                await delete_old_file(self.supabase, DB_BUCKETS['AUDIO'], row.get('audio_male'))
-            
-            await upload_to_supabase(self.supabase, DB_BUCKETS['AUDIO'], male_filename, BytesIO(audio_data), "audio/mpeg")
-            url = self.supabase.storage.from_(DB_BUCKETS['AUDIO']).get_public_url(male_filename)
+        if url:
             logging.info(f"✅ Audio Male: {word}")
             return {'audio_male': url}
 
@@ -56,19 +102,20 @@ class TTSHandler:
         
         ex_hash = hashlib.md5(example.encode('utf-8')).hexdigest()
         ex_filename = f"ex_{ex_hash}.mp3"
-        audio_data = None
+        existing = self._existing_url(ex_filename, force_audio)
+        if existing: return {'example_audio': existing}
+        url = None
         
         is_dialogue = re.search(r'(^|\n)[AaBb가나]\s*:', example)
         if is_dialogue:
+            # Диалог склеивается из реплик в памяти (реплики короткие и кэшируются по отдельности)
             audio_data = await self.tts_gen.generate_dialogue(example)
+            if audio_data:
+                url = await self._replace_file(row.get('example_audio'), ex_filename, audio_data)
         else:
-            audio_data = await self.tts_gen.generate_audio(example, "ko-KR-SunHiNeural")
+            url = await self._synthesize_and_upload(row.get('example_audio'), ex_filename, example, "ko-KR-SunHiNeural")
         
-        if audio_data:
-            if row.get('example_audio'):
-                await delete_old_file(self.supabase, DB_BUCKETS['AUDIO'], row.get('example_audio'))
-            await upload_to_supabase(self.supabase, DB_BUCKETS['AUDIO'], ex_filename, BytesIO(audio_data), "audio/mpeg")
-            url = self.supabase.storage.from_(DB_BUCKETS['AUDIO']).get_public_url(ex_filename)
+        if url:
             logging.info(f"✅ Example: {example[:10]}...")
             return {'example_audio': url}
 
@@ -83,14 +130,12 @@ class TTSHandler:
         
         quote_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
         filename = f"quote_{quote_hash}.mp3"
+        existing = self._existing_url(filename, force_audio)
+        if existing: return {'audio_url': existing}
         
-        audio_data = await self.tts_gen.generate_audio(text, "ko-KR-SunHiNeural")
+        url = await self._synthesize_and_upload(row.get('audio_url'), filename, text, "ko-KR-SunHiNeural")
         
-        if audio_data:
-            if row.get('audio_url'):
-                await delete_old_file(self.supabase, DB_BUCKETS['AUDIO'], row.get('audio_url'))
-            await upload_to_supabase(self.supabase, DB_BUCKETS['AUDIO'], filename, BytesIO(audio_data), "audio/mpeg")
-            url = self.supabase.storage.from_(DB_BUCKETS['AUDIO']).get_public_url(filename)
+        if url:
             logging.info(f"✅ Quote Audio: {text[:15]}...")
             return {'audio_url': url}
 
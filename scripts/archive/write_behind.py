@@ -0,0 +1,158 @@
+import time
+import asyncio
+import inspect
+import logging
+from app_utils import execute_supabase_query, _is_network_error # type: ignore
+from constants import DB_TABLES
+import metrics
+
+# Колонки, которые воркер записывает после генерации медиа
+MEDIA_COLUMNS = {'audio_url', 'audio_male', 'example_audio', 'image', 'image_source'}
+
+class WriteBehindBuffer:
+    """Отложенная пакетная запись обновлений медиа в vocabulary.
+
+    Обновления копятся в словаре {id: updates} и сбрасываются одним вызовом
+    RPC bulk_update_vocabulary_media каждые `max_rows` строк или `max_delay` секунд.
+    Если RPC нет или пакет упал не из-за сети, строки пишутся по одной,
+    чтобы ошибка одной строки не теряла остальные.
+    on_written(row_id), переданный в add(), вызывается, когда пакет со строкой
+    записан (или строка ушла в on_failure); строки, вернувшиеся в буфер после
+    сетевой ошибки, ждут следующего сброса. on_flushed(row_ids) получает после
+    каждого сброса id строк, которые действительно записаны.
+    """
+    def __init__(self, db_client, max_rows=50, max_delay=0.5, on_failure=None, on_flushed=None):
+        self.db = db_client
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.on_failure = on_failure # callback(row_id, error), может быть корутиной
+        self.on_flushed = on_flushed # callback(row_ids), может быть корутиной
+        self.pending = {}
+        self._callbacks = {} # row_id -> [on_written, ...]
+        self.use_rpc = True
+        self._lock = asyncio.Lock()
+        self._last_flush = time.time()
+        self.stats = {'rows': 0, 'batches': 0, 'round_trips': 0, 'fallback_rows': 0, 'failed_rows': 0}
+
+    def set_db_client(self, db_client):
+        """Переключает запросы на другой клиент (например, async)."""
+        self.db = db_client
+
+    async def add(self, row_id, updates, on_written=None):
+        """Ставит обновление строки в буфер; при заполнении буфера сразу сбрасывает его."""
+        if row_id is None or not updates:
+            return
+        self.pending.setdefault(row_id, {}).update(updates)
+        if on_written:
+            self._callbacks.setdefault(row_id, []).append(on_written)
+        if len(self.pending) >= self.max_rows:
+            await self.flush()
+
+    async def flush(self):
+        """Записывает всё накопленное."""
+        async with self._lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            callbacks = {rid: self._callbacks.pop(rid) for rid in batch if rid in self._callbacks}
+            self._last_flush = time.time()
+            requeued, failed = await self._write_batch(batch)
+            for rid, fns in callbacks.items():
+                if rid in requeued:
+                    self._callbacks.setdefault(rid, []).extend(fns)
+                    continue
+                for fn in fns:
+                    try:
+                        fn(rid)
+                    except Exception as e:
+                        logging.warning(f"⚠️ Ошибка обработчика записи строки id={rid}: {e}")
+            written = [rid for rid in batch if rid not in requeued and rid not in failed]
+            if self.on_flushed and written:
+                try:
+                    res = self.on_flushed(written)
+                    if inspect.isawaitable(res):
+                        await res
+                except Exception as e:
+                    logging.warning(f"⚠️ Ошибка обработчика сброса буфера: {e}")
+
+    async def _write_batch(self, batch):
+        """Пишет пакет; возвращает id строк, вернувшихся в буфер, и id строк, записать которые не удалось."""
+        requeued = set()
+        self.stats['batches'] += 1
+        rpc_rows = {rid: upd for rid, upd in batch.items() if set(upd) <= MEDIA_COLUMNS}
+        single_rows = {rid: upd for rid, upd in batch.items() if rid not in rpc_rows}
+
+        if rpc_rows and self.use_rpc:
+            payload = [{'id': rid, **upd} for rid, upd in rpc_rows.items()]
+            try:
+                self.stats['round_trips'] += 1
+                with metrics.span('db_write', rows=len(payload)):
+                    await execute_supabase_query(self.db.rpc('bulk_update_vocabulary_media', {'p_rows': payload}))
+                self.stats['rows'] += len(rpc_rows)
+                rpc_rows = {}
+            except Exception as e:
+                err_str = str(e)
+                if 'bulk_update_vocabulary_media' in err_str or 'PGRST202' in err_str:
+                    logging.warning("⚠️ RPC bulk_update_vocabulary_media не найдена (запустите migrate_schema.py). Запись по одной строке.")
+                    self.use_rpc = False
+                elif _is_network_error(e):
+                    # Сеть недоступна даже после ретраев — вернем строки в буфер до следующего сброса
+                    logging.warning(f"🌐 Пакетная запись не удалась ({e!r}). {len(rpc_rows)} строк вернулись в буфер.")
+                    for rid, upd in rpc_rows.items():
+                        # Обновления, пришедшие во время неудачной записи, новее — они поверх старых
+                        self.pending[rid] = {**upd, **self.pending.get(rid, {})}
+                    requeued.update(rpc_rows)
+                    rpc_rows = {}
+                else:
+                    logging.warning(f"⚠️ Ошибка пакетной записи ({e}). Повтор по одной строке...")
+
+        single_rows.update(rpc_rows)
+        failed = set()
+        if single_rows:
+            results = await asyncio.gather(*[self._write_row(rid, upd) for rid, upd in single_rows.items()])
+            failed = {rid for rid, ok in zip(single_rows, results) if not ok}
+        return requeued, failed
+
+    async def _write_row(self, row_id, updates):
+        self.stats['round_trips'] += 1
+        self.stats['fallback_rows'] += 1
+        try:
+            builder = self.db.table(DB_TABLES['VOCABULARY']).update(updates).eq("id", row_id)
+            with metrics.span('db_write', rows=1):
+                await execute_supabase_query(builder)
+            self.stats['rows'] += 1
+            return True
+        except Exception as e:
+            self.stats['failed_rows'] += 1
+            logging.error(f"❌ Не удалось сохранить медиа для id={row_id}: {e}")
+            if self.on_failure:
+                res = self.on_failure(row_id, e)
+                if inspect.isawaitable(res):
+                    await res
+            return False
+
+    async def run(self):
+        """Фоновый сброс буфера по таймеру."""
+        while True:
+            await asyncio.sleep(self.max_delay)
+            if self.pending and time.time() - self._last_flush >= self.max_delay:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logging.error(f"❌ Ошибка фонового сброса буфера записи: {e}")
+
+    async def close(self):
+        """Финальный сброс при остановке: пишем всё, включая строки, вернувшиеся после сетевой ошибки."""
+        for _ in range(3):
+            await self.flush()
+            if not self.pending:
+                break
+        if self.pending:
+            logging.error(f"❌ При остановке не записано {len(self.pending)} обновлений медиа.")
+
+    def log_stats(self):
+        s = self.stats
+        logging.info(
+            f"💾 Запись медиа: строк {s['rows']}, пакетов {s['batches']}, запросов к БД {s['round_trips']}, "
+            f"по одной {s['fallback_rows']}, ошибок {s['failed_rows']}"
+        )
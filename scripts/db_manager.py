@@ -35,7 +35,13 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     sys.exit(1)
 
 try:
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    if SUPABASE_URL.startswith("local://"):
+        # Локальная замена Supabase для нагрузочных тестов (scripts/archive/local_supabase.py)
+        sys.path.insert(0, os.path.join(script_dir, "archive"))
+        from local_supabase import create_local_client
+        supabase = create_local_client(SUPABASE_URL)
+    else:
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 except Exception as e:
     logging.error(f"❌ Ошибка инициализации Supabase: {e}")
     sys.exit(1)
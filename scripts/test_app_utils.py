@@ -0,0 +1,70 @@
+import os
+import sys
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import app_utils
+from local_supabase import LocalStore, LocalClient, AsyncLocalClient
+
+class FlakyAsyncQuery:
+    """Async-построитель запроса, который падает заданными ошибками, затем отвечает."""
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.threads = set()
+
+    async def execute(self):
+        self.calls += 1
+        self.threads.add(threading.get_ident())
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+class TestExecuteSupabaseQuery(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.store = LocalStore()
+        self.store.insert_rows('vocabulary', [{'id': 1, 'word_kr': "단어"}])
+
+    async def test_async_builder_is_awaited_on_the_loop(self):
+        query = FlakyAsyncQuery([])
+        loop = asyncio.get_running_loop()
+        with patch.object(loop, 'run_in_executor', side_effect=AssertionError("thread pool used")):
+            self.assertEqual(await app_utils.execute_supabase_query(query), "ok")
+        self.assertEqual(query.threads, {threading.get_ident()})
+
+    async def test_async_client_query(self):
+        db = AsyncLocalClient(self.store)
+        res = await app_utils.execute_supabase_query(db.table('vocabulary').select('word_kr').eq('id', 1))
+        self.assertEqual(res.data, [{'word_kr': "단어"}])
+
+    async def test_sync_builder_runs_in_thread_pool(self):
+        db = LocalClient(self.store)
+        loop = asyncio.get_running_loop()
+        with patch.object(loop, 'run_in_executor', wraps=loop.run_in_executor) as executor:
+            res = await app_utils.execute_supabase_query(db.table('vocabulary').select('id'))
+        self.assertEqual(res.data, [{'id': 1}])
+        executor.assert_called_once()
+
+    async def test_network_errors_are_retried(self):
+        query = FlakyAsyncQuery([ConnectionError("connection reset"), ConnectionError("connection reset")])
+        self.assertEqual(await app_utils._execute_async_with_retry(query, base_delay=0.001), "ok")
+        self.assertEqual(query.calls, 3)
+
+    async def test_other_errors_are_raised_at_once(self):
+        query = FlakyAsyncQuery([ValueError("violates check constraint")])
+        with self.assertRaises(ValueError):
+            await app_utils._execute_async_with_retry(query, base_delay=0.001)
+        self.assertEqual(query.calls, 1)
+
+    async def test_retries_are_bounded(self):
+        query = FlakyAsyncQuery([ConnectionError("connection reset")] * 5)
+        with self.assertRaises(ConnectionError):
+            await app_utils._execute_async_with_retry(query, max_retries=3, base_delay=0.001)
+        self.assertEqual(query.calls, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,11 @@
 import sys
 import os
+import asyncio
 import unittest
-from unittest.mock import MagicMock, patch, AsyncMock, ANY, call
+from unittest.mock import MagicMock, patch, AsyncMock, ANY
+
+# Воркер и его модули лежат в archive/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
 
 # 1. Mock environment variables required by content_worker to avoid import errors
 os.environ["SUPABASE_URL"] = "https://mock.supabase.co"
@@ -11,7 +15,8 @@ os.environ["SUPABASE_SERVICE_KEY"] = "mock-key"
 # We mock argparse to prevent it from trying to parse sys.argv of the test runner
 # We mock create_client to prevent real network connections on import
 with patch("argparse.ArgumentParser.parse_args") as mock_parse_args, \
-     patch("supabase.create_client"):
+     patch("supabase.create_client"), \
+     patch("app_utils.setup_logging"):
     
     # Setup default mock args structure
     mock_args = MagicMock()
@@ -21,12 +26,21 @@ with patch("argparse.ArgumentParser.parse_args") as mock_parse_args, \
     mock_args.check = False
     mock_args.force_quotes = False
     mock_args.concurrency = 0
+    mock_args.retry_errors = False
+    mock_args.request_concurrency = 5
+    mock_args.processes = 1
+    mock_args.shard_index = 0
+    mock_args.shard_count = 1
+    mock_args.tts_cache_mb = 0
     mock_parse_args.return_value = mock_args
 
     # Import the module under test
     # This must happen inside the patch context
     import content_worker
 
+from local_supabase import LocalStore, AsyncLocalClient
+from request_leases import RequestLeaseManager
+
 class TestContentWorker(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
         # Reset global args before each test to ensure isolation
@@ -69,10 +83,10 @@ class TestContentWorker(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(updates, expected_updates)
             
             # Verify handlers were called with correct arguments
-            m_main.assert_called_with(session, row, '테스트', ANY, force_audio=False)
-            m_male.assert_called_with(row, '테스트', ANY, force_audio=False)
-            m_ex.assert_called_with(row, '이것은 테스트입니다.', force_audio=False)
-            m_img.assert_called_with(session, row, 'test', ANY, force_images=False)
+            m_main.assert_called_with(row, '테스트', ANY, False)
+            m_male.assert_called_with(row, '테스트', ANY, False)
+            m_ex.assert_called_with(row, '이것은 테스트입니다.', False)
+            m_img.assert_called_with(session, row, 'test', ANY, False)
 
     async def test_generate_content_partial(self):
         """Test scenario where some handlers return empty dicts (no updates needed)"""
@@ -113,133 +127,229 @@ class TestContentWorker(unittest.IsolatedAsyncioTestCase):
             await content_worker._generate_content_for_word(session, row)
 
             # Check if handlers were called with force=True
-            m_main.assert_called_with(ANY, ANY, ANY, ANY, force_audio=True)
-            m_male.assert_called_with(ANY, ANY, ANY, force_audio=True)
-            m_ex.assert_called_with(ANY, ANY, force_audio=True)
-            m_img.assert_called_with(ANY, ANY, ANY, ANY, force_images=True)
-
-    def test_check_integrity(self):
-        """Test integrity check logic: fixing DB links and removing orphan files"""
-        # 1. Setup mock for storage list (files in bucket)
-        # We expect a list of file objects. The script handles objects or dicts.
-        file1 = MagicMock(); file1.name = 'valid.mp3'; file1.metadata = {'size': 1000}
-        file2 = MagicMock(); file2.name = 'orphan.mp3'; file2.metadata = {'size': 1000}
-        file3 = MagicMock(); file3.name = 'small.mp3'; file3.metadata = {'size': 10} # Too small
-        
-        mock_storage_client = MagicMock()
-        # list() returns files first call, then empty list to stop pagination
-        mock_storage_client.list.side_effect = [[file1, file2, file3], []]
-        
-        # Patch the global supabase client in content_worker for this test
-        with patch('content_worker.supabase') as mock_supabase:
-            mock_supabase: MagicMock
-            # Attach storage mock to global supabase client
-            mock_supabase.storage.from_.return_value = mock_storage_client
-            
-            # 2. Setup mock for DB records
-            # Record 1 links to valid.mp3 (should be kept)
-            # Record 2 links to small.mp3 (should be reset because file is too small)
-            # Record 3 links to missing.mp3 (should be reset because file is missing)
-            rows = [
-                {'id': 1, 'audio_url': 'http://bucket/valid.mp3'},
-                {'id': 2, 'audio_url': 'http://bucket/small.mp3'},
-                {'id': 3, 'audio_url': 'http://bucket/missing.mp3'}
-            ]
-            
-            # Настройка цепочки моков для: supabase.table().select().range().execute()
-            mock_select_builder = MagicMock()
-            mock_range_builder = MagicMock()
-            
-            # Настраиваем возврат данных: первый вызов возвращает rows, второй - пустой список (конец пагинации)
-            mock_res_1 = MagicMock(); mock_res_1.data = rows
-            mock_res_2 = MagicMock(); mock_res_2.data = []
-            mock_range_builder.execute.side_effect = [mock_res_1, mock_res_2]
-
-            mock_supabase.table.return_value.select.return_value = mock_select_builder
-            mock_select_builder.range.return_value = mock_range_builder 
-
-            # 3. Run check for 'audio-files' bucket
-            content_worker.check_integrity('audio-files')
-
-            # 4. Verify DB updates (fixing broken links)
-            # We expect updates for id=2 and id=3
-            self.assertEqual(mock_supabase.table.return_value.update.call_count, 2)
-
-            # Проверяем, что update().eq() вызывается с правильными аргументами.
-            # Поскольку порядок итерации по словарю не гарантирован,
-            # используем assert_has_calls для проверки вызовов без учета порядка.
-            update_mock = mock_supabase.table.return_value.update
-            eq_mock = update_mock.return_value.eq
-
-            # Проверяем, что для id=2 и id=3 были вызваны update с None
-            update_mock.assert_has_calls([
-                call({'audio_url': None}),
-                call({'audio_url': None})
-            ])
-            # Проверяем, что для id=2 и id=3 были вызваны eq
-            eq_mock.assert_has_calls([call('id', 2), call('id', 3)], any_order=True)
-            
-            # 5. Verify storage removals (orphans)
-            # 'orphan.mp3' is not in DB. 'small.mp3' is in DB but invalid size, so it's treated as orphan too.
-            # 'valid.mp3' should NOT be removed.
-            mock_storage_client.remove.assert_called_once()
-            removed_files = mock_storage_client.remove.call_args[0][0]
-            self.assertEqual(set(removed_files), {'orphan.mp3', 'small.mp3'})
+            m_main.assert_called_with(ANY, ANY, ANY, True)
+            m_male.assert_called_with(ANY, ANY, ANY, True)
+            m_ex.assert_called_with(ANY, ANY, True)
+            m_img.assert_called_with(ANY, ANY, ANY, ANY, True)
+
+    async def test_process_word_reports_failure(self):
+        """process_word returns None and passes the error class to on_error when generation fails"""
+        row = {'id': 7, 'word_kr': 'test'}
+        on_error = AsyncMock()
+        error_counter = {'network': 0, 'other': 0}
+
+        with patch('content_worker._generate_content_for_word', new_callable=AsyncMock, side_effect=ValueError('boom')):
+            result = await content_worker.process_word(MagicMock(), row, error_counter, on_error=on_error)
+
+        self.assertIsNone(result)
+        self.assertEqual(error_counter['other'], 1)
+        on_error.assert_awaited_once_with(row, 'ValueError', ANY)
 
     async def test_handle_image_force_logic(self):
-        """Test handle_image logic regarding force_images flag and existing images"""
+        """handle_image calls the image Edge Function only when there is no image or force_images is set for an auto image"""
+        handler = content_worker.ai_handler
+        resp = AsyncMock()
+        resp.status = 200
+        resp.json.return_value = {'source': 'pixabay', 'finalUrl': 'http://supabase/new_image.jpg'}
         session = MagicMock()
-        
-        # Mock responses
-        mock_pixabay_resp = AsyncMock()
-        mock_pixabay_resp.status = 200
-        mock_pixabay_resp.json.return_value = {'hits': [{'webformatURL': 'http://pixabay.com/img.jpg'}]}
-        
-        mock_img_resp = AsyncMock()
-        mock_img_resp.status = 200
-        mock_img_resp.read.return_value = b'x' * 600 # > MIN_FILE_SIZE (500)
-
-        # Helper to create async context manager mock for session.get()
-        def async_cm(result):
-            m = MagicMock()
-            m.__aenter__ = AsyncMock(return_value=result)
-            m.__aexit__ = AsyncMock(return_value=None)
-            return m
-
-        # We expect calls only for scenarios that proceed to download (Scenario 3 and 4)
-        # Each successful download involves 2 calls: 1 to API, 1 to Image URL
-        session.get.side_effect = [
-            async_cm(mock_pixabay_resp), # Scenario 3 (API)
-            async_cm(mock_img_resp),     # Scenario 3 (Image)
-            async_cm(mock_pixabay_resp), # Scenario 4 (API)
-            async_cm(mock_img_resp)      # Scenario 4 (Image)
-        ]
+        session.post.return_value.__aenter__ = AsyncMock(return_value=resp)
+        session.post.return_value.__aexit__ = AsyncMock(return_value=None)
 
-        with patch('content_worker.optimize_image_data', return_value=b'x'*600) as mock_opt, \
-             patch('content_worker.upload_to_supabase', new_callable=AsyncMock) as mock_upload, \
-             patch('content_worker.supabase') as mock_supabase, \
-             patch('content_worker.PIXABAY_API_KEY', 'mock-key'):
-            
-            mock_supabase.storage.from_.return_value.get_public_url.return_value = 'http://supabase/new_image.jpg'
+        with patch('ai_handler.delete_old_file', new_callable=AsyncMock) as mock_delete:
+            # Scenario 1: Existing custom image without force. Should skip.
+            row_custom = {'id': 1, 'image': 'http://old.jpg', 'image_source': 'user', 'word_kr': 'test', 'translation': 'test'}
+            self.assertEqual(await handler.handle_image(session, row_custom, 'test', 'hash', force_images=False), {})
 
-            # Scenario 1: Existing custom image (not pixabay). Should skip regardless of force.
-            row_custom = {'image': 'http://old.jpg', 'image_source': 'user', 'word_kr': 'test'}
-            res1 = await content_worker.ai_handler.handle_image(session, row_custom, 'test', 'hash', force_images=True)
-            self.assertEqual(res1, {})
-            
             # Scenario 2: Existing pixabay image, force=False. Should skip.
-            row_pixabay = {'image': 'http://old_pix.jpg', 'image_source': 'pixabay', 'word_kr': 'test'}
-            res2 = await content_worker.ai_handler.handle_image(session, row_pixabay, 'test', 'hash', force_images=False)
-            self.assertEqual(res2, {})
+            row_pixabay = {'id': 2, 'image': 'http://old_pix.jpg', 'image_source': 'pixabay', 'word_kr': 'test', 'translation': 'test'}
+            self.assertEqual(await handler.handle_image(session, row_pixabay, 'test', 'hash', force_images=False), {})
+            session.post.assert_not_called()
 
-            # Scenario 3: Existing pixabay image, force=True. Should update.
-            res3 = await content_worker.ai_handler.handle_image(session, row_pixabay, 'test', 'hash', force_images=True)
-            self.assertEqual(res3, {'image': 'http://supabase/new_image.jpg', 'image_source': 'pixabay'})
-            
-            # Scenario 4: No image. Should update regardless of force (testing force=False here).
-            row_none = {'image': None, 'image_source': None, 'word_kr': 'test'}
-            res4 = await content_worker.ai_handler.handle_image(session, row_none, 'test', 'hash', force_images=False)
-            self.assertEqual(res4, {'image': 'http://supabase/new_image.jpg', 'image_source': 'pixabay'})
+            # Scenario 3: Existing pixabay image, force=True. The function writes the new image, the old file is removed.
+            await handler.handle_image(session, row_pixabay, 'test', 'hash', force_images=True)
+            self.assertEqual(session.post.call_count, 1)
+            self.assertEqual(session.post.call_args.kwargs['json']['id'], 2)
+            mock_delete.assert_awaited_once_with(ANY, 'image-files', 'http://old_pix.jpg')
+
+            # Scenario 4: No image. Should call the function regardless of force.
+            row_none = {'id': 3, 'image': None, 'image_source': None, 'word_kr': 'test', 'translation': 'test'}
+            await handler.handle_image(session, row_none, 'test', 'hash', force_images=False)
+            self.assertEqual(session.post.call_count, 2)
+            self.assertEqual(mock_delete.await_count, 1)
+
+class TestRealtimeRequests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = LocalStore()
+        self.db = AsyncLocalClient(self.store)
+        self.store.insert_rows('word_requests', [{'id': i, 'word_kr': f"단어{i}", 'status': 'pending'} for i in (1, 2, 3)])
+        self.leases = RequestLeaseManager(self.db, worker_id='a')
+        patcher = patch.multiple(content_worker, pushed_requests=asyncio.Queue(maxsize=1000),
+                                 pushed_request_ids=set(), request_leases=self.leases)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def statuses(self):
+        res = self.store.run_query(self.db.table('word_requests').select('id,status,claimed_by'))
+        return {r['id']: (r['status'], r['claimed_by']) for r in res.data}
+
+    async def test_enqueue_filters_events(self):
+        content_worker.enqueue_realtime_request({'id': 1, 'status': 'pending'})
+        content_worker.enqueue_realtime_request({'id': 1, 'status': 'pending'}) # дубль
+        content_worker.enqueue_realtime_request({'id': 2, 'status': 'done'})
+        content_worker.enqueue_realtime_request({'status': 'pending'})
+        self.leases.held.add(3)
+        content_worker.enqueue_realtime_request({'id': 3})
+
+        self.assertEqual(content_worker.take_pushed_requests(5), [1])
+        self.assertEqual(content_worker.pushed_request_ids, set())
+
+    async def test_take_respects_limit_and_drops_held(self):
+        for req_id in (1, 2, 3):
+            content_worker.enqueue_realtime_request({'id': req_id, 'status': 'pending'})
+        self.leases.held.add(1) # уже захвачена опросом
+
+        self.assertEqual(content_worker.take_pushed_requests(1), [2])
+        self.assertEqual(content_worker.take_pushed_requests(5), [3])
+
+    async def test_pushed_requests_are_claimed_once(self):
+        content_worker.enqueue_realtime_request({'id': 2, 'status': 'pending'})
+        ids = content_worker.take_pushed_requests(5)
+
+        rows = await self.leases.claim_ids(ids)
+        self.assertEqual([(r['id'], r['word_kr']) for r in rows], [(2, "단어2")])
+        self.assertEqual(self.statuses()[2], ('processing', 'a'))
+
+        other = RequestLeaseManager(self.db, worker_id='b')
+        self.assertEqual(await other.claim_ids(ids), [])
+        self.assertEqual(await self.leases.claim_ids(ids), [])
+
+class TestWordRequests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = LocalStore()
+        self.db = AsyncLocalClient(self.store)
+        self.store.insert_rows('word_requests', [{'id': i, 'word_kr': f"단어{i}", 'status': 'pending'} for i in (1, 2, 3)])
+        self.leases = RequestLeaseManager(self.db, worker_id='a')
+        patchers = [
+            patch.multiple(content_worker, db=self.db, request_leases=self.leases, http_pool=MagicMock(),
+                           shutdown_event=asyncio.Event(), pushed_requests=asyncio.Queue(maxsize=1000), pushed_request_ids=set()),
+            patch.multiple(content_worker.args, request_timeout=0.05, drain_timeout=0.2, request_concurrency=2),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def request(self, req_id):
+        res = self.store.run_query(self.db.table('word_requests').select('*').eq('id', req_id))
+        return res.data[0]
+
+    async def test_request_timeout_marks_error_and_releases_lease(self):
+        req = (await self.leases.claim(1))[0]
+
+        async def stuck(*args, **kwargs):
+            await asyncio.sleep(10)
+
+        with patch.object(content_worker.ai_handler, 'process_word_request', side_effect=stuck):
+            await content_worker.run_word_request(asyncio.Semaphore(1), None, req)
+
+        row = self.request(req['id'])
+        self.assertEqual((row['status'], row['my_notes']), ('error', 'Worker Timeout'))
+        self.assertNotIn(req['id'], self.leases.held)
+
+    async def test_request_error_releases_lease(self):
+        req = (await self.leases.claim(1))[0]
+        with patch.object(content_worker.ai_handler, 'process_word_request', side_effect=ValueError("bad json")):
+            await content_worker.run_word_request(asyncio.Semaphore(1), None, req)
+        self.assertNotIn(req['id'], self.leases.held)
+
+    async def test_requests_run_concurrently_within_slots(self):
+        active, peak = 0, 0
+
+        async def work(req, **kwargs):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            try:
+                await asyncio.sleep(0.01)
+            finally:
+                active -= 1
+
+        reqs = await self.leases.claim(3)
+        sem = asyncio.Semaphore(2)
+        with patch.object(content_worker.ai_handler, 'process_word_request', side_effect=work):
+            await asyncio.gather(*[content_worker.run_word_request(sem, None, r) for r in reqs])
+        self.assertEqual(peak, 2)
+        self.assertEqual(self.leases.held, set())
+
+    async def test_shutdown_drains_started_requests_and_requeues_the_rest(self):
+        started = []
+        finished = []
+
+        async def work(req, **kwargs):
+            started.append(req['id'])
+            if req['id'] == 1:
+                # Дорабатывается в пределах drain-timeout
+                await content_worker.shutdown_event.wait()
+                await asyncio.sleep(0.01)
+                finished.append(req['id'])
+            else:
+                await asyncio.sleep(10)
+
+        with patch.object(content_worker.args, 'request_timeout', 30), \
+             patch.object(content_worker.ai_handler, 'process_word_request', side_effect=work):
+            loop_task = asyncio.create_task(content_worker.user_requests_loop(asyncio.Event()))
+            for _ in range(100):
+                if len(started) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(sorted(started), [1, 2])
+
+            content_worker.shutdown_event.set()
+            await asyncio.wait_for(loop_task, 5)
+
+        self.assertEqual(finished, [1])
+        # Прерванная заявка остается за воркером, пока ее не вернут в очередь
+        self.assertEqual(self.leases.held, {2})
+        self.assertEqual(await self.leases.requeue_held(), 1)
+        row = self.request(2)
+        self.assertEqual((row['status'], row['claimed_by']), ('pending', None))
+        self.assertEqual(self.request(3)['status'], 'pending')
+
+class TestRealtimeMedia(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.queue = asyncio.Queue(maxsize=1000)
+        patcher = patch.multiple(content_worker, realtime_media_queue=self.queue, shutdown_event=asyncio.Event())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_media_loop_bounds_tasks_in_flight(self):
+        """Events stay in the bounded queue until a worker slot frees up"""
+        release = asyncio.Event()
+        started = []
+
+        async def slow_word(row):
+            started.append(row['id'])
+            await release.wait()
+
+        for i in range(5):
+            self.queue.put_nowait(('word', {'id': i, 'word_kr': f'w{i}'}))
+
+        with patch('content_worker.REALTIME_CONSUMERS', 2), \
+             patch('content_worker.process_realtime_word', side_effect=slow_word):
+            loop_task = asyncio.create_task(content_worker.realtime_media_loop())
+            for _ in range(20):
+                await asyncio.sleep(0)
+            self.assertEqual(started, [0, 1])
+            self.assertEqual(self.queue.qsize(), 3)
+
+            release.set()
+            for _ in range(100):
+                if len(started) == 5:
+                    break
+                await asyncio.sleep(0)
+            self.assertEqual(started, [0, 1, 2, 3, 4])
+
+            content_worker.shutdown_event.set()
+            await asyncio.wait_for(loop_task, 5)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+from local_supabase import LocalStore, AsyncLocalClient
+import failure_ledger
+from failure_ledger import FailureLedger
+
+class TestFailureLedger(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.store = LocalStore()
+        self.db = AsyncLocalClient(self.store)
+        self.store.insert_rows('vocabulary', [{'id': i, 'word_kr': f"단어{i}"} for i in range(1, 4)])
+        self.ledger = FailureLedger(self.db, max_attempts=3, base_delay=600)
+
+    def failures(self):
+        res = self.store.run_query(self.db.table('media_failures').select('*'))
+        return {r['vocabulary_id']: r for r in res.data}
+
+    async def queue_ids(self):
+        res = self.store.run_query(self.db.table('vocabulary_media_queue').select('id'))
+        return {r['id'] for r in res.data}
+
+    async def test_failure_is_persisted_and_hidden_from_queue(self):
+        await self.ledger.record_failure(1, 'TimeoutError', 'edge-tts timeout')
+
+        row = self.failures()[1]
+        self.assertEqual(row['attempts'], 1)
+        self.assertEqual(row['last_error_class'], 'TimeoutError')
+        self.assertFalse(row['exhausted'])
+        self.assertEqual(await self.queue_ids(), {2, 3})
+
+    async def test_attempts_accumulate_until_budget_is_exhausted(self):
+        for _ in range(3):
+            await self.ledger.record_failure(1, 'ValueError')
+
+        row = self.failures()[1]
+        self.assertEqual(row['attempts'], 3)
+        self.assertTrue(row['exhausted'])
+        self.assertEqual(self.ledger.stats['exhausted'], 1)
+
+    async def test_attempts_are_read_back_after_restart(self):
+        await self.ledger.record_failure(1, 'ValueError')
+        restarted = FailureLedger(self.db)
+
+        await restarted.record_failure(1, 'ValueError')
+
+        self.assertEqual(self.failures()[1]['attempts'], 2)
+
+    async def test_backoff_expires(self):
+        await self.ledger.record_failure(1, 'ValueError')
+        self.assertTrue(self.ledger.is_backing_off(1))
+        self.assertFalse(self.ledger.is_backing_off(2))
+
+        self.ledger._attempts[1]['retry_at'] = time.time() - 1
+        self.assertFalse(self.ledger.is_backing_off(1))
+
+    async def test_exhausted_row_keeps_backing_off(self):
+        ledger = FailureLedger(self.db, max_attempts=1, base_delay=0)
+        await ledger.record_failure(1, 'ValueError')
+        self.assertTrue(ledger.is_backing_off(1))
+
+    async def test_tracked_rows_are_bounded(self):
+        ledger = FailureLedger(self.db, max_tracked=2)
+        for row_id in (1, 2, 3):
+            await ledger.record_failure(row_id, 'ValueError')
+
+        self.assertEqual(list(ledger._attempts), [2, 3])
+        self.assertFalse(ledger.has_failed(1))
+
+    async def test_clear_removes_record_written_by_another_process(self):
+        await FailureLedger(self.db).record_failure(1, 'ValueError')
+
+        await self.ledger.clear(1)
+        await self.ledger.clear(2)
+
+        self.assertEqual(self.failures(), {})
+        self.assertEqual(await self.queue_ids(), {1, 2, 3})
+        self.assertEqual(self.ledger.stats['healed'], 1)
+
+    async def test_written_rows_are_cleared_in_one_request(self):
+        other = FailureLedger(self.db)
+        for row_id in (1, 2):
+            await other.record_failure(row_id, 'ValueError')
+        for row_id in (1, 2, 3):
+            self.ledger.schedule_clear(row_id)
+
+        with patch.object(failure_ledger, 'execute_supabase_query', wraps=failure_ledger.execute_supabase_query) as execute:
+            await self.ledger.flush_written([1, 2, 4])
+
+        self.assertEqual(execute.await_count, 1)
+        self.assertEqual(self.failures(), {})
+        self.assertEqual(self.ledger.stats['healed'], 2)
+        # Строка 3 еще не записана — остается отмеченной до своего сброса
+        self.assertEqual(self.ledger._to_clear, {3})
+
+    async def test_new_failure_cancels_scheduled_clear(self):
+        self.ledger.schedule_clear(1)
+        await self.ledger.record_failure(1, 'ValueError')
+
+        await self.ledger.flush_written([1])
+        self.assertIn(1, self.failures())
+
+    async def test_disabled_when_table_is_missing(self):
+        class BrokenClient:
+            def table(self, name):
+                raise RuntimeError('relation "media_failures" does not exist')
+
+        ledger = FailureLedger(BrokenClient())
+        self.assertFalse(await ledger.check())
+        await ledger.record_failure(1, 'ValueError')
+        self.assertFalse(ledger.is_backing_off(1))
+
+if __name__ == '__main__':
+    unittest.main()
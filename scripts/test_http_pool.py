@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import metrics
+from http_pool import HttpPool
+
+class TestHttpPool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = patch.multiple(metrics, _counters={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        async def ok(request):
+            return web.Response(text="ok")
+
+        app = web.Application()
+        app.router.add_get('/', ok)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/"
+        self.pool = HttpPool()
+        await self.pool.start()
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        await self.runner.cleanup()
+
+    async def test_connection_reuse_is_exported(self):
+        for _ in range(3):
+            async with self.pool.session.get(self.url) as resp:
+                await resp.read()
+
+        s = self.pool.stats()
+        self.assertEqual((s['requests'], s['connections_created'], s['connections_reused']), (3, 1, 2))
+        text = metrics.render()
+        self.assertIn('worker_http_requests_total 3', text)
+        self.assertIn('worker_http_connections_total{result="created"} 1', text)
+        self.assertIn('worker_http_connections_total{result="reused"} 2', text)
+
+    async def test_session_requires_start(self):
+        with self.assertRaises(RuntimeError):
+            HttpPool().session
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+from limiters import AIMDLimiter
+
+class TestAIMDLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrency_never_exceeds_limit(self):
+        limiter = AIMDLimiter('test', initial=3, max_limit=3)
+        peak = 0
+
+        async def call():
+            nonlocal peak
+            async with limiter():
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[call() for _ in range(20)])
+        self.assertEqual(peak, 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+    async def test_fast_successes_grow_limit_additively(self):
+        limiter = AIMDLimiter('test', initial=2, max_limit=10, latency_target=5.0)
+        for _ in range(4):
+            async with limiter():
+                pass
+        # +1/limit за вызов: 2 -> 2.5 -> 2.9 -> 3.24 -> 3.55
+        self.assertEqual(limiter.current, 3)
+
+        for _ in range(100):
+            async with limiter():
+                pass
+        self.assertEqual(limiter.current, 10)
+
+    async def test_error_decreases_limit_once_per_cooldown(self):
+        limiter = AIMDLimiter('test', initial=10, decrease_factor=0.5, cooldown=60)
+        for _ in range(3):
+            async with limiter() as slot:
+                slot.fail()
+
+        self.assertEqual(limiter.current, 5)
+        self.assertEqual(limiter.stats['errors'], 3)
+        self.assertEqual(limiter.stats['decreases'], 1)
+
+    async def test_exception_counts_as_failure(self):
+        limiter = AIMDLimiter('test', initial=10, decrease_factor=0.5)
+        with self.assertRaises(ValueError):
+            async with limiter():
+                raise ValueError("boom")
+        self.assertEqual(limiter.current, 5)
+        self.assertEqual(limiter.in_flight, 0)
+
+    async def test_slow_call_decreases_limit(self):
+        limiter = AIMDLimiter('test', initial=8, latency_target=0.0, decrease_factor=0.5)
+        async with limiter():
+            await asyncio.sleep(0.01)
+        self.assertEqual(limiter.current, 4)
+        self.assertEqual(limiter.stats['slow'], 1)
+
+    async def test_limit_stays_within_bounds(self):
+        limiter = AIMDLimiter('test', initial=2, min_limit=2, decrease_factor=0.1, cooldown=0)
+        for _ in range(3):
+            async with limiter() as slot:
+                slot.fail()
+        self.assertEqual(limiter.current, 2)
+
+if __name__ == '__main__':
+    unittest.main()
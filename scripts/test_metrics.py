@@ -0,0 +1,67 @@
+import os
+import sys
+import asyncio
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import metrics
+
+class TestMetrics(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = patch.multiple(metrics, _gauge_callbacks=[], _callback_gauges={}, _counters={}, _histograms={}, _gauges={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_render_reads_callback_snapshot_only(self):
+        calls = []
+        state = {'depth': 3}
+
+        def collect():
+            calls.append(1)
+            return [('worker_queue_depth', {'queue': 'test'}, state['depth'])]
+
+        metrics.register_gauge_callback(collect)
+        state['depth'] = 7
+        text = metrics.render()
+
+        self.assertEqual(len(calls), 1)
+        self.assertIn('worker_queue_depth{queue="test"} 3', text)
+
+        metrics.refresh_gauges()
+        self.assertIn('worker_queue_depth{queue="test"} 7', metrics.render())
+
+    def test_failing_callback_keeps_other_gauges(self):
+        def broken():
+            raise RuntimeError("dictionary changed size during iteration")
+
+        metrics.register_gauge_callback(broken)
+        metrics.register_gauge_callback(lambda: [('worker_requests_in_flight', {}, 2)])
+
+        self.assertIn('worker_requests_in_flight 2', metrics.render())
+
+    async def test_monitor_loop_refreshes_snapshot(self):
+        state = {'depth': 1}
+        metrics.register_gauge_callback(lambda: [('worker_queue_depth', {'queue': 'q'}, state['depth'])])
+        state['depth'] = 5
+
+        task = asyncio.create_task(metrics.monitor_loop_lag(interval=0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        self.assertIn('worker_queue_depth{queue="q"} 5', metrics.render())
+
+    def test_counters_and_histograms_render(self):
+        metrics.inc('worker_words_processed_total', result='ok')
+        metrics.inc('worker_words_processed_total', result='ok')
+        metrics.observe('worker_stage_seconds', 0.3, stage='tts')
+
+        text = metrics.render()
+        self.assertIn('worker_words_processed_total{result="ok"} 2', text)
+        self.assertIn('worker_stage_seconds_bucket{stage="tts",le="0.5"} 1', text)
+        self.assertIn('worker_stage_seconds_count{stage="tts"} 1', text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import metrics
+import network_quality
+
+class TestNetworkQuality(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(network_quality, '_estimates', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_db_write_span_does_not_double_count(self):
+        network_quality.record('supabase_db', 0.1)
+        sp = metrics.Span('db_write', {})
+        sp.duration = 0.1
+        network_quality.on_span(sp)
+        self.assertEqual(network_quality.get('supabase_db').samples, 1)
+
+    def test_stage_span_is_recorded_for_its_endpoint(self):
+        sp = metrics.Span('tts', {})
+        sp.duration, sp.bytes = 0.5, 1000
+        network_quality.on_span(sp)
+        s = network_quality.snapshot()['edge_tts']
+        self.assertEqual(s['samples'], 1)
+        self.assertEqual(s['throughput'], 2000)
+
+    def test_latency_ewma_and_errors(self):
+        network_quality.record('gemini', 1.0)
+        network_quality.record('gemini', 2.0, ok=False)
+        self.assertAlmostEqual(network_quality.latency('gemini'), 1.2)
+        self.assertAlmostEqual(network_quality.snapshot()['gemini']['error_rate'], 0.2)
+        self.assertIsNone(network_quality.latency('edge_tts'))
+
+if __name__ == '__main__':
+    unittest.main()
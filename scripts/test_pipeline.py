@@ -0,0 +1,147 @@
+import os
+import sys
+import asyncio
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import pipeline
+from pipeline import MediaPipeline
+
+def paged(rows, page_size):
+    """fetch_page по списку строк с keyset-курсором, как у воркера."""
+    async def fetch_page(cursor):
+        page = [r for r in rows if cursor is None or r['id'] > cursor][:page_size]
+        next_cursor = page[-1]['id'] if len(page) == page_size else None
+        return page, next_cursor
+    return fetch_page
+
+class TestMediaPipeline(unittest.IsolatedAsyncioTestCase):
+    async def test_full_pass_writes_every_result(self):
+        rows = [{'id': i} for i in range(1, 26)]
+        written, done = [], []
+
+        async def process(row):
+            return None if row['id'] == 5 else {'audio_url': f"a{row['id']}"}
+
+        async def write(row, result):
+            written.append(row['id'])
+            return True
+
+        p = MediaPipeline(paged(rows, 10), process, write, consumers=3, on_row_done=lambda r: done.append(r['id']))
+        stats = await p.run()
+
+        self.assertEqual(sorted(written), [i for i in range(1, 26) if i != 5])
+        self.assertEqual(sorted(done), list(range(1, 26)))
+        self.assertEqual(stats['process'].count, 25)
+        self.assertEqual(stats['process'].errors, 1)
+
+    async def test_start_cursor_skips_processed_rows(self):
+        rows = [{'id': i} for i in range(1, 11)]
+        seen = []
+
+        async def process(row):
+            seen.append(row['id'])
+            return {}
+
+        async def write(row, result):
+            return True
+
+        await MediaPipeline(paged(rows, 4), process, write, consumers=2, start_cursor=6).run()
+        self.assertEqual(sorted(seen), [7, 8, 9, 10])
+
+    async def test_fetch_error_is_retried(self):
+        rows = [{'id': i} for i in range(1, 6)]
+        fetch = paged(rows, 2)
+        calls = {'n': 0}
+
+        async def flaky_fetch(cursor):
+            calls['n'] += 1
+            if calls['n'] == 2:
+                raise ConnectionError("PostgREST 503")
+            return await fetch(cursor)
+
+        written = []
+
+        async def process(row):
+            return {'image': 'x'}
+
+        async def write(row, result):
+            written.append(row['id'])
+            return True
+
+        with patch.object(pipeline, 'FETCH_RETRY_BASE', 0.01):
+            p = MediaPipeline(flaky_fetch, process, write, consumers=2)
+            stats = await p.run()
+
+        self.assertEqual(sorted(written), [1, 2, 3, 4, 5])
+        self.assertEqual(stats['fetch'].errors, 1)
+
+    async def test_stop_drains_generated_results(self):
+        rows = [{'id': i} for i in range(1, 101)]
+        processed, written = [], []
+        p = None
+
+        async def process(row):
+            await asyncio.sleep(0.001)
+            processed.append(row['id'])
+            if len(processed) == 10:
+                p.stop()
+            return {'audio_url': 'x'}
+
+        async def write(row, result):
+            await asyncio.sleep(0.005)
+            written.append(row['id'])
+            return True
+
+        p = MediaPipeline(paged(rows, 20), process, write, consumers=4, writers=1)
+        await p.run()
+
+        self.assertTrue(p.stopped)
+        self.assertLess(len(processed), 100)
+        self.assertEqual(sorted(written), sorted(processed))
+
+    async def test_cancelled_pass_still_writes_queued_results(self):
+        rows = [{'id': i} for i in range(1, 41)]
+        queued, written = [], []
+        release_writer = asyncio.Event()
+
+        async def process(row):
+            queued.append(row['id'])
+            return {'audio_url': 'x'}
+
+        async def write(row, result):
+            await release_writer.wait()
+            written.append(row['id'])
+            return True
+
+        p = MediaPipeline(paged(rows, 10), process, write, consumers=2, writers=1)
+        task = asyncio.create_task(p.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0)
+        release_writer.set()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertTrue(written)
+        self.assertEqual(sorted(written), sorted(queued))
+
+    async def test_stop_during_fetch_retry_ends_pass(self):
+        async def broken_fetch(cursor):
+            raise ConnectionError("down")
+
+        async def process(row):
+            return {}
+
+        async def write(row, result):
+            return True
+
+        p = MediaPipeline(broken_fetch, process, write, consumers=2)
+        asyncio.get_running_loop().call_later(0.05, p.stop)
+        await asyncio.wait_for(p.run(), timeout=5)
+        self.assertGreaterEqual(p.stats['fetch'].errors, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import rate_limits
+from rate_limits import TokenBucket
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_is_immediate_then_rate_applies(self):
+        bucket = TokenBucket('test', rate=20, burst=3)
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.02)
+
+        await asyncio.gather(bucket.acquire(), bucket.acquire())
+        # Два токена сверх всплеска при 20/сек — не меньше ~0.1 сек
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertEqual(bucket.stats['acquired'], 5)
+        self.assertEqual(bucket.stats['waited'], 2)
+
+    async def test_waiters_are_served_in_order(self):
+        bucket = TokenBucket('test', rate=50, burst=1)
+        order = []
+
+        async def take(i):
+            await bucket.acquire()
+            order.append(i)
+
+        await asyncio.gather(*[take(i) for i in range(5)])
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+
+    async def test_max_wait_counts_queued_callers(self):
+        bucket = TokenBucket('test', rate=2, burst=1)
+        await bucket.acquire()
+        # Трое уже ждут: следующий токен освободится только через ~2 сек
+        queued = [asyncio.create_task(bucket.acquire()) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        start = time.monotonic()
+        self.assertFalse(await bucket.acquire(max_wait=1.0))
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.assertEqual(bucket.stats['rejected'], 1)
+
+        for task in queued:
+            task.cancel()
+        await asyncio.gather(*queued, return_exceptions=True)
+
+    async def test_cancelled_waiter_returns_its_reservation(self):
+        bucket = TokenBucket('test', rate=1, burst=1)
+        await bucket.acquire()
+        waiter = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        self.assertLess(bucket.tokens, 0)
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        self.assertGreaterEqual(bucket.tokens, 0)
+
+    async def test_penalty_blocks_new_and_reserved_tokens(self):
+        # Ожидание резерва (0.2 с) намного больше возможной задержки цикла, чтобы токен не успел накопиться до штрафа
+        bucket = TokenBucket('test', rate=5, burst=1)
+        await bucket.acquire()
+        waiter = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+
+        start = time.monotonic()
+        bucket.penalize(0.4)
+        self.assertFalse(await bucket.acquire(max_wait=0.01))
+        await waiter
+        self.assertGreaterEqual(time.monotonic() - start, 0.39)
+
+class TestRateLimitHelpers(unittest.TestCase):
+    def test_retry_delay_is_parsed_from_429(self):
+        error = "429 RESOURCE_EXHAUSTED {'retryDelay': '37s'}"
+        self.assertTrue(rate_limits.is_rate_limited(error))
+        self.assertEqual(rate_limits.retry_delay(error), 37.0)
+        self.assertIsNone(rate_limits.retry_delay("500 internal"))
+
+if __name__ == '__main__':
+    unittest.main()
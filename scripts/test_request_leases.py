@@ -0,0 +1,92 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+from local_supabase import LocalStore, AsyncLocalClient
+from request_leases import RequestLeaseManager
+
+class TestRequestLeases(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.store = LocalStore()
+        self.db = AsyncLocalClient(self.store)
+        self.store.insert_rows('word_requests', [{'id': i, 'word_kr': f"단어{i}", 'status': 'pending'} for i in (1, 2, 3)])
+
+    def rows(self):
+        res = self.store.run_query(self.db.table('word_requests').select('*').order('id'))
+        return {r['id']: r for r in res.data}
+
+    async def test_claim_marks_processing_and_is_exclusive(self):
+        a = RequestLeaseManager(self.db, worker_id='a')
+        b = RequestLeaseManager(self.db, worker_id='b')
+
+        claimed_a = await a.claim(2)
+        claimed_b = await b.claim(5)
+
+        self.assertEqual(len(claimed_a), 2)
+        self.assertEqual(len(claimed_b), 1)
+        self.assertFalse({r['id'] for r in claimed_a} & {r['id'] for r in claimed_b})
+        self.assertEqual(a.held, {r['id'] for r in claimed_a})
+        rows = self.rows()
+        self.assertTrue(all(r['status'] == 'processing' for r in rows.values()))
+        self.assertEqual(rows[claimed_b[0]['id']]['claimed_by'], 'b')
+
+    async def test_fallback_claim_without_rpc(self):
+        manager = RequestLeaseManager(self.db, worker_id='a')
+        manager.use_rpc = False
+
+        claimed = await manager.claim(5)
+
+        self.assertEqual({r['id'] for r in claimed}, {1, 2, 3})
+        self.assertEqual({r['claimed_by'] for r in self.rows().values()}, {'a'})
+
+    async def test_expired_lease_is_reclaimed(self):
+        dead = RequestLeaseManager(self.db, worker_id='dead', lease_seconds=-1)
+        alive = RequestLeaseManager(self.db, worker_id='alive')
+        await dead.claim(3)
+
+        claimed = await alive.claim(3)
+
+        self.assertEqual(len(claimed), 3)
+        self.assertEqual({r['claimed_by'] for r in self.rows().values()}, {'alive'})
+
+    async def test_renew_extends_lease_and_drops_lost_requests(self):
+        manager = RequestLeaseManager(self.db, worker_id='a')
+        await manager.claim(2)
+        held = set(manager.held)
+        lost_id = min(held)
+        # Другой воркер перехватил одну заявку
+        self.store.run_query(self.db.table('word_requests').update({'claimed_by': 'b'}).eq('id', lost_id))
+
+        await manager.renew()
+
+        self.assertEqual(manager.held, held - {lost_id})
+        kept = self.rows()[max(held)]
+        expires = datetime.fromisoformat(kept['lease_expires_at'])
+        self.assertGreater(expires, datetime.now(timezone.utc) + timedelta(seconds=manager.lease_seconds - 10))
+
+    async def test_requeue_held_returns_requests_to_pending(self):
+        manager = RequestLeaseManager(self.db, worker_id='a')
+        await manager.claim(3)
+
+        returned = await manager.requeue_held()
+
+        self.assertEqual(returned, 3)
+        self.assertEqual(manager.held, set())
+        rows = self.rows()
+        self.assertTrue(all(r['status'] == 'pending' and r['claimed_by'] is None for r in rows.values()))
+
+    async def test_claim_ids_skips_requests_held_elsewhere(self):
+        other = RequestLeaseManager(self.db, worker_id='b')
+        await other.claim_ids([1])
+        manager = RequestLeaseManager(self.db, worker_id='a')
+
+        claimed = await manager.claim_ids([1, 2])
+
+        self.assertEqual([r['id'] for r in claimed], [2])
+        self.assertEqual(manager.held, {2})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+from scan_cursor import ScanCursor
+
+class TestScanCursor(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'worker_state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_advances_only_when_earlier_pages_are_done(self):
+        cursor = ScanCursor('vocabulary:missing', path=self.path)
+        cursor.page_fetched(10, [1, 5, 10])
+        cursor.page_fetched(20, [15])
+
+        cursor.row_done(15)
+        self.assertIsNone(cursor.committed)
+
+        cursor.row_done(1)
+        cursor.row_done(10)
+        self.assertIsNone(cursor.committed)
+
+        cursor.row_done(5)
+        self.assertEqual(cursor.committed, 20)
+
+    def test_page_without_kept_rows_commits_immediately(self):
+        cursor = ScanCursor('k', path=self.path)
+        cursor.page_fetched(10, [])
+        self.assertEqual(cursor.committed, 10)
+
+    def test_cursor_survives_restart(self):
+        cursor = ScanCursor('k', path=self.path)
+        cursor.page_fetched(10, [3])
+        cursor.row_done(3)
+
+        self.assertEqual(ScanCursor('k', path=self.path).committed, 10)
+        self.assertIsNone(ScanCursor('other', path=self.path).committed)
+
+    def test_keys_do_not_overwrite_each_other(self):
+        a = ScanCursor('a', path=self.path)
+        b = ScanCursor('b', path=self.path)
+        a.page_fetched(10, [])
+        b.page_fetched(30, [])
+
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['cursors'], {'a': 10, 'b': 30})
+
+    def test_reset_forgets_cursor(self):
+        cursor = ScanCursor('k', path=self.path)
+        cursor.page_fetched(10, [])
+        cursor.reset()
+
+        self.assertIsNone(cursor.committed)
+        self.assertIsNone(ScanCursor('k', path=self.path).committed)
+
+    def test_unknown_and_repeated_rows_are_ignored(self):
+        cursor = ScanCursor('k', path=self.path)
+        cursor.page_fetched(10, [1, 2])
+        cursor.row_done(1)
+        cursor.row_done(1)
+        cursor.row_done(99)
+        self.assertIsNone(cursor.committed)
+
+        cursor.row_done(2)
+        self.assertEqual(cursor.committed, 10)
+
+if __name__ == '__main__':
+    unittest.main()
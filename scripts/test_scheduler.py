@@ -0,0 +1,102 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+from scheduler import PriorityScheduler
+
+async def hold(scheduler, cls, release, started=None):
+    async with scheduler.slot(cls):
+        if started is not None:
+            started.append(cls)
+        await release.wait()
+
+class TestPriorityScheduler(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        for task in getattr(self, 'tasks', []):
+            task.cancel()
+        await asyncio.gather(*getattr(self, 'tasks', []), return_exceptions=True)
+
+    def spawn(self, coro):
+        self.tasks = getattr(self, 'tasks', [])
+        task = asyncio.create_task(coro)
+        self.tasks.append(task)
+        return task
+
+    async def test_background_never_takes_user_reserve(self):
+        scheduler = PriorityScheduler(4, user_reserve=2)
+        release = asyncio.Event()
+        for _ in range(5):
+            self.spawn(hold(scheduler, 'words', release))
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.in_use['words'], 2)
+
+        started = []
+        self.spawn(hold(scheduler, PriorityScheduler.USER, release, started))
+        await asyncio.sleep(0)
+        self.assertEqual(started, ['user'])
+
+    async def test_user_waiter_gets_next_free_slot(self):
+        scheduler = PriorityScheduler(2)
+        gates = [asyncio.Event(), asyncio.Event()]
+        for gate in gates:
+            self.spawn(hold(scheduler, 'words', gate))
+        await asyncio.sleep(0)
+
+        started = []
+        never = asyncio.Event()
+        self.spawn(hold(scheduler, 'words', never, started))
+        self.spawn(hold(scheduler, PriorityScheduler.USER, never, started))
+        await asyncio.sleep(0)
+        gates[0].set()
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(started, ['user'])
+
+    async def test_background_is_capped_while_users_are_active(self):
+        scheduler = PriorityScheduler(10, busy_share=0.5)
+        release = asyncio.Event()
+        self.spawn(hold(scheduler, PriorityScheduler.USER, release))
+        for _ in range(10):
+            self.spawn(hold(scheduler, 'words', release))
+        await asyncio.sleep(0)
+
+        self.assertEqual(scheduler.in_use['words'], 5)
+
+    async def test_background_classes_share_by_weight(self):
+        scheduler = PriorityScheduler(1, weights={'words': 4, 'quotes': 1})
+        order = []
+
+        async def unit(cls):
+            async with scheduler.slot(cls):
+                order.append(cls)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*[unit('words') for _ in range(8)], *[unit('quotes') for _ in range(8)])
+        first_ten = order[:10]
+        self.assertEqual(first_ten.count('words'), 8)
+        self.assertEqual(first_ten.count('quotes'), 2)
+
+    async def test_cancelled_waiter_frees_its_place(self):
+        scheduler = PriorityScheduler(1)
+        release = asyncio.Event()
+        self.spawn(hold(scheduler, 'words', release))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(scheduler, 'quotes', release))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        self.assertEqual(scheduler.snapshot()['quotes']['waiting'], 0)
+        release.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(scheduler.total_in_use, 0)
+
+    def test_unknown_class_is_rejected(self):
+        with self.assertRaises(ValueError):
+            PriorityScheduler(2).slot('images')
+
+if __name__ == '__main__':
+    unittest.main()
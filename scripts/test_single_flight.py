@@ -0,0 +1,84 @@
+import os
+import sys
+import asyncio
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import single_flight
+from single_flight import SingleFlight
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_run(self):
+        flights = SingleFlight('test')
+        release = asyncio.Event()
+        runs = []
+
+        async def work():
+            runs.append(1)
+            await release.wait()
+            return "audio"
+
+        waiters = [asyncio.create_task(flights.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.assertEqual(flights.in_flight, 1)
+        release.set()
+
+        self.assertEqual(await asyncio.gather(*waiters), ["audio"] * 3)
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(flights.stats, {'calls': 3, 'shared': 2})
+        self.assertEqual(flights.in_flight, 0)
+
+    async def test_different_keys_run_separately(self):
+        flights = SingleFlight('test')
+
+        async def work(value):
+            await asyncio.sleep(0)
+            return value
+
+        results = await asyncio.gather(flights.do("a", lambda: work(1)), flights.do("b", lambda: work(2)))
+        self.assertEqual(results, [1, 2])
+        self.assertEqual(flights.stats['shared'], 0)
+
+    async def test_exception_is_shared_and_key_released(self):
+        flights = SingleFlight('test')
+
+        async def fail():
+            await asyncio.sleep(0)
+            raise ValueError("quota")
+
+        results = await asyncio.gather(flights.do("key", fail), flights.do("key", fail), return_exceptions=True)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(flights.in_flight, 0)
+
+        async def ok():
+            return "retry"
+        self.assertEqual(await flights.do("key", ok), "retry")
+
+    async def test_cancelled_waiter_does_not_cancel_work(self):
+        flights = SingleFlight('test')
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "done"
+
+        first = asyncio.create_task(flights.do("key", work))
+        second = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        self.assertEqual(await second, "done")
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+
+    @patch.dict(single_flight._groups)
+    def test_group_is_shared_by_name(self):
+        self.assertIs(single_flight.group('test-group'), single_flight.group('test-group'))
+        self.assertIn('test-group', single_flight.snapshot())
+
+if __name__ == '__main__':
+    unittest.main()
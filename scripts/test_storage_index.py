@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import storage_index
+from local_supabase import LocalStore, LocalClient
+from storage_index import StorageIndex
+
+BUCKET = 'audio-files'
+
+class TestStorageIndex(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.client = LocalClient(LocalStore())
+        self.client.storage.create_bucket(BUCKET, options={'public': True})
+        self.bucket = self.client.storage.from_(BUCKET)
+        self.index = StorageIndex(self.client, BUCKET)
+
+    def upload(self, *names, size=1024):
+        for name in names:
+            self.bucket.upload(name, b'\x00' * size)
+
+    async def test_full_refresh_skips_broken_objects(self):
+        self.upload("a.mp3", "b.mp3")
+        self.upload("broken.mp3", size=10)
+        self.assertFalse(self.index.exists("a.mp3"))
+
+        await self.index.refresh()
+
+        self.assertTrue(self.index.ready)
+        self.assertTrue(self.index.exists("a.mp3"))
+        self.assertTrue(self.index.exists("b.mp3"))
+        self.assertFalse(self.index.exists("broken.mp3"))
+
+    async def test_pages_through_bucket(self):
+        self.upload(*[f"{i:02d}.mp3" for i in range(7)])
+        with patch.object(storage_index, 'LIST_PAGE_SIZE', 3):
+            await self.index.refresh()
+        self.assertEqual(len(self.index._names), 7)
+
+    async def test_incremental_refresh_reads_only_new_objects(self):
+        self.upload("old.mp3")
+        await self.index.refresh()
+        self.upload("new.mp3")
+
+        with patch.object(self.index, '_fetch_page', wraps=self.index._fetch_page) as fetch:
+            await self.index.refresh()
+
+        fetch.assert_called_once_with(0, newest_first=True)
+        self.assertTrue(self.index.exists("old.mp3"))
+        self.assertTrue(self.index.exists("new.mp3"))
+
+    async def test_full_refresh_drops_deleted_objects(self):
+        self.upload("a.mp3", "b.mp3")
+        await self.index.refresh()
+        self.bucket.remove(["a.mp3"])
+
+        await self.index.refresh()
+        self.assertTrue(self.index.exists("a.mp3"))
+        await self.index.refresh(full=True)
+        self.assertFalse(self.index.exists("a.mp3"))
+
+    async def test_public_url_and_local_updates(self):
+        self.upload("a.mp3")
+        self.assertIsNone(self.index.public_url("a.mp3"))
+        await self.index.refresh()
+
+        url = self.index.public_url("a.mp3")
+        self.assertEqual(url, self.bucket.get_public_url("a.mp3"))
+        self.assertEqual(self.index.stats['reused'], 1)
+
+        self.index.discard_url(url + "?t=1")
+        self.assertIsNone(self.index.public_url("a.mp3"))
+        self.index.add("a.mp3")
+        self.assertTrue(self.index.exists("a.mp3"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sys
+import signal
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import supervisor
+from supervisor import ShardProcess, WorkerSupervisor, _add_label, merge_metrics
+
+def fake_shard(alive=True, returncode=None):
+    proc = MagicMock()
+    proc.poll.return_value = None if alive else returncode
+    proc.returncode = returncode
+    return proc
+
+class TestAddLabel(unittest.TestCase):
+    def test_sample_without_labels(self):
+        self.assertEqual(_add_label('worker_up 1', 'shard="0"'), 'worker_up{shard="0"} 1')
+
+    def test_sample_with_labels(self):
+        self.assertEqual(
+            _add_label('worker_tts_cache_total{result="hit"} 5', 'shard="1"'),
+            'worker_tts_cache_total{shard="1",result="hit"} 5'
+        )
+
+class TestMergeMetrics(unittest.TestCase):
+    def test_families_stay_grouped(self):
+        shard0 = "# HELP a_total A\n# TYPE a_total counter\na_total 1\n# TYPE b gauge\nb{x=\"1\"} 2\n"
+        shard1 = "# HELP a_total A\n# TYPE a_total counter\na_total 3\n\n# TYPE b gauge\nb{x=\"1\"} 4\n"
+        merged = merge_metrics([(0, shard0), (1, shard1)]).splitlines()
+        self.assertEqual(merged, [
+            "# HELP a_total A",
+            "# TYPE a_total counter",
+            'a_total{shard="0"} 1',
+            'a_total{shard="1"} 3',
+            "# TYPE b gauge",
+            'b{shard="0",x="1"} 2',
+            'b{shard="1",x="1"} 4',
+        ])
+
+    def test_samples_without_metadata(self):
+        self.assertEqual(merge_metrics([(2, "up 1\n")]), 'up{shard="2"} 1\n')
+
+class TestWorkerSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.sup = WorkerSupervisor("worker.py", ["--topic", "x"], 2, metrics_port=9000, drain_timeout=5)
+
+    def test_shard_commands(self):
+        cmd = self.sup.shards[1].command
+        self.assertEqual(cmd[1:4], ["worker.py", "--topic", "x"])
+        self.assertEqual(cmd[cmd.index('--shard-index') + 1], "1")
+        self.assertEqual(cmd[cmd.index('--shard-count') + 1], "2")
+        self.assertEqual(cmd[cmd.index('--metrics-port') + 1], "9002")
+
+    @unittest.skipIf(sys.platform == 'win32', "POSIX process groups")
+    def test_shard_runs_in_own_process_group(self):
+        shard = ShardProcess(0, [sys.executable, "-c", "import time; time.sleep(30)"], 0)
+        shard.start()
+        try:
+            self.assertNotEqual(os.getpgid(shard.proc.pid), os.getpgid(0))
+        finally:
+            shard.proc.kill()
+            shard.proc.wait()
+
+    @unittest.skipIf(sys.platform == 'win32', "SIGTERM is not forwarded on Windows")
+    def test_stop_forwards_one_sigterm_then_kills(self):
+        for shard in self.sup.shards:
+            shard.proc = fake_shard()
+
+        self.sup._request_stop(signal.SIGINT, None)
+        self.assertTrue(self.sup.stopping)
+        for shard in self.sup.shards:
+            shard.proc.send_signal.assert_called_once_with(signal.SIGTERM)
+            shard.proc.kill.assert_not_called()
+
+        self.sup._request_stop(signal.SIGINT, None)
+        for shard in self.sup.shards:
+            self.assertEqual(shard.proc.send_signal.call_count, 1)
+            shard.proc.kill.assert_called_once()
+
+    def test_crashed_shard_restarts_with_backoff(self):
+        shard = self.sup.shards[0]
+        shard.proc = fake_shard(alive=False, returncode=1)
+        self.sup.shards[1].proc = fake_shard()
+        shard.started_at = 1000.0
+        with patch.object(supervisor.time, 'time', return_value=1010.0):
+            self.sup._check_shard(shard)
+        self.assertEqual(shard.restart_at, 1010.0 + supervisor.RESTART_BASE_DELAY)
+        self.assertEqual(self.sup.health(), (False, "шарды не работают: 0"))
+
+        with patch.object(shard, 'start') as start, patch.object(supervisor.time, 'time', return_value=shard.restart_at):
+            self.sup._check_shard(shard)
+        start.assert_called_once()
+        self.assertEqual(shard.restarts, 1)
+
+        shard.restart_at = None
+        with patch.object(supervisor.time, 'time', return_value=1020.0):
+            self.sup._check_shard(shard)
+        self.assertEqual(shard.failures_in_row, 2)
+        self.assertEqual(shard.restart_at, 1020.0 + 2 * supervisor.RESTART_BASE_DELAY)
+
+    def test_clean_exit_is_not_restarted(self):
+        shard = self.sup.shards[0]
+        shard.proc = fake_shard(alive=False, returncode=0)
+        self.sup._check_shard(shard)
+        self.assertTrue(shard.finished)
+        self.assertIsNone(shard.restart_at)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import tts_cache
+from tts_cache import TTSCache
+from tts_generator import TTSGenerator, MIN_FILE_SIZE
+
+FMT = "audio-24khz-48kbitrate-mono-mp3"
+
+class TestTTSCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def test_put_and_get(self):
+        cache = TTSCache(self.dir)
+        self.assertIsNone(cache.get("안녕", "v", FMT))
+        cache.put("안녕", "v", FMT, b"audio")
+        self.assertEqual(cache.get("안녕", "v", FMT), b"audio")
+        self.assertIsNone(cache.get("안녕", "other", FMT))
+        s = cache.snapshot()
+        self.assertEqual((s['hits'], s['misses'], s['writes'], s['files']), (1, 2, 1, 1))
+
+    def test_reserve_and_commit(self):
+        cache = TTSCache(self.dir)
+        tmp = cache.reserve("학교", "v", FMT)
+        with open(tmp, 'wb') as f:
+            f.write(b"chunk1chunk2")
+        path = cache.commit("학교", "v", FMT, tmp)
+        self.assertFalse(os.path.exists(tmp))
+        self.assertEqual(cache.lookup("학교", "v", FMT), path)
+        self.assertEqual(cache.snapshot()['bytes'], 12)
+
+    def test_index_survives_restart(self):
+        TTSCache(self.dir).put("사랑", "v", FMT, b"x" * 10)
+        cache = TTSCache(self.dir)
+        self.assertEqual(cache.snapshot()['files'], 1)
+        self.assertEqual(cache.get("사랑", "v", FMT), b"x" * 10)
+
+    def test_evicts_least_recently_used(self):
+        cache = TTSCache(self.dir, max_bytes=25)
+        cache.put("a", "v", FMT, b"1" * 10)
+        cache.put("b", "v", FMT, b"2" * 10)
+        cache.lookup("a", "v", FMT)
+        cache.put("c", "v", FMT, b"3" * 10)
+        self.assertIsNotNone(cache.lookup("a", "v", FMT))
+        self.assertIsNone(cache.lookup("b", "v", FMT))
+        self.assertIsNotNone(cache.lookup("c", "v", FMT))
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(cache.snapshot()['bytes'], 20)
+
+    def test_file_that_cannot_be_removed_stays_accounted(self):
+        # Windows не дает удалить файл, открытый для загрузки
+        cache = TTSCache(self.dir, max_bytes=25)
+        cache.put("a", "v", FMT, b"1" * 10)
+        cache.put("b", "v", FMT, b"2" * 10)
+        with patch("tts_cache.os.remove", side_effect=PermissionError("file is in use")):
+            cache.put("c", "v", FMT, b"3" * 10)
+        self.assertEqual(cache.stats['evictions'], 0)
+        self.assertEqual(cache.snapshot()['bytes'], 30)
+        self.assertEqual(list(cache._entries)[0], cache._path(cache.key("a", "v", FMT)))
+
+        # Файл освободился — следующая очистка его удаляет
+        cache.put("d", "v", FMT, b"4" * 10)
+        self.assertIsNone(cache.lookup("a", "v", FMT))
+        self.assertLessEqual(cache.snapshot()['bytes'], 25)
+
+    def test_lookup_tracks_untracked_file(self):
+        cache = TTSCache(self.dir)
+        cache.put("a", "v", FMT, b"1" * 10)
+        cache._entries.clear()
+        cache._total = 0
+        self.assertIsNotNone(cache.lookup("a", "v", FMT))
+        self.assertEqual(cache.snapshot()['bytes'], 10)
+
+    def test_startup_keeps_fresh_temp_files(self):
+        # Свежий .tmp может дописывать другой процесс; удаляются только брошенные
+        cache = TTSCache(self.dir)
+        fresh = cache.reserve("a", "v", FMT)
+        stale = cache.reserve("b", "v", FMT)
+        for path in (fresh, stale):
+            with open(path, 'wb') as f:
+                f.write(b"partial")
+        old = time.time() - tts_cache.STALE_TMP_AGE - 60
+        os.utime(stale, (old, old))
+        restarted = TTSCache(self.dir)
+        self.assertTrue(os.path.exists(fresh))
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(restarted.snapshot()['files'], 0)
+
+class TestSynthesizeFile(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.cache = TTSCache(self.dir)
+        self.gen = TTSGenerator()
+        self.gen.set_cache(self.cache)
+        self.audio = b"a" * MIN_FILE_SIZE
+
+        async def fake_stream(text, voice, write):
+            write(self.audio)
+            return len(self.audio)
+        patcher = patch.object(self.gen, '_stream', side_effect=fake_stream)
+        self.stream = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def temp_files(self):
+        return [name for _, _, files in os.walk(self.dir) for name in files if name.endswith('.tmp')]
+
+    async def test_synthesizes_into_cache_once(self):
+        path = await self.gen.generate_audio_file("안녕", "v")
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.audio)
+        self.assertEqual(await self.gen.generate_audio_file("안녕", "v"), path)
+        self.assertEqual(self.stream.call_count, 1)
+
+    async def test_cache_failure_returns_audio_from_memory(self):
+        with patch("tts_cache.os.replace", side_effect=OSError("disk full")):
+            result = await self.gen.generate_audio_file("안녕", "v")
+        self.assertEqual(result, self.audio)
+        self.assertEqual(self.temp_files(), [])
+        self.assertEqual(self.cache.snapshot()['files'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import random
+import asyncio
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+import tts_generator
+from tts_generator import TTSGenerator, MIN_FILE_SIZE
+
+class TestDialogue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gen = TTSGenerator()
+        self.active = 0
+        self.peak = 0
+        self.finished = []
+
+    async def fake_line(self, text, voice):
+        # Реплики завершаются в случайном порядке
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(random.uniform(0, 0.02))
+            self.finished.append(text)
+            return f"[{voice[-6:]}:{text}]".encode('utf-8').ljust(MIN_FILE_SIZE // 4, b'.')
+        finally:
+            self.active -= 1
+
+    async def test_lines_joined_in_input_order_with_bounded_concurrency(self):
+        lines = [f"가: 줄{i}" if i % 2 == 0 else f"나: 줄{i}" for i in range(12)]
+        random.seed(7)
+        with patch.object(self.gen, 'generate_audio', side_effect=self.fake_line), \
+             patch.object(tts_generator, 'DIALOGUE_LINE_CONCURRENCY', 3):
+            data = await self.gen.generate_dialogue("\n".join(lines))
+
+        expected = [
+            f"[{(self.gen.voice_female if i % 2 == 0 else self.gen.voice_male)[-6:]}:줄{i}]".encode('utf-8')
+            for i in range(12)
+        ]
+        positions = [data.index(part) for part in expected]
+        self.assertEqual(positions, sorted(positions))
+        self.assertNotEqual(self.finished, [f"줄{i}" for i in range(12)])
+        self.assertEqual(self.peak, 3)
+
+    async def test_failed_line_is_skipped(self):
+        async def flaky(text, voice):
+            return None if text == "둘" else await self.fake_line(text, voice)
+
+        with patch.object(self.gen, 'generate_audio', side_effect=flaky):
+            data = await self.gen.generate_dialogue("A: 하나\nB: 둘\nA: 셋\nB: 넷\nA: 다섯")
+        self.assertNotIn("둘".encode('utf-8'), data)
+        self.assertLess(data.index("하나".encode('utf-8')), data.index("셋".encode('utf-8')))
+
+    async def test_too_short_dialogue_returns_none(self):
+        async def tiny(text, voice):
+            return b"x"
+
+        with patch.object(self.gen, 'generate_audio', side_effect=tiny):
+            self.assertIsNone(await self.gen.generate_dialogue("A: 하나\nB: 둘"))
+
+if __name__ == '__main__':
+    unittest.main()
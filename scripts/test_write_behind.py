@@ -0,0 +1,140 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+from local_supabase import LocalStore, AsyncLocalClient
+import write_behind
+from write_behind import WriteBehindBuffer
+
+class TestWriteBehindBuffer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.store = LocalStore()
+        self.db = AsyncLocalClient(self.store)
+        self.store.insert_rows('vocabulary', [{'id': i, 'word_kr': f"단어{i}"} for i in range(1, 6)])
+
+    def vocabulary(self):
+        res = self.store.run_query(self.db.table('vocabulary').select('*'))
+        return {r['id']: r for r in res.data}
+
+    async def test_batch_is_written_in_one_round_trip(self):
+        buf = WriteBehindBuffer(self.db, max_rows=3)
+        await buf.add(1, {'audio_url': 'a1'})
+        await buf.add(2, {'audio_url': 'a2'})
+        self.assertEqual(buf.stats['round_trips'], 0)
+
+        await buf.add(3, {'image': 'i3', 'image_source': 'pixabay'})
+
+        self.assertEqual(buf.stats['round_trips'], 1)
+        self.assertEqual(buf.pending, {})
+        rows = self.vocabulary()
+        self.assertEqual(rows[1]['audio_url'], 'a1')
+        self.assertEqual(rows[3]['image'], 'i3')
+
+    async def test_updates_for_one_row_are_merged(self):
+        buf = WriteBehindBuffer(self.db)
+        await buf.add(1, {'audio_url': 'a1'})
+        await buf.add(1, {'audio_male': 'm1'})
+        await buf.flush()
+
+        row = self.vocabulary()[1]
+        self.assertEqual((row['audio_url'], row['audio_male']), ('a1', 'm1'))
+        self.assertEqual(buf.stats['rows'], 1)
+
+    async def test_missing_rpc_falls_back_to_single_rows(self):
+        buf = WriteBehindBuffer(self.db)
+        buf.use_rpc = False
+        await buf.add(1, {'audio_url': 'a1'})
+        await buf.add(2, {'audio_url': 'a2'})
+        await buf.flush()
+
+        self.assertEqual(buf.stats['fallback_rows'], 2)
+        self.assertEqual(self.vocabulary()[2]['audio_url'], 'a2')
+
+    async def test_on_written_fires_after_flush(self):
+        written = []
+        buf = WriteBehindBuffer(self.db)
+        await buf.add(1, {'audio_url': 'a1'}, on_written=written.append)
+        self.assertEqual(written, [])
+
+        await buf.flush()
+        self.assertEqual(written, [1])
+
+    async def test_network_error_requeues_rows_and_callbacks(self):
+        written = []
+        buf = WriteBehindBuffer(self.db)
+        await buf.add(1, {'audio_url': 'a1'}, on_written=written.append)
+
+        with patch.object(write_behind, 'execute_supabase_query', side_effect=ConnectionError("connection reset")):
+            await buf.flush()
+
+        self.assertEqual(written, [])
+        self.assertEqual(buf.pending, {1: {'audio_url': 'a1'}})
+
+        await buf.flush()
+        self.assertEqual(written, [1])
+        self.assertEqual(self.vocabulary()[1]['audio_url'], 'a1')
+
+    async def test_requeue_keeps_newer_updates(self):
+        buf = WriteBehindBuffer(self.db)
+        await buf.add(1, {'audio_url': 'old', 'image': 'i1'})
+
+        async def fail_after_new_update(builder):
+            # Пока пакет пишется, для той же строки приходит более свежая ссылка
+            await buf.add(1, {'audio_url': 'new'})
+            raise ConnectionError("connection reset")
+
+        with patch.object(write_behind, 'execute_supabase_query', side_effect=fail_after_new_update):
+            await buf.flush()
+
+        self.assertEqual(buf.pending, {1: {'audio_url': 'new', 'image': 'i1'}})
+
+    async def test_failed_row_goes_to_on_failure(self):
+        failures = []
+
+        async def on_failure(row_id, error):
+            failures.append(row_id)
+
+        written = []
+        buf = WriteBehindBuffer(self.db, on_failure=on_failure)
+        buf.use_rpc = False
+        await buf.add(1, {'audio_url': 'a1'}, on_written=written.append)
+        with patch.object(write_behind, 'execute_supabase_query', side_effect=ValueError("violates check constraint")):
+            await buf.flush()
+
+        self.assertEqual(failures, [1])
+        self.assertEqual(buf.stats['failed_rows'], 1)
+        # Строка передана в журнал ошибок — курсор может идти дальше
+        self.assertEqual(written, [1])
+
+    async def test_on_flushed_gets_only_written_rows(self):
+        flushed = []
+
+        async def on_flushed(row_ids):
+            flushed.append(sorted(row_ids))
+
+        buf = WriteBehindBuffer(self.db, on_flushed=on_flushed)
+        buf.use_rpc = False
+        await buf.add(1, {'audio_url': 'a1'})
+        await buf.add(2, {'audio_url': 'a2'})
+        real_execute = write_behind.execute_supabase_query
+
+        async def fail_row_2(builder):
+            if 2 in builder.params:
+                raise ValueError("violates check constraint")
+            return await real_execute(builder)
+
+        with patch.object(write_behind, 'execute_supabase_query', side_effect=fail_row_2):
+            await buf.flush()
+        self.assertEqual(flushed, [[1]])
+
+        with patch.object(write_behind, 'execute_supabase_query', side_effect=ConnectionError("connection reset")):
+            buf.use_rpc = True
+            await buf.add(3, {'audio_url': 'a3'})
+            await buf.flush()
+        self.assertEqual(flushed, [[1]])
+
+if __name__ == '__main__':
+    unittest.main()
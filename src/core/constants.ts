@@ -70,6 +70,7 @@ export const DB_BUCKETS = {
 // Статусы заявок на слова
 export const WORD_REQUEST_STATUS = {
   PENDING: "pending",
+  PROCESSING: "processing",
   AI: "ai",
   AUDIO: "audio",
   DONE: "done",
@@ -22,7 +22,7 @@ export interface Session {
 export interface WordRequestState {
   id: string | number;
   word: string;
-  status: "pending" | "ai" | "audio" | "done" | "error";
+  status: "pending" | "processing" | "ai" | "audio" | "done" | "error";
   error?: string;
   timestamp: number;
   targetListId?: string;
@@ -23,7 +23,7 @@ let observer: MutationObserver | null = null;
 const requestProgress = new Map<
   string | number,
   {
-    status: "pending" | "ai" | "audio" | "done" | "error";
+    status: "pending" | "processing" | "ai" | "audio" | "done" | "error";
     word: string;
     error?: string;
     justFinished?: boolean;
@@ -343,12 +343,15 @@ async function restorePendingRequests() {
   const user = state.currentUser;
   if (!user) return;
 
-  // Ищем заявки, которые еще не обработаны (pending)
+  // Ищем заявки, которые еще не обработаны (pending) или уже захвачены воркером (processing)
   const { data, error } = await client
     .from(DB_TABLES.WORD_REQUESTS)
     .select("*")
     .eq("user_id", user.id)
-    .eq("status", "pending");
+    .in("status", [
+      WORD_REQUEST_STATUS.PENDING,
+      WORD_REQUEST_STATUS.PROCESSING,
+    ]);
 
   if (!error && data && data.length > 0) {
     const formView = document.getElementById("add-word-form-view");
@@ -377,12 +380,16 @@ async function restorePendingRequests() {
         (row: {
           id: string | number;
           word_kr: string;
+          status: string;
           created_at: string;
           my_notes?: string;
         }) => ({
           id: row.id,
           word: row.word_kr,
-          status: "pending",
+          status:
+            row.status === WORD_REQUEST_STATUS.PROCESSING
+              ? "processing"
+              : "pending",
           timestamp: new Date(row.created_at).getTime(),
           error: row.my_notes,
         }),
@@ -692,7 +699,10 @@ function trackProgress(
   requestProgress.clear();
   requests.forEach((req) => {
     // Если статус уже есть (например, при восстановлении), используем его, иначе pending
-    const initialStatus = req.status === "error" ? "error" : "pending";
+    const initialStatus =
+      req.status === "error" || req.status === "processing"
+        ? req.status
+        : "pending";
     requestProgress.set(req.id, {
       status: initialStatus,
       word: req.word,
@@ -710,7 +720,11 @@ function trackProgress(
         let cssClass = "status-pending";
         let extraAttrs = "";
 
-        if (item.status === "ai") {
+        if (item.status === "processing") {
+          icon = "⚙️";
+          text = "В обработке...";
+          cssClass = "status-processing";
+        } else if (item.status === "ai") {
           icon = "🤖";
           text = "AI генерирует контент...";
           cssClass = "status-processing";
@@ -1018,6 +1032,7 @@ function trackProgress(
               if (newStatus !== progress.status) {
                 progress.status = newStatus as
                   | "pending"
+                  | "processing"
                   | "ai"
                   | "audio"
                   | "done"